@@ -4,3 +4,8 @@ from app.exceptions import BaseError
 class AuthenticationFailed(BaseError):
     def __init__(self):
         super().__init__(status_code=401, message="Authentication Failed!")
+
+
+class PasswordHasherBusy(BaseError):
+    def __init__(self):
+        super().__init__(status_code=429, message="Too Many Password Checks, Try Again Later!")
@@ -0,0 +1,87 @@
+import asyncio
+from app.auth.exceptions import PasswordHasherBusy
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError
+from argon2.low_level import ARGON2_VERSION
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Request
+
+
+class PasswordHasherPool:
+    """
+    Argon2 hashing and verification on a dedicated thread pool, off the event loop.
+    argon2-cffi releases the GIL while hashing, so max_workers hashes run in parallel.
+    At most max_queue calls wait for a free thread, further calls raise PasswordHasherBusy.
+
+    Hashes made with other parameters still verify and are upgraded on sign-in,
+    stats counts verifications, outdated hashes met and hashes upgraded.
+    """
+
+    def __init__(self, hasher: PasswordHasher, max_workers: int, max_queue: int):
+        self.hasher = hasher
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="argon2")
+        self.max_pending = max_workers + max_queue
+        self.pending = 0
+        self.stats = {"verified": 0, "outdated": 0, "rehashed": 0}
+
+    @property
+    def prefix(self) -> str:
+        """
+        Leading part shared by every hash made with the current parameters
+        """
+        hasher = self.hasher
+        return (
+            f"$argon2{hasher.type.name.lower()}$v={ARGON2_VERSION}"
+            f"$m={hasher.memory_cost},t={hasher.time_cost},p={hasher.parallelism}$"
+        )
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise PasswordHasherBusy()
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(self.hasher.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        try:
+            verified = await self.run(self.hasher.verify, hashed_password, password)
+        except VerifyMismatchError:
+            return False
+
+        self.stats["verified"] += 1
+        return verified
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        outdated = self.hasher.check_needs_rehash(hashed_password)
+        self.stats["outdated"] += int(outdated)
+        return outdated
+
+    def record_rehash(self):
+        self.stats["rehashed"] += 1
+
+
+def set_password_hasher(app: FastAPI):
+    settings = app.state.settings
+    app.state.password_hasher = PasswordHasherPool(
+        hasher=PasswordHasher(
+            time_cost=settings.ARGON2_TIME_COST,
+            memory_cost=settings.ARGON2_MEMORY_COST_KIB,
+            parallelism=settings.ARGON2_PARALLELISM,
+        ),
+        max_workers=settings.ARGON2_WORKERS,
+        max_queue=settings.ARGON2_MAX_QUEUE,
+    )
+
+
+def get_password_hasher(request: Request) -> PasswordHasherPool:
+    return request.app.state.password_hasher
+
+
+def close_password_hasher(password_hasher: PasswordHasherPool):
+    password_hasher.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,25 +1,27 @@
 from app.auth.exceptions import AuthenticationFailed
-from app.auth.models import SignInCredentials, SignInResponse, TokenIn, TokenOut
-from app.auth.services import (
-    create_access_token,
-    create_refresh_token,
-    hash_password,
-    verify_refresh_token,
+from app.auth.hasher import PasswordHasherPool, get_password_hasher
+from app.auth.models import SignInCredentials, SignInResponse, TokenIn
+from app.auth.services import RefreshTokenStore, create_access_token, get_refresh_token_store
+from app.auth.verifier import TokenVerifier, get_jwt_signing_key, get_token_verifier
+from app.db.core import get_db, get_db_read
+from app.db.services import get_constraint_name
+from app.settings import (
+    get_jwt_algorithm,
+    get_jwt_key_id,
+    get_jwt_ttl_sec,
+    get_refresh_token_max_sessions,
+    get_refresh_token_ttl_sec,
 )
-from app.db.core import get_db
-from app.redis import get_redis
-from app.settings import get_jwt_algorithm, get_jwt_key, get_jwt_ttl_sec, get_refresh_token_ttl_sec
-from app.user.exceptions import DisplayNameAlreadyExist, EmailAlreadyExist, UsernameAlreadyExist
+from app.user.exceptions import UNIQUE_CONSTRAINT_ERRORS
 from app.user.models import UserCreate
 from app.user.services import (
+    count_outdated_password_hashes,
     create_user,
-    display_name_exists,
-    email_exists,
     get_user_id_by_credentials,
-    username_exists,
 )
-from fastapi import APIRouter, Depends
-from redis.asyncio import Redis
+from fastapi import APIRouter, Depends, Response
+from jwt.algorithms import AllowedPrivateKeys
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 auth_router = APIRouter(prefix="/auth", tags=["Auth"])
@@ -29,36 +31,45 @@ auth_router = APIRouter(prefix="/auth", tags=["Auth"])
 async def sign_up_route(
     user_data: UserCreate,
     db: AsyncSession = Depends(get_db),
-    jwt_key: str = Depends(get_jwt_key),
+    password_hasher: PasswordHasherPool = Depends(get_password_hasher),
+    jwt_key: bytes | AllowedPrivateKeys = Depends(get_jwt_signing_key),
     jwt_algorithm: str = Depends(get_jwt_algorithm),
+    jwt_key_id: str = Depends(get_jwt_key_id),
     jwt_ttl_sec: int = Depends(get_jwt_ttl_sec),
     refresh_token_ttl_sec: int = Depends(get_refresh_token_ttl_sec),
-    redis: Redis = Depends(get_redis),
+    refresh_token_max_sessions: int = Depends(get_refresh_token_max_sessions),
+    refresh_token_store: RefreshTokenStore = Depends(get_refresh_token_store),
 ):
-    if await username_exists(username=user_data.username, db=db):
-        raise UsernameAlreadyExist()
-
-    if await email_exists(email=user_data.email, db=db):
-        raise EmailAlreadyExist()
-
-    if await display_name_exists(display_name=user_data.display_name, db=db):
-        raise DisplayNameAlreadyExist
-
-    user = await create_user(
-        username=user_data.username,
-        password=hash_password(user_data.password),
-        email=user_data.email,
-        display_name=user_data.display_name,
-        avatar=user_data.avatar,
-        db=db,
-    )
+    # duplicates are detected by the unique constraints, no existence checks beforehand
+    try:
+        user = await create_user(
+            username=user_data.username,
+            password=await password_hasher.hash(user_data.password),
+            email=user_data.email,
+            display_name=user_data.display_name,
+            avatar=user_data.avatar,
+            db=db,
+        )
+    except IntegrityError as e:
+        error = UNIQUE_CONSTRAINT_ERRORS.get(get_constraint_name(e))
+
+        if error is None:
+            raise
+
+        raise error()
 
     access_token, access_exp = create_access_token(
-        sub=str(user.id), jwt_key=jwt_key, jwt_algorithm=jwt_algorithm, jwt_ttl_sec=jwt_ttl_sec
+        sub=str(user.id),
+        jwt_key=jwt_key,
+        jwt_algorithm=jwt_algorithm,
+        jwt_ttl_sec=jwt_ttl_sec,
+        jwt_key_id=jwt_key_id,
     )
 
-    refresh_token, refresh_exp = await create_refresh_token(
-        redis=redis, user_id=user.id, refresh_token_ttl_sec=refresh_token_ttl_sec
+    refresh_token, refresh_exp = await refresh_token_store.create(
+        user_id=user.id,
+        refresh_token_ttl_sec=refresh_token_ttl_sec,
+        refresh_token_max_sessions=refresh_token_max_sessions,
     )
     return {
         "access_token": {"token": access_token, "exp": access_exp},
@@ -70,25 +81,37 @@ async def sign_up_route(
 async def sign_in_route(
     credentials: SignInCredentials,
     db: AsyncSession = Depends(get_db),
-    jwt_key: str = Depends(get_jwt_key),
+    password_hasher: PasswordHasherPool = Depends(get_password_hasher),
+    jwt_key: bytes | AllowedPrivateKeys = Depends(get_jwt_signing_key),
     jwt_algorithm: str = Depends(get_jwt_algorithm),
+    jwt_key_id: str = Depends(get_jwt_key_id),
     jwt_ttl_sec: int = Depends(get_jwt_ttl_sec),
     refresh_token_ttl_sec: int = Depends(get_refresh_token_ttl_sec),
-    redis: Redis = Depends(get_redis),
+    refresh_token_max_sessions: int = Depends(get_refresh_token_max_sessions),
+    refresh_token_store: RefreshTokenStore = Depends(get_refresh_token_store),
 ):
     user_id = await get_user_id_by_credentials(
-        username=credentials.username, password=credentials.password, db=db
+        username=credentials.username,
+        password=credentials.password,
+        password_hasher=password_hasher,
+        db=db,
     )
 
     if not user_id:
         raise AuthenticationFailed()
 
     access_token, access_exp = create_access_token(
-        sub=str(user_id), jwt_key=jwt_key, jwt_algorithm=jwt_algorithm, jwt_ttl_sec=jwt_ttl_sec
+        sub=str(user_id),
+        jwt_key=jwt_key,
+        jwt_algorithm=jwt_algorithm,
+        jwt_ttl_sec=jwt_ttl_sec,
+        jwt_key_id=jwt_key_id,
     )
 
-    refresh_token, refresh_exp = await create_refresh_token(
-        redis=redis, user_id=user_id, refresh_token_ttl_sec=refresh_token_ttl_sec
+    refresh_token, refresh_exp = await refresh_token_store.create(
+        user_id=user_id,
+        refresh_token_ttl_sec=refresh_token_ttl_sec,
+        refresh_token_max_sessions=refresh_token_max_sessions,
     )
     return {
         "access_token": {"token": access_token, "exp": access_exp},
@@ -97,33 +120,60 @@ async def sign_in_route(
 
 
 @auth_router.post(path="/sign-out", status_code=200, response_model=None)
-async def sign_out_route(token: TokenIn, redis: Redis = Depends(get_redis)):
-    deleted = await redis.delete(token.token)
-
-    if not deleted:
+async def sign_out_route(
+    token: TokenIn, refresh_token_store: RefreshTokenStore = Depends(get_refresh_token_store)
+):
+    if not await refresh_token_store.revoke(refresh_token=token.token):
         raise AuthenticationFailed()
 
 
-@auth_router.post(path="/refresh", status_code=200, response_model=TokenOut)
+@auth_router.post(path="/refresh", status_code=200, response_model=SignInResponse)
 async def refresh_access_token_route(
     token: TokenIn,
-    jwt_key: str = Depends(get_jwt_key),
+    jwt_key: bytes | AllowedPrivateKeys = Depends(get_jwt_signing_key),
     jwt_algorithm: str = Depends(get_jwt_algorithm),
+    jwt_key_id: str = Depends(get_jwt_key_id),
     jwt_ttl_sec: int = Depends(get_jwt_ttl_sec),
-    redis: Redis = Depends(get_redis),
+    refresh_token_ttl_sec: int = Depends(get_refresh_token_ttl_sec),
+    refresh_token_store: RefreshTokenStore = Depends(get_refresh_token_store),
 ):
-    user_id = await verify_refresh_token(refresh_token=token.token, redis=redis)
+    # the refresh token is single use: a new one is returned with every access token
+    result = await refresh_token_store.rotate(
+        refresh_token=token.token, refresh_token_ttl_sec=refresh_token_ttl_sec
+    )
 
-    if not user_id:
+    if result is None:
         raise AuthenticationFailed()
 
-    access_token, exp = create_access_token(
-        sub=str(user_id), jwt_key=jwt_key, jwt_algorithm=jwt_algorithm, jwt_ttl_sec=jwt_ttl_sec
+    user_id, refresh_token, refresh_exp = result
+    access_token, access_exp = create_access_token(
+        sub=str(user_id),
+        jwt_key=jwt_key,
+        jwt_algorithm=jwt_algorithm,
+        jwt_ttl_sec=jwt_ttl_sec,
+        jwt_key_id=jwt_key_id,
     )
 
-    return {"token": access_token, "exp": exp}
+    return {
+        "access_token": {"token": access_token, "exp": access_exp},
+        "refresh_token": {"token": refresh_token, "exp": refresh_exp},
+    }
+
 
+@auth_router.get(path="/jwks", status_code=200)
+async def get_jwks_route(
+    response: Response, token_verifier: TokenVerifier = Depends(get_token_verifier)
+):
+    # public keys of the accepted asymmetric signing keys, for gateways verifying tokens locally
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return token_verifier.jwks
 
-@auth_router.delete(path="/redis", status_code=200, response_model=None)
-async def reset_redis_route(redis: Redis = Depends(get_redis)):
-    await redis.flushdb()
+
+@auth_router.get(path="/password-hashes", status_code=200)
+async def get_password_hash_stats_route(
+    db: AsyncSession = Depends(get_db_read),
+    password_hasher: PasswordHasherPool = Depends(get_password_hasher),
+):
+    # outdated_users is global, the other counters are per worker process
+    outdated_users = await count_outdated_password_hashes(hash_prefix=password_hasher.prefix, db=db)
+    return {"outdated_users": outdated_users, **password_hasher.stats}
@@ -1,65 +1,225 @@
 import jwt
+import secrets
 import time
 import uuid
 from app.auth.exceptions import AuthenticationFailed
-from app.settings import get_jwt_algorithm, get_jwt_key
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
-from fastapi import Depends
+from app.auth.verifier import TokenVerifier, get_token_verifier
+from fastapi import Depends, FastAPI, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jwt.algorithms import AllowedPrivateKeys
 from redis.asyncio import Redis
 
-ph = PasswordHasher()
+# Refresh tokens are "{user_id}.{family}.{secret}". Each user has one hash,
+# refresh_token:{user_id} = {family: "{exp_ms}:{secret}"}, holding the current secret
+# of every session (token family), so all sessions of a user are revoked with one DEL.
+
+# KEYS[1] = user's hash, ARGV = family, secret, ttl_ms, max_families
+# drops expired families, then the ones expiring first beyond max_families
+# returns exp_ms
+ISSUE_REFRESH_TOKEN_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local exp = now + tonumber(ARGV[3])
+redis.call('HSET', KEYS[1], ARGV[1], exp .. ':' .. ARGV[2])
+
+local families = {}
+local fields = redis.call('HGETALL', KEYS[1])
+for i = 1, #fields, 2 do
+    local family_exp = tonumber(string.match(fields[i + 1], '^(%d+):'))
+    if family_exp <= now then
+        redis.call('HDEL', KEYS[1], fields[i])
+    else
+        table.insert(families, {family_exp, fields[i]})
+    end
+end
+
+table.sort(families, function(a, b) return a[1] < b[1] end)
+for i = 1, #families - tonumber(ARGV[4]) do
+    redis.call('HDEL', KEYS[1], families[i][2])
+end
+
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return exp
+"""
+
+# KEYS[1] = user's hash, ARGV = family, presented secret, new secret, ttl_ms
+# returns new exp_ms, 0 for unknown or expired families,
+# -1 when a secret that was already rotated is presented again (the family is revoked)
+ROTATE_REFRESH_TOKEN_SCRIPT = """
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+if not value then
+    return 0
+end
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local exp, secret = string.match(value, '^(%d+):(.*)$')
+
+if tonumber(exp) <= now then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return 0
+end
+
+if secret ~= ARGV[2] then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return -1
+end
+
+local new_exp = now + tonumber(ARGV[4])
+redis.call('HSET', KEYS[1], ARGV[1], new_exp .. ':' .. ARGV[3])
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return new_exp
+"""
+
+# KEYS[1] = user's hash, ARGV = family, presented secret
+# returns 1 if the family was removed, 0 for unknown families or a secret that is not the current one
+REVOKE_REFRESH_TOKEN_SCRIPT = """
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+if not value or string.match(value, '^%d+:(.*)$') ~= ARGV[2] then
+    return 0
+end
+
+return redis.call('HDEL', KEYS[1], ARGV[1])
+"""
 
 
 def create_access_token(
-    sub: str, jwt_key: str, jwt_algorithm: str, jwt_ttl_sec: int
+    sub: str,
+    jwt_key: bytes | AllowedPrivateKeys,
+    jwt_algorithm: str,
+    jwt_ttl_sec: int,
+    jwt_key_id: str = "",
 ) -> tuple[str, int]:
     exp = int(time.time()) + jwt_ttl_sec #  expiration time in second
     payload = {"sub": sub, "exp": exp}
-    access_token = jwt.encode(payload=payload, key=jwt_key, algorithm=jwt_algorithm)
+    headers = {"kid": jwt_key_id} if jwt_key_id else None  # lets verifiers pick the key
+    access_token = jwt.encode(
+        payload=payload, key=jwt_key, algorithm=jwt_algorithm, headers=headers
+    )
     return access_token, exp
 
 
-async def create_refresh_token(
-    redis: Redis, user_id: int, refresh_token_ttl_sec: int
-) -> tuple[str, int]:
-    refresh_token = str(uuid.uuid4())   
-    await redis.set(name=refresh_token, value=user_id, ex=refresh_token_ttl_sec)    # store refresh token in redis
-    exp = int(time.time()) + refresh_token_ttl_sec
-    return refresh_token, exp
+def parse_refresh_token(refresh_token: str) -> tuple[int, str, str] | None:
+    """
+    output: (user_id, family, secret) | None
+    """
+    parts = refresh_token.split(".")
+
+    if len(parts) != 3 or not parts[0].isdigit():
+        return None
+
+    return int(parts[0]), parts[1], parts[2]
+
+
+class RefreshTokenStore:
+    """
+    Refresh token families of every user, changed only through the scripts below so a
+    token is never issued, rotated and revoked at the same time.
+    """
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self.issue_script = redis.register_script(ISSUE_REFRESH_TOKEN_SCRIPT)
+        self.rotate_script = redis.register_script(ROTATE_REFRESH_TOKEN_SCRIPT)
+        self.revoke_script = redis.register_script(REVOKE_REFRESH_TOKEN_SCRIPT)
+
+    async def create(
+        self, user_id: int, refresh_token_ttl_sec: int, refresh_token_max_sessions: int
+    ) -> tuple[str, int]:
+        """
+        Starts a new token family (session) for the user.
+        output: (refresh token, exp)
+        """
+        family, secret = uuid.uuid4().hex, secrets.token_urlsafe(32)
+        exp_ms = await self.issue_script(
+            keys=[f"refresh_token:{user_id}"],
+            args=[family, secret, refresh_token_ttl_sec * 1000, refresh_token_max_sessions],
+        )
+        return f"{user_id}.{family}.{secret}", exp_ms // 1000
+
+    async def rotate(
+        self, refresh_token: str, refresh_token_ttl_sec: int
+    ) -> tuple[int, str, int] | None:
+        """
+        output: (user_id, new refresh token, exp) | None if the token is invalid, expired or
+        reused
+        """
+        parsed = parse_refresh_token(refresh_token)
+
+        if parsed is None:
+            return None
+
+        user_id, family, secret = parsed
+        new_secret = secrets.token_urlsafe(32)
+        exp_ms = await self.rotate_script(
+            keys=[f"refresh_token:{user_id}"],
+            args=[family, secret, new_secret, refresh_token_ttl_sec * 1000],
+        )
+
+        if exp_ms <= 0:
+            return None
+
+        return user_id, f"{user_id}.{family}.{new_secret}", exp_ms // 1000
+
+    async def revoke(self, refresh_token: str) -> bool:
+        """
+        Ends the session of the token.
+        output: False if the token is invalid or not the current one of its family
+        """
+        parsed = parse_refresh_token(refresh_token)
+
+        if parsed is None:
+            return False
+
+        user_id, family, secret = parsed
+        revoked = await self.revoke_script(keys=[f"refresh_token:{user_id}"], args=[family, secret])
+        return revoked == 1
+
+    async def revoke_all(self, user_id: int):
+        """
+        Signs the user out of every session.
+        """
+        await self.redis.delete(f"refresh_token:{user_id}")
+
+
+def set_refresh_token_store(app: FastAPI):
+    app.state.refresh_token_store = RefreshTokenStore(
+        redis=app.state.keyspaces["refresh_token"].redis
+    )
+
+
+def get_refresh_token_store(request: Request) -> RefreshTokenStore:
+    return request.app.state.refresh_token_store
 
 
 def verify_access_token(
     credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False)),
-    jwt_key: str = Depends(get_jwt_key),
-    jwt_algorithm: str = Depends(get_jwt_algorithm),
+    token_verifier: TokenVerifier = Depends(get_token_verifier),
 ) -> dict:
-    try:
-        access_token = credentials.credentials
-        payload = jwt.decode(jwt=access_token, key=jwt_key, algorithms=[jwt_algorithm])
-        return payload
-    except Exception:
+    if credentials is None:
         raise AuthenticationFailed()
 
+    payload = token_verifier.verify(credentials.credentials)
+
+    if payload is None:
+        raise AuthenticationFailed()
 
-async def verify_refresh_token(refresh_token: str, redis: Redis) -> int | None:
-    user_id = await redis.get(name=refresh_token)
-    return int(user_id) if user_id else None
+    return payload
 
 
 def get_current_user_id(payload: dict = Depends(verify_access_token)) -> int:
     return int(payload["sub"])
 
 
-def hash_password(password: str) -> str:
-    hashed_password = ph.hash(password=password)
-    return hashed_password
+def get_optional_user_id(request: Request) -> int | None:
+    """
+    User id of a valid bearer token, None for anonymous requests or invalid tokens.
+    Used outside the route dependencies (middlewares, db routing).
+    """
+    authorization = request.headers.get("authorization")
 
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
 
-def verify_hashed_password(password: str, hashed_password: str) -> bool:
-    try:
-        ph.verify(hash=hashed_password, password=password)
-        return True
-    except VerifyMismatchError:
-        return False
+    payload = request.app.state.token_verifier.verify(authorization[7:])
+    return int(payload["sub"]) if payload else None
@@ -0,0 +1,105 @@
+import hashlib
+import jwt
+import time
+from collections import OrderedDict
+from fastapi import FastAPI, Request
+from jwt.algorithms import AllowedPrivateKeys
+
+
+def prepare_signing_key(algorithm: str, key: str):
+    # PEM keys are parsed once instead of on every jwt.encode
+    return jwt.get_algorithm_by_name(algorithm).prepare_key(key)
+
+
+def prepare_verification_key(algorithm: str, key: str):
+    prepared_key = jwt.get_algorithm_by_name(algorithm).prepare_key(key)
+    # asymmetric tokens are verified with the public half of a private key
+    return prepared_key.public_key() if hasattr(prepared_key, "public_key") else prepared_key
+
+
+class TokenVerifier:
+    """
+    Access token verification with the keys prepared once at startup.
+    keys maps a kid to (algorithm, key), tokens without a kid header use the "" kid.
+    Several kids are accepted at once while signing keys rotate.
+
+    Payloads of verified tokens are cached by token hash until their exp, so repeated
+    requests with the same token skip the signature check. Tokens that fail verification
+    are never cached.
+    """
+
+    def __init__(self, keys: dict[str, tuple[str, str]], max_entries: int = 10_000):
+        self.keys = {
+            kid: (algorithm, prepare_verification_key(algorithm=algorithm, key=key))
+            for kid, (algorithm, key) in keys.items()
+        }
+        self.max_entries = max_entries
+        self.entries: OrderedDict[bytes, dict] = OrderedDict()
+        self.jwks = {"keys": self.public_jwks()}
+
+    def public_jwks(self) -> list[dict]:
+        jwks = []
+
+        for kid, (algorithm, key) in self.keys.items():
+            # shared secrets (HS*) are never published
+            if isinstance(key, bytes):
+                continue
+
+            jwk = jwt.get_algorithm_by_name(algorithm).to_jwk(key, as_dict=True)
+            jwks.append({**jwk, "kid": kid, "alg": algorithm, "use": "sig"})
+
+        return jwks
+
+    def verify(self, token: str) -> dict | None:
+        """
+        output: payload | None if the token is invalid or expired
+        """
+        token_hash = hashlib.sha256(token.encode()).digest()
+        payload = self.entries.get(token_hash)
+
+        if payload is not None:
+            if payload["exp"] > time.time():
+                self.entries.move_to_end(token_hash)
+                return payload
+
+            del self.entries[token_hash]
+
+        try:
+            kid = jwt.get_unverified_header(token).get("kid", "")
+
+            if not isinstance(kid, str) or kid not in self.keys:
+                return None
+
+            algorithm, key = self.keys[kid]
+            payload = jwt.decode(
+                jwt=token, key=key, algorithms=[algorithm], options={"require": ["exp", "sub"]}
+            )
+        except jwt.InvalidTokenError:
+            return None
+
+        self.entries[token_hash] = payload
+
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        return payload
+
+
+def set_token_verifier(app: FastAPI):
+    settings = app.state.settings
+    keys = {kid: (key["algorithm"], key["key"]) for kid, key in settings.JWT_VERIFY_KEYS.items()}
+    keys[settings.JWT_KEY_ID] = (settings.JWT_ALGORITHM, settings.JWT_KEY)
+    app.state.token_verifier = TokenVerifier(
+        keys=keys, max_entries=settings.TOKEN_CACHE_MAX_ENTRIES
+    )
+    app.state.jwt_signing_key = prepare_signing_key(
+        algorithm=settings.JWT_ALGORITHM, key=settings.JWT_KEY
+    )
+
+
+def get_token_verifier(request: Request) -> TokenVerifier:
+    return request.app.state.token_verifier
+
+
+def get_jwt_signing_key(request: Request) -> bytes | AllowedPrivateKeys:
+    return request.app.state.jwt_signing_key
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from fastapi import FastAPI, Request
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "cache:invalidation"
+
+# message on INVALIDATION_CHANNEL dropping the whole local tier, published when the cache
+# keyspace is purged
+INVALIDATE_ALL = "*"
+
+# session.info key of the entities to invalidate once the session commits
+PENDING_INVALIDATIONS = "cache_invalidations"
+
+# KEYS = entry, invalidated_at pairs, ARGV = ttl_sec, channel, message to publish ("" for none)
+# deletes each entry and stamps it with the redis time of the invalidation (ms)
+INVALIDATE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+for i = 1, #KEYS, 2 do
+    redis.call('DEL', KEYS[i])
+    redis.call('SET', KEYS[i + 1], now, 'EX', ARGV[1])
+end
+
+if ARGV[3] ~= '' then
+    redis.call('PUBLISH', ARGV[2], ARGV[3])
+end
+"""
+
+# KEYS[1] = entry, KEYS[2] = invalidated_at, ARGV = content, ttl_sec, invalidated_at read on
+# the miss ("" when none), grace_ms
+# a fill whose read started before the last invalidation, or within grace_ms after it, is
+# dropped, returns 1 when stored
+FILL_SCRIPT = """
+local invalidated_at = redis.call('GET', KEYS[2]) or ''
+
+if invalidated_at ~= ARGV[3] then
+    return 0
+end
+
+if invalidated_at ~= '' then
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+    if now - tonumber(invalidated_at) < tonumber(ARGV[4]) then
+        return 0
+    end
+end
+
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+
+class LocalCache:
+    """
+    Per-process LRU/TTL tier in front of Redis.
+    Each namespace has its own budget: {"max_entries": int, "max_bytes": int}.
+    Namespaces without a budget are never stored locally.
+    """
+
+    def __init__(self, ttl_sec: int, budgets: dict[str, dict[str, int]]):
+        self.ttl_sec = ttl_sec
+        self.budgets = budgets
+        self.entries: dict[str, OrderedDict[int, tuple[float, str]]] = {
+            namespace: OrderedDict() for namespace in budgets
+        }
+        self.sizes: dict[str, int] = {namespace: 0 for namespace in budgets}
+
+    def get(self, namespace: str, entity_id: int) -> str | None:
+        entries = self.entries.get(namespace)
+
+        if entries is None or entity_id not in entries:
+            return None
+
+        expires_at, content = entries[entity_id]
+
+        if expires_at < time.monotonic():
+            self.discard(namespace=namespace, entity_id=entity_id)
+            return None
+
+        entries.move_to_end(entity_id)
+        return content
+
+    def set(self, namespace: str, entity_id: int, content: str):
+        budget = self.budgets.get(namespace)
+
+        if budget is None or len(content) > budget["max_bytes"]:
+            return
+
+        self.discard(namespace=namespace, entity_id=entity_id)
+
+        entries = self.entries[namespace]
+        entries[entity_id] = (time.monotonic() + self.ttl_sec, content)
+        self.sizes[namespace] += len(content)
+
+        # evict least recently used entries until the namespace fits its budget again
+        while len(entries) > budget["max_entries"] or self.sizes[namespace] > budget["max_bytes"]:
+            _, (_, evicted) = entries.popitem(last=False)
+            self.sizes[namespace] -= len(evicted)
+
+    def discard(self, namespace: str, entity_id: int):
+        entries = self.entries.get(namespace)
+
+        if entries is None or entity_id not in entries:
+            return
+
+        _, content = entries.pop(entity_id)
+        self.sizes[namespace] -= len(content)
+
+    def clear(self):
+        for namespace in self.entries:
+            self.entries[namespace].clear()
+            self.sizes[namespace] = 0
+
+
+class Cache:
+    """
+    Read-through cache of serialized read models (PostRead, CommentRead, SubredditRead).
+    Entries are keyed by (namespace, entity_id) and expire after ttl_sec.
+    A miss returns the time of the entry's last invalidation, and the fill is dropped when
+    another invalidation landed since, so a slow read never stores the rows it saw before.
+    Fills are also dropped for fill_grace_ms after an invalidation: misses are read from
+    replicas, which may still return the rows from before the write.
+    When local is set, hot entries are also served from process memory and kept
+    coherent across workers through the INVALIDATION_CHANNEL pub/sub channel.
+    """
+
+    def __init__(
+        self, redis: Redis, ttl_sec: int, local: LocalCache | None = None, fill_grace_ms: int = 0
+    ):
+        self.redis = redis
+        self.invalidate_script = redis.register_script(INVALIDATE_SCRIPT)
+        self.fill_script = redis.register_script(FILL_SCRIPT)
+        self.ttl_sec = ttl_sec
+        self.local = local
+        self.fill_grace_ms = fill_grace_ms
+        self.stats: dict[str, dict[str, int]] = {}
+        self.listener: asyncio.Task | None = None
+
+    def count(self, namespace: str, event: str):
+        stats = self.stats.setdefault(
+            namespace, {"local_hit": 0, "hit": 0, "miss": 0, "invalidation": 0}
+        )
+        stats[event] += 1
+
+    async def get(self, namespace: str, entity_id: int) -> tuple[str | None, str]:
+        """
+        output: (content | None, invalidated_at to pass to set on a miss)
+        """
+        if self.local:
+            content = self.local.get(namespace=namespace, entity_id=entity_id)
+
+            if content is not None:
+                self.count(namespace=namespace, event="local_hit")
+                return content, ""
+
+        key = f"cache:{namespace}:{entity_id}"
+        content, invalidated_at = await self.redis.mget(key, f"{key}:invalidated_at")
+        self.count(namespace=namespace, event="miss" if content is None else "hit")
+
+        if self.local and content is not None:
+            self.local.set(namespace=namespace, entity_id=entity_id, content=content)
+
+        return content, invalidated_at or ""
+
+    async def set(self, namespace: str, entity_id: int, content: str, invalidated_at: str):
+        key = f"cache:{namespace}:{entity_id}"
+        stored = await self.fill_script(
+            keys=[key, f"{key}:invalidated_at"],
+            args=[content, self.ttl_sec, invalidated_at, self.fill_grace_ms],
+        )
+
+        if self.local and stored:
+            self.local.set(namespace=namespace, entity_id=entity_id, content=content)
+
+    async def invalidate(self, *entities: tuple[str, int]):
+        """
+        input: (namespace, entity_id) pairs, deleted in one round-trip
+        """
+        if not entities:
+            return
+
+        keys = [f"{namespace}:{entity_id}" for namespace, entity_id in entities]
+        script_keys = [
+            name for key in keys for name in (f"cache:{key}", f"cache:{key}:invalidated_at")
+        ]
+
+        if self.local:
+            for namespace, entity_id in entities:
+                self.local.discard(namespace=namespace, entity_id=entity_id)
+
+        # workers with a local tier drop the entries through INVALIDATION_CHANNEL
+        message = ",".join(keys) if self.local else ""
+        await self.invalidate_script(
+            keys=script_keys, args=[self.ttl_sec, INVALIDATION_CHANNEL, message]
+        )
+
+        for namespace, _ in entities:
+            self.count(namespace=namespace, event="invalidation")
+
+    def invalidate_on_commit(self, *entities: tuple[str, int], db: AsyncSession):
+        """
+        input: (namespace, entity_id) pairs, deleted by get_db once db has committed.
+        Deleting them before the commit lets a concurrent read cache the rows it still sees.
+        """
+        db.info.setdefault(PENDING_INVALIDATIONS, []).extend(entities)
+
+    async def invalidate_committed(self, db: AsyncSession):
+        await self.invalidate(*db.info.pop(PENDING_INVALIDATIONS, []))
+
+    async def listen(self):
+        """
+        Apply invalidations published by other workers to the local tier.
+        Messages missed while disconnected are unknown, so the local tier is dropped on reconnect.
+        """
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    self.local.clear()
+
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+
+                        if message["data"] == INVALIDATE_ALL:
+                            self.local.clear()
+                            continue
+
+                        for key in message["data"].split(","):
+                            namespace, entity_id = key.rsplit(":", 1)
+                            self.local.discard(namespace=namespace, entity_id=int(entity_id))
+
+            except RedisError:
+                logger.exception("cache invalidation listener disconnected")
+                self.local.clear()
+                await asyncio.sleep(1)
+
+
+def set_cache(app: FastAPI):
+    settings = app.state.settings
+    local = None
+
+    if settings.LOCAL_CACHE_ENABLED:
+        local = LocalCache(
+            ttl_sec=settings.LOCAL_CACHE_TTL_SEC, budgets=settings.LOCAL_CACHE_BUDGETS
+        )
+
+    # replicas are expected to replay a write within DB_READ_YOUR_WRITES_SEC, the primary
+    # only serves reads without them
+    fill_grace_ms = settings.DB_READ_YOUR_WRITES_SEC * 1000 if settings.DB_REPLICA_URLS else 0
+
+    app.state.cache = Cache(
+        redis=app.state.keyspaces["cache"].redis,
+        ttl_sec=settings.CACHE_TTL_SEC,
+        local=local,
+        fill_grace_ms=fill_grace_ms,
+    )
+
+
+def get_cache(request: Request) -> Cache:
+    return request.app.state.cache
+
+
+async def open_cache(cache: Cache):
+    if cache.local:
+        cache.listener = asyncio.create_task(cache.listen())
+
+
+async def close_cache(cache: Cache):
+    if cache.listener:
+        cache.listener.cancel()
+        await asyncio.gather(cache.listener, return_exceptions=True)
@@ -0,0 +1,10 @@
+from app.cache.core import Cache, get_cache
+from fastapi import APIRouter, Depends
+
+cache_router = APIRouter(prefix="/cache", tags=["Cache"])
+
+
+@cache_router.get(path="/stats", status_code=200)
+async def get_cache_stats_route(cache: Cache = Depends(get_cache)):
+    # counters are per worker process
+    return cache.stats
@@ -22,6 +22,11 @@ class CommentRead(Model):
 
 
 class CommentReads(Model):
+    """
+    A page of comments by score: the top-level comments of a post, or the direct replies of
+    a comment. Replies are not listed with their post, reply_count tells which ones have any.
+    """
+
     comments: list[CommentRead]
     score_cursor: int
     id_cursor: int
@@ -33,3 +38,12 @@ class CommentUpdate(Model):
 
 class CommentUpvoteCreate(Model):
     value: bool
+
+
+class CommentUpvoteUpdate(Model):
+    value: bool | None  # None removes the vote
+
+
+class CommentUpvoteRead(Model):
+    upvote_count: int
+    downvote_count: int
@@ -1,4 +1,5 @@
 from app.auth.services import get_current_user_id
+from app.cache.core import Cache, get_cache
 from app.comment.exceptions import CommentNotFound, CommentUpvoteNotFound
 from app.comment.models import (
     CommentCreate,
@@ -6,20 +7,20 @@ from app.comment.models import (
     CommentReads,
     CommentUpdate,
     CommentUpvoteCreate,
+    CommentUpvoteRead,
+    CommentUpvoteUpdate,
 )
 from app.comment.services import (
     delete_comment,
-    delete_comment_upvote,
     get_comment,
     get_comment_replies,
     get_comments,
     submit_comment,
-    toggle_comment_upvote,
     update_comment,
-    upvote_comment,
 )
-from app.db.core import get_db
-from fastapi import APIRouter, Depends
+from app.db.core import get_db, get_db_read
+from app.vote.core import VoteBuffer, cast_vote, get_vote_buffer
+from fastapi import APIRouter, Depends, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 comment_router = APIRouter(
@@ -32,9 +33,10 @@ async def submit_comment_route(
     post_id: int,
     comment_data: CommentCreate,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    comment_id = await submit_comment(
+    comment = await submit_comment(
         body=[data.model_dump() for data in comment_data.body],
         post_id=post_id,
         parent_comment_id=comment_data.parent_comment_id,
@@ -42,10 +44,12 @@ async def submit_comment_route(
         db=db,
     )
 
-    comment = await get_comment(comment_id=comment_id, db=db)
-
-    if not comment:
-        raise CommentNotFound()
+    if comment_data.parent_comment_id is None:
+        cache.invalidate_on_commit(("post", post_id), db=db)
+    else:
+        cache.invalidate_on_commit(
+            ("post", post_id), ("comment", comment_data.parent_comment_id), db=db
+        )
 
     comment = comment._asdict()
     comment.update(comment.pop("Comment").to_dict())
@@ -53,31 +57,57 @@ async def submit_comment_route(
 
 
 @comment_router.get(path="/{comment_id}", status_code=200, response_model=CommentRead)
-async def get_comment_route(comment_id: int, db: AsyncSession = Depends(get_db)):
-    comment = await get_comment(comment_id=comment_id, db=db)
-    if not comment:
-        raise CommentNotFound()
+async def get_comment_route(
+    comment_id: int, db: AsyncSession = Depends(get_db_read), cache: Cache = Depends(get_cache)
+):
+    content, invalidated_at = await cache.get(namespace="comment", entity_id=comment_id)
 
-    comment = comment._asdict()
-    comment.update(comment.pop("Comment").to_dict())
-    return comment
+    if content is None:
+        comment = await get_comment(comment_id=comment_id, db=db)
+        if not comment:
+            raise CommentNotFound()
+
+        comment = comment._asdict()
+        comment.update(comment.pop("Comment").to_dict())
+        content = CommentRead.model_validate(comment).model_dump_json()
+        await cache.set(
+            namespace="comment",
+            entity_id=comment_id,
+            content=content,
+            invalidated_at=invalidated_at,
+        )
+
+    return Response(content=content, media_type="application/json")
 
 
 @comment_router.delete(path="/{comment_id}", status_code=200, response_model=None)
 async def delete_comment_route(
     comment_id: int,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    if not await delete_comment(comment_id=comment_id, user_id=current_user_id, db=db):
+    result = await delete_comment(comment_id=comment_id, user_id=current_user_id, db=db)
+
+    if result is None:
         raise CommentNotFound()
 
+    post_id, parent_comment_id, deleted_comment_ids = result
+    entities = [("post", post_id)]
+    entities += [("comment", deleted_comment_id) for deleted_comment_id in deleted_comment_ids]
+
+    if parent_comment_id is not None:
+        entities.append(("comment", parent_comment_id))
+
+    cache.invalidate_on_commit(*entities, db=db)
+
 
 @comment_router.patch(path="/{comment_id}", status_code=200, response_model=CommentRead)
 async def update_comment_route(
     comment_id: int,
     comment_data: CommentUpdate,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
     current_user_id: int = Depends(get_current_user_id),
 ):
     if not await update_comment(
@@ -88,6 +118,8 @@ async def update_comment_route(
     ):
         raise CommentNotFound()
 
+    cache.invalidate_on_commit(("comment", comment_id), db=db)
+
     comment = await get_comment(comment_id=comment_id, db=db)
     if not comment:
         raise CommentNotFound()
@@ -102,7 +134,7 @@ async def get_comments_route(
     post_id: int,
     score_cursor: int | None = None,
     id_cursor: int | None = None,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_read),
 ):
     result = await get_comments(
         post_id=post_id, score_cursor=score_cursor, id_cursor=id_cursor, db=db
@@ -128,7 +160,7 @@ async def get_comment_replies_route(
     comment_id: int,
     score_cursor: int | None = None,
     id_cursor: int | None = None,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_read),
 ):
     result = await get_comment_replies(
         comment_id=comment_id, score_cursor=score_cursor, id_cursor=id_cursor, db=db
@@ -149,15 +181,49 @@ async def get_comment_replies_route(
     return res
 
 
+@comment_router.put(path="/{comment_id}/upvote", status_code=200, response_model=CommentUpvoteRead)
+async def set_comment_upvote_route(
+    comment_id: int,
+    comment: CommentUpvoteUpdate,
+    db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
+    vote_buffer: VoteBuffer | None = Depends(get_vote_buffer),
+    current_user_id: int = Depends(get_current_user_id),
+):
+    row = await cast_vote(
+        target="comment",
+        target_id=comment_id,
+        user_id=current_user_id,
+        db=db,
+        cache=cache,
+        vote_buffer=vote_buffer,
+        value=comment.value,
+    )
+
+    if row is None:
+        raise CommentNotFound()
+
+    upvote_count, downvote_count, _ = row
+    return {"upvote_count": upvote_count, "downvote_count": downvote_count}
+
+
 @comment_router.post(path="/{comment_id}/upvote", status_code=201, response_model=None)
 async def upvote_comment_route(
     comment_id: int,
     comment: CommentUpvoteCreate,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
+    vote_buffer: VoteBuffer | None = Depends(get_vote_buffer),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    if not await upvote_comment(
-        user_id=current_user_id, comment_id=comment_id, value=comment.value, db=db
+    if not await cast_vote(
+        target="comment",
+        target_id=comment_id,
+        user_id=current_user_id,
+        db=db,
+        cache=cache,
+        vote_buffer=vote_buffer,
+        value=comment.value,
     ):
         raise CommentNotFound()
 
@@ -166,9 +232,24 @@ async def upvote_comment_route(
 async def toggle_comment_upvote_route(
     comment_id: int,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
+    vote_buffer: VoteBuffer | None = Depends(get_vote_buffer),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    if not await toggle_comment_upvote(user_id=current_user_id, comment_id=comment_id, db=db):
+    row = await cast_vote(
+        target="comment",
+        target_id=comment_id,
+        user_id=current_user_id,
+        db=db,
+        cache=cache,
+        vote_buffer=vote_buffer,
+        toggle=True,
+    )
+
+    if row is None:
+        raise CommentNotFound()
+
+    if not row[-1]:
         raise CommentUpvoteNotFound()
 
 
@@ -176,7 +257,22 @@ async def toggle_comment_upvote_route(
 async def delete_comment_upvote_route(
     comment_id: int,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
+    vote_buffer: VoteBuffer | None = Depends(get_vote_buffer),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    if not await delete_comment_upvote(user_id=current_user_id, comment_id=comment_id, db=db):
+    row = await cast_vote(
+        target="comment",
+        target_id=comment_id,
+        user_id=current_user_id,
+        db=db,
+        cache=cache,
+        vote_buffer=vote_buffer,
+        value=None,
+    )
+
+    if row is None:
+        raise CommentNotFound()
+
+    if not row[-1]:
         raise CommentUpvoteNotFound()
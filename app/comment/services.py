@@ -1,26 +1,94 @@
-from app.db.schema import Comment, CommentUpvote, User
-from sqlalchemy import delete, func, insert, select, update
+from app.db.schema import Comment, CommentUpvote, Post, User
+from app.post.services import increment_post_counters
+from sqlalchemy import delete, func, insert, select, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import aliased
 
 
 async def submit_comment(
     body: list[dict], user_id: int, post_id: int, parent_comment_id: int | None, db: AsyncSession
-) -> int:
-    query = (
+):
+    """
+    output: (Comment, user_display_name)
+
+    """
+    # insert, bump the counters and read back the author's display name in one statement
+    new_comment = (
         insert(Comment)
         .values(body=body, user_id=user_id, post_id=post_id, parent_comment_id=parent_comment_id)
-        .returning(Comment.id)
+        .returning(*Comment.__table__.c)
+        .cte("new_comment")
+    )
+    counters = [
+        update(Post)
+        .where(Post.id == post_id)
+        .values(comment_count=Post.comment_count + 1, updated_at=Post.updated_at)
+        .cte("post_counter")
+    ]
+
+    if parent_comment_id is not None:
+        counters.append(
+            update(Comment)
+            .where(Comment.id == parent_comment_id)
+            .values(reply_count=Comment.reply_count + 1, updated_at=Comment.updated_at)
+            .cte("parent_comment_counter")
+        )
+
+    comment = aliased(Comment, new_comment, name="Comment")
+    query = (
+        select(comment, User.display_name.label("user_display_name"))
+        .join(User, comment.user_id == User.id, isouter=True)
+        .add_cte(*counters)
     )
     result = await db.execute(query)
-    comment_id = result.scalars().one()
-    return comment_id
+    row = result.one()
+    return row
 
 
 async def delete_comment(comment_id: int, user_id: int, db: AsyncSession):
-    query = delete(Comment).where(Comment.id == comment_id, Comment.user_id == user_id)
+    """
+    output: (post_id, parent_comment_id, deleted_comment_ids) | None
+
+    """
+    # replies are removed by ON DELETE CASCADE, so the whole subtree leaves the post's count.
+    # It is locked level by level from the top: a locked comment gets no new replies (their
+    # foreign key check waits for the lock), and the replies committed before are seen below.
+    result = await db.execute(
+        select(Comment.id)
+        .where(Comment.id == comment_id, Comment.user_id == user_id)
+        .with_for_update()
+    )
+    deleted_comment_ids = list(result.scalars().all())
+    parent_ids = deleted_comment_ids
+
+    while parent_ids:
+        result = await db.execute(
+            select(Comment.id)
+            .where(Comment.parent_comment_id.in_(parent_ids))
+            .order_by(Comment.id)
+            .with_for_update()
+        )
+        parent_ids = list(result.scalars().all())
+        deleted_comment_ids.extend(parent_ids)
+
+    query = (
+        delete(Comment)
+        .where(Comment.id == comment_id, Comment.user_id == user_id)
+        .returning(Comment.post_id, Comment.parent_comment_id)
+    )
     result = await db.execute(query)
-    return result.rowcount > 0
+    row = result.first()
+
+    if row is None:
+        return None
+
+    post_id, parent_comment_id = row
+    await increment_post_counters(post_id=post_id, comment_count=-len(deleted_comment_ids), db=db)
+
+    if parent_comment_id is not None:
+        await increment_comment_counters(comment_id=parent_comment_id, reply_count=-1, db=db)
+
+    return (post_id, parent_comment_id, deleted_comment_ids)
 
 
 async def update_comment(
@@ -35,53 +103,35 @@ async def update_comment(
     return result.rowcount > 0
 
 
-async def upvote_comment(user_id: int, comment_id: int, value: bool, db: AsyncSession) -> bool:
-    query = insert(CommentUpvote).values(value=value, user_id=user_id, comment_id=comment_id)
-    result = await db.execute(query)
-    return result.rowcount > 0
-
-
-async def toggle_comment_upvote(user_id: int, comment_id: int, db: AsyncSession) -> bool:
+async def increment_comment_counters(
+    comment_id: int,
+    db: AsyncSession,
+    upvote_count: int = 0,
+    downvote_count: int = 0,
+    reply_count: int = 0,
+):
     query = (
-        update(CommentUpvote)
-        .where(CommentUpvote.user_id == user_id, CommentUpvote.comment_id == comment_id)
-        .values(value=~CommentUpvote.value)
+        update(Comment)
+        .where(Comment.id == comment_id)
+        .values(
+            upvote_count=Comment.upvote_count + upvote_count,
+            downvote_count=Comment.downvote_count + downvote_count,
+            reply_count=Comment.reply_count + reply_count,
+            updated_at=Comment.updated_at,
+        )
     )
-    result = await db.execute(query)
-    return result.rowcount > 0
-
-
-async def delete_comment_upvote(user_id: int, comment_id: int, db: AsyncSession) -> bool:
-    query = delete(CommentUpvote).where(
-        CommentUpvote.user_id == user_id, CommentUpvote.comment_id == comment_id
-    )
-    result = await db.execute(query)
-    return result.rowcount > 0
+    await db.execute(query)
 
 
 async def get_comment(comment_id: int, db: AsyncSession):
     """
-    output: (Comment, user_display_name, upvote_count, downvote_count, reply_count) | None
+    output: (Comment, user_display_name) | None
 
     """
-    Upvote = aliased(CommentUpvote)
-    Downvote = aliased(CommentUpvote)
-    CommentReply = aliased(Comment)
-
     query = (
-        select(
-            Comment,
-            User.display_name.label("user_display_name"),
-            func.count(func.distinct(Upvote.id)).label("upvote_count"),
-            func.count(func.distinct(Downvote.id)).label("downvote_count"),
-            func.count(func.distinct(CommentReply.id)).label("reply_count"),
-        )
+        select(Comment, User.display_name.label("user_display_name"))
         .join(User, Comment.user_id == User.id, isouter=True)
-        .join(Upvote, (Comment.id == Upvote.comment_id) & Upvote.value, isouter=True)
-        .join(Downvote, (Comment.id == Downvote.comment_id) & ~Downvote.value, isouter=True)
-        .join(CommentReply, CommentReply.parent_comment_id == Comment.id, isouter=True)
         .where(Comment.id == comment_id)
-        .group_by(Comment.id, User.display_name)
     )
     result = await db.execute(query)
     row = result.first()
@@ -92,59 +142,24 @@ async def get_comments(
     post_id: int, db: AsyncSession, score_cursor: int | None, id_cursor: int | None
 ):
     """
-    output: [(Comment, user_display_name, upvote_count, downvote_count, reply_count), next_score_cursor, next_id_cursor] | None
+    output: [(Comment, user_display_name), next_score_cursor, next_id_cursor] | None
 
     """
     limit = 10
 
-    Upvote = aliased(CommentUpvote)
-    Downvote = aliased(CommentUpvote)
-    Reply = aliased(Comment)
+    # top-level comments only, replies are listed per parent by get_comment_replies
+    query = (
+        select(Comment, User.display_name.label("user_display_name"))
+        .join(User, Comment.user_id == User.id, isouter=True)
+        .where(Comment.post_id == post_id, Comment.parent_comment_id.is_(None))
+        .order_by(Comment.upvote_count.desc(), Comment.id.desc())
+        .limit(limit)
+    )
 
-    if score_cursor is None or id_cursor is None:
-        query = (
-            select(
-                Comment,
-                User.display_name.label("user_display_name"),
-                func.count(func.distinct(Upvote.id)).label("upvote_count"),
-                func.count(func.distinct(Downvote.id)).label("downvote_count"),
-                func.count(func.distinct(Reply.id)).label("reply_count"),
-            )
-            .join(User, Comment.user_id == User.id, isouter=True)
-            .join(Upvote, (Comment.id == Upvote.comment_id) & Upvote.value, isouter=True)
-            .join(Downvote, (Comment.id == Downvote.comment_id) & ~Downvote.value, isouter=True)
-            .join(Reply, Reply.parent_comment_id == Comment.id, isouter=True)
-            .where(Comment.post_id == post_id)
-            .group_by(Comment.id, User.display_name)
-            .order_by(
-                func.count(func.distinct(Upvote.id)).label("upvote_count").desc(), Comment.id.asc()
-            )
-            .limit(limit)
-        )
-    else:
-        query = (
-            select(
-                Comment,
-                User.display_name.label("user_display_name"),
-                func.count(func.distinct(Upvote.id)).label("upvote_count"),
-                func.count(func.distinct(Downvote.id)).label("downvote_count"),
-                func.count(func.distinct(Reply.id)).label("reply_count"),
-            )
-            .join(User, Comment.user_id == User.id, isouter=True)
-            .join(Upvote, (Comment.id == Upvote.comment_id) & Upvote.value, isouter=True)
-            .join(Downvote, (Comment.id == Downvote.comment_id) & ~Downvote.value, isouter=True)
-            .join(Reply, Reply.parent_comment_id == Comment.id, isouter=True)
-            .where(Comment.post_id == post_id)
-            .group_by(Comment.id, User.display_name)
-            .having(
-                (func.count(func.distinct(Upvote.id)) < score_cursor)
-                | (
-                    (func.count(func.distinct(Upvote.id)) == score_cursor)
-                    & (Comment.id > id_cursor)
-                )
-            )
-            .order_by(func.count(func.distinct(Upvote.id)).desc(), Comment.id.asc())
-            .limit(limit)
+    if score_cursor is not None and id_cursor is not None:
+        # row comparison lets postgres start the index scan right after the cursor
+        query = query.where(
+            tuple_(Comment.upvote_count, Comment.id) < tuple_(score_cursor, id_cursor)
         )
 
     result = await db.execute(query)
@@ -153,7 +168,7 @@ async def get_comments(
     if rows == []:
         return None
 
-    next_score_cursor = rows[-1][2]
+    next_score_cursor = rows[-1][0].upvote_count
     next_id_cursor = rows[-1][0].id
 
     return (rows, next_score_cursor, next_id_cursor)
@@ -163,59 +178,23 @@ async def get_comment_replies(
     comment_id: int, db: AsyncSession, score_cursor: int | None, id_cursor: int | None
 ):
     """
-    output: [(Comment, user_display_name, upvote_count, downvote_count, reply_count), next_score_cursor, next_id_cursor] | None
+    output: [(Comment, user_display_name), next_score_cursor, next_id_cursor] | None
 
     """
     limit = 10
 
-    Upvote = aliased(CommentUpvote)
-    Downvote = aliased(CommentUpvote)
-    Reply = aliased(Comment)
+    query = (
+        select(Comment, User.display_name.label("user_display_name"))
+        .join(User, Comment.user_id == User.id, isouter=True)
+        .where(Comment.parent_comment_id == comment_id)
+        .order_by(Comment.upvote_count.desc(), Comment.id.desc())
+        .limit(limit)
+    )
 
-    if score_cursor is None or id_cursor is None:
-        query = (
-            select(
-                Comment,
-                User.display_name.label("user_display_name"),
-                func.count(func.distinct(Upvote.id)).label("upvote_count"),
-                func.count(func.distinct(Downvote.id)).label("downvote_count"),
-                func.count(func.distinct(Reply.id)).label("reply_count"),
-            )
-            .join(User, Comment.user_id == User.id, isouter=True)
-            .join(Upvote, (Comment.id == Upvote.comment_id) & Upvote.value, isouter=True)
-            .join(Downvote, (Comment.id == Downvote.comment_id) & ~Downvote.value, isouter=True)
-            .join(Reply, Reply.parent_comment_id == Comment.id, isouter=True)
-            .where(Comment.parent_comment_id == comment_id)
-            .group_by(Comment.id, User.display_name)
-            .order_by(
-                func.count(func.distinct(Upvote.id)).label("upvote_count").desc(), Comment.id.asc()
-            )
-            .limit(limit)
-        )
-    else:
-        query = (
-            select(
-                Comment,
-                User.display_name.label("user_display_name"),
-                func.count(func.distinct(Upvote.id)).label("upvote_count"),
-                func.count(func.distinct(Downvote.id)).label("downvote_count"),
-                func.count(func.distinct(Reply.id)).label("reply_count"),
-            )
-            .join(User, Comment.user_id == User.id, isouter=True)
-            .join(Upvote, (Comment.id == Upvote.comment_id) & Upvote.value, isouter=True)
-            .join(Downvote, (Comment.id == Downvote.comment_id) & ~Downvote.value, isouter=True)
-            .join(Reply, Reply.parent_comment_id == Comment.id, isouter=True)
-            .where(Comment.parent_comment_id == comment_id)
-            .group_by(Comment.id, User.display_name)
-            .having(
-                (func.count(func.distinct(Upvote.id)) < score_cursor)
-                | (
-                    (func.count(func.distinct(Upvote.id)) == score_cursor)
-                    & (Comment.id > id_cursor)
-                )
-            )
-            .order_by(func.count(func.distinct(Upvote.id)).desc(), Comment.id.asc())
-            .limit(limit)
+    if score_cursor is not None and id_cursor is not None:
+        # row comparison lets postgres start the index scan right after the cursor
+        query = query.where(
+            tuple_(Comment.upvote_count, Comment.id) < tuple_(score_cursor, id_cursor)
         )
 
     result = await db.execute(query)
@@ -224,7 +203,71 @@ async def get_comment_replies(
     if rows == []:
         return None
 
-    next_score_cursor = rows[-1][2]
+    next_score_cursor = rows[-1][0].upvote_count
     next_id_cursor = rows[-1][0].id
 
     return (rows, next_score_cursor, next_id_cursor)
+
+
+async def reconcile_comment_counters(db: AsyncSession, start_id: int, end_id: int) -> int:
+    """
+    Recompute the denormalized counters on Comment from the vote and reply tables in bulk,
+    for the comments in [start_id, end_id), a BackfillRunner chunk.
+    Only drifted rows are written. Returns the number of repaired comments.
+
+    The comments are locked in id order before counting, so the counts are read once the
+    concurrent votes and replies on them committed, and those after wait for the commit.
+    """
+    Reply = aliased(Comment)
+
+    votes = (
+        select(
+            CommentUpvote.comment_id,
+            func.count().filter(CommentUpvote.value).label("upvote_count"),
+            func.count().filter(~CommentUpvote.value).label("downvote_count"),
+        )
+        .where(CommentUpvote.comment_id >= start_id, CommentUpvote.comment_id < end_id)
+        .group_by(CommentUpvote.comment_id)
+    )
+    replies = (
+        select(Reply.parent_comment_id, func.count().label("reply_count"))
+        .where(Reply.parent_comment_id >= start_id, Reply.parent_comment_id < end_id)
+        .group_by(Reply.parent_comment_id)
+    )
+    comments = select(Comment.id).where(Comment.id >= start_id, Comment.id < end_id)
+
+    await db.execute(comments.order_by(Comment.id).with_for_update())
+
+    votes = votes.subquery()
+    replies = replies.subquery()
+    comments = comments.subquery()
+
+    counts = (
+        select(
+            comments.c.id,
+            func.coalesce(votes.c.upvote_count, 0).label("upvote_count"),
+            func.coalesce(votes.c.downvote_count, 0).label("downvote_count"),
+            func.coalesce(replies.c.reply_count, 0).label("reply_count"),
+        )
+        .join(votes, votes.c.comment_id == comments.c.id, isouter=True)
+        .join(replies, replies.c.parent_comment_id == comments.c.id, isouter=True)
+        .subquery()
+    )
+
+    query = (
+        update(Comment)
+        .where(
+            Comment.id == counts.c.id,
+            (Comment.upvote_count != counts.c.upvote_count)
+            | (Comment.downvote_count != counts.c.downvote_count)
+            | (Comment.reply_count != counts.c.reply_count),
+        )
+        .values(
+            upvote_count=counts.c.upvote_count,
+            downvote_count=counts.c.downvote_count,
+            reply_count=counts.c.reply_count,
+            updated_at=Comment.updated_at,
+        )
+    )
+    result = await db.execute(query)
+    return result.rowcount
@@ -1,7 +1,9 @@
 from app.auth.router import auth_router
+from app.cache.router import cache_router
 from app.comment.router import comment_router
 from app.db.router import database_router
 from app.exception_handlers import handle_request_validation_error
+from app.keyspace.router import keyspace_router
 from app.middlewares import (
     exceptions_handler_middleware,
     generate_request_id_middleware,
@@ -29,6 +31,8 @@ def set_routers(app: FastAPI):
     main_router.include_router(router=auth_router)
     main_router.include_router(router=user_router)
     main_router.include_router(router=database_router)
+    main_router.include_router(router=cache_router)
+    main_router.include_router(router=keyspace_router)
     main_router.include_router(router=subreddit_router)
     main_router.include_router(router=post_router)
     main_router.include_router(router=comment_router)
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import time
+from app.settings import Settings, get_settings
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from fastapi import Depends
+from redis.asyncio import Redis
+from sqlalchemy import TableClause, column, func, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+# checkpoints of an abandoned backfill expire instead of staying in redis forever
+CHECKPOINT_TTL_SEC = 7 * 24 * 3600
+
+# replay lag of the slowest replica, and the replicas whose lag is unknown: NULL for idle
+# replicas, or for every replica without pg_read_all_stats, which read as no lag
+REPLICA_LAG_QUERY = """
+SELECT coalesce(max(extract(epoch FROM replay_lag)) * 1000, 0), count(*) - count(replay_lag)
+FROM pg_stat_replication
+"""
+
+ACTIVE_QUERIES_QUERY = """
+SELECT count(*)
+FROM pg_stat_activity
+WHERE state = 'active' AND backend_type = 'client backend' AND pid <> pg_backend_pid()
+"""
+
+
+@dataclass
+class BackfillThrottle:
+    max_replica_lag_ms: int
+    max_active_queries: int  # queries running on the primary besides the backfill
+    sleep_ms: int
+
+
+def get_backfill_throttle(settings: Settings = Depends(get_settings)) -> BackfillThrottle:
+    return BackfillThrottle(
+        max_replica_lag_ms=settings.BACKFILL_MAX_REPLICA_LAG_MS,
+        max_active_queries=settings.BACKFILL_MAX_ACTIVE_QUERIES,
+        sleep_ms=settings.BACKFILL_THROTTLE_SLEEP_MS,
+    )
+
+
+class BackfillRunner:
+    """
+    Derived data recomputed by primary key ranges of chunk_size ids, one transaction each,
+    so no row stays locked longer than its chunk.
+    fn(db, start_id, end_id) updates the ids in [start_id, end_id) and returns the rows changed,
+    it must be idempotent: a chunk that committed right before a crash is run again.
+
+    Before each chunk the runner waits while replicas lag or the primary is busy. The next id
+    is checkpointed in redis after each chunk, so a restarted backfill resumes where it stopped.
+    Ids above the max id seen at the start are left to the application.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        table: str,
+        fn: Callable[[AsyncSession, int, int], Awaitable[int]],
+        chunk_size: int,
+        db_engine: AsyncEngine,
+        session_factory: async_sessionmaker[AsyncSession],
+        redis: Redis | None,
+        throttle: BackfillThrottle,
+        report_interval_sec: float = 10,
+    ):
+        self.name = name
+        self.table = table
+        self.fn = fn
+        self.chunk_size = chunk_size
+        self.db_engine = db_engine
+        self.session_factory = session_factory
+        self.redis = redis
+        self.throttle = throttle
+        self.report_interval_sec = report_interval_sec
+        self.checkpoint_key = f"db:backfill:{name}"
+        # quoted in the queries, table names can be keywords ("user")
+        self.id_column = TableClause(table, column("id")).c.id
+        self.unknown_lag_warned = False
+
+    async def get_load(self) -> tuple[float, int]:
+        """
+        output: (replica lag in ms, active queries)
+        """
+        async with self.db_engine.connect() as conn:
+            replica_lag_ms, unknown_lags = (await conn.execute(text(REPLICA_LAG_QUERY))).one()
+            active_queries = (await conn.execute(text(ACTIVE_QUERIES_QUERY))).scalar()
+
+        # once per runner, replicas stay idle for long
+        if unknown_lags and not self.unknown_lag_warned:
+            self.unknown_lag_warned = True
+            logger.warning(
+                "%s: replay lag unknown for %s replicas, not throttled on them",
+                self.name,
+                unknown_lags,
+            )
+
+        return float(replica_lag_ms), active_queries
+
+    async def wait_for_capacity(self) -> float:
+        """
+        output: seconds spent throttled
+        """
+        throttled = 0.0
+
+        while True:
+            replica_lag_ms, active_queries = await self.get_load()
+
+            if (
+                replica_lag_ms <= self.throttle.max_replica_lag_ms
+                and active_queries <= self.throttle.max_active_queries
+            ):
+                return throttled
+
+            logger.info(
+                "%s: throttled, replica lag %.0f ms, %s active queries",
+                self.name,
+                replica_lag_ms,
+                active_queries,
+            )
+            await asyncio.sleep(self.throttle.sleep_ms / 1000)
+            throttled += self.throttle.sleep_ms / 1000
+
+    async def get_checkpoint(self) -> dict | None:
+        if self.redis is None:
+            return None
+
+        checkpoint = await self.redis.hgetall(self.checkpoint_key)
+        return {key: float(value) for key, value in checkpoint.items()} or None
+
+    async def save_checkpoint(self, checkpoint: dict):
+        if self.redis is None:
+            return
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.checkpoint_key, mapping=checkpoint)
+            pipe.expire(self.checkpoint_key, CHECKPOINT_TTL_SEC)
+            await pipe.execute()
+
+    async def clear_checkpoint(self):
+        if self.redis is not None:
+            await self.redis.delete(self.checkpoint_key)
+
+    async def run_chunk(self, start_id: int, end_id: int) -> tuple[int, int]:
+        """
+        output: (rows in the chunk, rows changed)
+        """
+        async with self.session_factory() as db, db.begin():
+            result = await db.execute(
+                select(func.count()).where(self.id_column >= start_id, self.id_column < end_id)
+            )
+            rows = result.scalar()
+            changed = await self.fn(db, start_id, end_id) if rows else 0
+
+        return rows, changed
+
+    async def run(self, restart: bool = False) -> dict:
+        """
+        output: {"rows", "changed", "elapsed_sec", "throttled_sec", "rows_per_sec"}, totals of
+        the whole backfill, including the runs before a restart
+        """
+        checkpoint = None if restart else await self.get_checkpoint()
+
+        if checkpoint:
+            logger.info("%s: resuming at id %s", self.name, int(checkpoint["next_id"]))
+        else:
+            async with self.db_engine.connect() as conn:
+                result = await conn.execute(
+                    select(func.min(self.id_column), func.max(self.id_column))
+                )
+                min_id, max_id = result.one()
+
+            checkpoint = {
+                "next_id": min_id or 0,
+                "max_id": -1 if max_id is None else max_id,
+                "rows": 0,
+                "changed": 0,
+                "elapsed_sec": 0,
+                "throttled_sec": 0,
+            }
+
+        next_id, max_id = int(checkpoint["next_id"]), int(checkpoint["max_id"])
+        start = time.perf_counter() - checkpoint["elapsed_sec"]
+        reported = time.perf_counter()
+
+        while next_id <= max_id:
+            checkpoint["throttled_sec"] += await self.wait_for_capacity()
+
+            end_id = next_id + self.chunk_size
+            rows, changed = await self.run_chunk(start_id=next_id, end_id=end_id)
+            next_id = end_id
+
+            checkpoint["next_id"] = next_id
+            checkpoint["rows"] += rows
+            checkpoint["changed"] += changed
+            checkpoint["elapsed_sec"] = time.perf_counter() - start
+            await self.save_checkpoint(checkpoint)
+
+            if time.perf_counter() - reported >= self.report_interval_sec:
+                reported = time.perf_counter()
+                logger.info(
+                    "%s: %s, at id %s/%s", self.name, self.describe(checkpoint), next_id, max_id
+                )
+
+        await self.clear_checkpoint()
+
+        checkpoint["elapsed_sec"] = time.perf_counter() - start
+        logger.info("%s: done, %s", self.name, self.describe(checkpoint))
+
+        return {
+            "rows": int(checkpoint["rows"]),
+            "changed": int(checkpoint["changed"]),
+            "elapsed_sec": checkpoint["elapsed_sec"],
+            "throttled_sec": checkpoint["throttled_sec"],
+            "rows_per_sec": self.get_rate(checkpoint),
+        }
+
+    @staticmethod
+    def get_rate(checkpoint: dict) -> float:
+        return checkpoint["rows"] / checkpoint["elapsed_sec"] if checkpoint["elapsed_sec"] else 0
+
+    def describe(self, checkpoint: dict) -> str:
+        return (
+            f"{int(checkpoint['rows'])} rows, {int(checkpoint['changed'])} changed, "
+            f"{self.get_rate(checkpoint):,.0f} rows/sec, "
+            f"{checkpoint['throttled_sec']:.1f}s throttled"
+        )
+
+
+async def clear_backfill_checkpoints(redis: Redis) -> int:
+    """
+    output: number of checkpoints removed
+    """
+    keys = [key async for key in redis.scan_iter(match="db:backfill:*")]
+    return await redis.unlink(*keys) if keys else 0
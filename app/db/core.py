@@ -1,4 +1,13 @@
+import asyncio
+import logging
+import random
+from app.auth.services import get_optional_user_id
+from app.db.metrics import DBMetrics, MeteredPool
+from app.settings import Settings
+from dataclasses import dataclass
 from fastapi import Depends, FastAPI, Request
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
@@ -6,34 +15,188 @@ from sqlalchemy.ext.asyncio import (
     create_async_engine,
 )
 
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DBReplica:
+    engine: AsyncEngine
+    session_factory: async_sessionmaker[AsyncSession]  # autocommit, reads only
+    healthy: bool = True
+
+
+def create_db_engine(
+    url: str, settings: Settings, db_metrics: DBMetrics | None = None
+) -> AsyncEngine:
+    connect_args = {
+        "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        "server_settings": {
+            # threshold of the `%` operator used by the indexed trigram search
+            "pg_trgm.similarity_threshold": str(settings.SEARCH_SIMILARITY_THRESHOLD)
+        },
+    }
+
+    if db_metrics is not None:
+        # called by the dialect on each statement cache miss
+        connect_args["prepared_statement_name_func"] = db_metrics.record_prepare
+
+    return create_async_engine(
+        url=url,
+        echo=False,
+        poolclass=MeteredPool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SEC,
+        pool_recycle=settings.DB_POOL_RECYCLE_SEC,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
 
 def set_db(app: FastAPI):
-    app.state.db_engine = create_async_engine(url=app.state.settings.DB_URL, echo=False)
+    settings = app.state.settings
+    app.state.db_metrics = DBMetrics()
+    app.state.db_engine = create_db_engine(
+        url=settings.DB_URL, settings=settings, db_metrics=app.state.db_metrics
+    )
+    app.state.db_metrics.attach(db_engine=app.state.db_engine)
     app.state.db_session_factory = async_sessionmaker(bind=app.state.db_engine, autoflush=True)
 
+    # read sessions run in autocommit: no BEGIN/COMMIT round-trips around their selects
+    app.state.db_read_session_factory = async_sessionmaker(
+        bind=app.state.db_engine.execution_options(isolation_level="AUTOCOMMIT")
+    )
+    app.state.db_replicas = []
+
+    for url in settings.DB_REPLICA_URLS:
+        engine = create_db_engine(url=url, settings=settings)
+        session_factory = async_sessionmaker(
+            bind=engine.execution_options(isolation_level="AUTOCOMMIT")
+        )
+        app.state.db_replicas.append(DBReplica(engine=engine, session_factory=session_factory))
+
+
+async def check_db_replicas(replicas: list[DBReplica], interval_sec: int):
+    while True:
+        for replica in replicas:
+            try:
+                async with asyncio.timeout(interval_sec):
+                    async with replica.engine.connect() as conn:
+                        await conn.execute(text("SELECT 1"))
+
+                if not replica.healthy:
+                    logger.info("replica %s is healthy again", replica.engine.url)
+
+                replica.healthy = True
+            except (DBAPIError, OSError) as e:
+                # TimeoutError is an OSError
+                logger.warning("replica %s failed its health check: %r", replica.engine.url, e)
+                replica.healthy = False
+
+        await asyncio.sleep(interval_sec)
+
 
 async def close_db(db_engine: AsyncEngine):
     await db_engine.dispose()
 
 
+def open_db_replicas(app: FastAPI):
+    app.state.db_replica_checker = None
+
+    if app.state.db_replicas:
+        app.state.db_replica_checker = asyncio.create_task(
+            check_db_replicas(
+                replicas=app.state.db_replicas,
+                interval_sec=app.state.settings.DB_REPLICA_CHECK_INTERVAL_SEC,
+            )
+        )
+
+
+async def close_db_replicas(app: FastAPI):
+    if app.state.db_replica_checker:
+        app.state.db_replica_checker.cancel()
+        await asyncio.gather(app.state.db_replica_checker, return_exceptions=True)
+
+    for replica in app.state.db_replicas:
+        await replica.engine.dispose()
+
+
 async def get_db_engine(request: Request):
     return request.app.state.db_engine
 
 
+async def get_db_metrics(request: Request):
+    return request.app.state.db_metrics
+
+
 async def get_db_session_factory(request: Request):
     return request.app.state.db_session_factory
 
 
 async def get_db(
+    request: Request,
     session_factory: async_sessionmaker[AsyncSession] = Depends(get_db_session_factory),
 ):
+    # the session only checks out a connection on its first statement
     db = session_factory()
+    used = False
     try:
         yield db
-        await db.commit()
+        used = db.in_transaction()
+
+        if used:
+            await db.commit()
     except Exception as e:
+        used = db.in_transaction()
         print(e)
         await db.rollback()
         raise
     finally:
         await db.close()
+        request.app.state.db_metrics.record_session(used=used)
+
+    # cache entries of the rows written are only deleted once the write is visible
+    await request.app.state.cache.invalidate_committed(db=db)
+
+    # reads of this user go to the primary until replicas have caught up with the write
+    if used and request.app.state.db_replicas:
+        user_id = get_optional_user_id(request)
+
+        if user_id is not None:
+            await request.app.state.keyspaces["db"].redis.set(
+                name=f"db:recent_write:{user_id}",
+                value=1,
+                ex=request.app.state.settings.DB_READ_YOUR_WRITES_SEC,
+            )
+
+
+async def get_db_read_session_factory(request: Request):
+    """
+    Healthy replica picked at random, or the primary when no replica is healthy
+    or the user wrote within DB_READ_YOUR_WRITES_SEC.
+    """
+    replicas = [replica for replica in request.app.state.db_replicas if replica.healthy]
+
+    if not replicas:
+        return request.app.state.db_read_session_factory
+
+    user_id = get_optional_user_id(request)
+
+    redis = request.app.state.keyspaces["db"].redis
+
+    if user_id is not None and await redis.exists(f"db:recent_write:{user_id}"):
+        return request.app.state.db_read_session_factory
+
+    return random.choice(replicas).session_factory
+
+
+async def get_db_read(
+    request: Request,
+    session_factory: async_sessionmaker[AsyncSession] = Depends(get_db_read_session_factory),
+):
+    db = session_factory()
+    try:
+        yield db
+    finally:
+        request.app.state.db_metrics.record_session(used=db.in_transaction())
+        await db.close()
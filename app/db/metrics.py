@@ -0,0 +1,125 @@
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class DBMetrics:
+    """
+    Per-process counters for sizing the pool against the worker count.
+    wait_sec is the total time spent waiting for a pooled connection.
+    sessions counts request sessions, sessions_used the ones that sent at least one statement.
+
+    statement_cache_* count the prepared statements cached on each asyncpg connection (sized by
+    DB_STATEMENT_CACHE_SIZE): a miss is a statement prepared on the server, an extra round-trip.
+    compiled_cache_* count SQLAlchemy's cache of compiled SQL strings, which is in-process only.
+    executemany() calls bypass the statement cache and are not counted.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_sec = 0.0
+        self.max_wait_sec = 0.0
+        self.overflows = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.statements = 0
+        self.prepares = 0
+        self.setup_prepares = 0
+        self.compiled_cache_hits = 0
+        self.compiled_cache_misses = 0
+        self.sessions = 0
+        self.sessions_used = 0
+
+    def record_checkout(self, wait_sec: float, overflow: bool):
+        self.checkouts += 1
+        self.wait_sec += wait_sec
+        self.max_wait_sec = max(self.max_wait_sec, wait_sec)
+        self.overflows += int(overflow)
+
+    def record_prepare(self) -> None:
+        """
+        prepared_statement_name_func of the asyncpg dialect, called once per statement prepared
+        on the server
+        output: None, asyncpg names the statement
+        """
+        self.prepares += 1
+
+    def record_session(self, used: bool):
+        self.sessions += 1
+        self.sessions_used += int(used)
+
+    def attach(self, db_engine: AsyncEngine):
+        sync_engine = db_engine.sync_engine
+        sync_engine.pool.metrics = self
+
+        @event.listens_for(sync_engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            if self.connects == 0:
+                # the dialect's queries on the first connection are prepared without cursor events
+                self.setup_prepares = self.prepares
+
+            self.connects += 1
+
+        @event.listens_for(sync_engine, "after_cursor_execute")
+        def on_execute(conn, cursor, statement, parameters, context, executemany):
+            if not executemany:
+                self.statements += 1
+
+            if context.cache_hit == context.dialect.CACHE_HIT:
+                self.compiled_cache_hits += 1
+            elif context.cache_hit == context.dialect.CACHE_MISS:
+                self.compiled_cache_misses += 1
+
+    def snapshot(self, db_engine: AsyncEngine) -> dict:
+        pool = db_engine.sync_engine.pool
+        return {
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "checkouts": self.checkouts,
+            "avg_wait_ms": self.wait_sec / self.checkouts * 1000 if self.checkouts else 0.0,
+            "max_wait_ms": self.max_wait_sec * 1000,
+            "overflow_checkouts": self.overflows,
+            "timeouts": self.timeouts,
+            "connects": self.connects,
+            "statement_cache_hits": self.statements - (self.prepares - self.setup_prepares),
+            "statement_cache_misses": self.prepares,
+            "compiled_cache_hits": self.compiled_cache_hits,
+            "compiled_cache_misses": self.compiled_cache_misses,
+            "sessions": self.sessions,
+            "sessions_used": self.sessions_used,
+        }
+
+
+class MeteredPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that reports checkout wait time, overflow connections and timeouts.
+    """
+
+    metrics: DBMetrics | None = None
+
+    def connect(self):
+        if self.metrics is None:
+            return super().connect()
+
+        overflow = self._overflow
+        start = time.perf_counter()
+
+        try:
+            connection = super().connect()
+        except TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+
+        self.metrics.record_checkout(
+            wait_sec=time.perf_counter() - start, overflow=self._overflow > overflow
+        )
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import logging
+from app.db.backfill import get_backfill_throttle
+from app.db.core import close_db, set_db
+from app.db.migrations.core import apply_migrations, plan_migrations
+from app.db.migrations.versions import MIGRATIONS
+from app.keyspace.core import close_keyspaces, set_keyspaces
+from app.redis import close_redis, set_redis
+from app.settings import set_settings
+from fastapi import FastAPI
+
+
+def print_plan(plan: list[dict]):
+    if not plan:
+        print("no pending migrations")
+
+    for migration in plan:
+        print(f"{migration['version']}: {migration['name']}")
+
+        for step in migration["steps"]:
+            table = f" on {step['table']}" if step["table"] else ""
+            print(f"  {step['lock']}{table} ({step['effect']}): {step['impact']}")
+
+            for statement in step["statements"]:
+                print(f"    {statement}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(prog="python -m app.db.migrations")
+    parser.add_argument("--dry-run", action="store_true", help="print the pending steps only")
+    args = parser.parse_args()
+    # progress of the backfills, logged by the runner
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    # the engine and redis of the app, backfills checkpoint in its "db" keyspace
+    app = FastAPI()
+    set_settings(app=app)
+    set_db(app=app)
+    set_redis(app=app)
+    set_keyspaces(app=app)
+    settings = app.state.settings
+
+    try:
+        print_plan(await plan_migrations(db_engine=app.state.db_engine, migrations=MIGRATIONS))
+
+        if not args.dry_run:
+            versions = await apply_migrations(
+                db_engine=app.state.db_engine,
+                migrations=MIGRATIONS,
+                lock_timeout_ms=settings.MIGRATION_LOCK_TIMEOUT_MS,
+                throttle=get_backfill_throttle(settings=settings),
+                redis=app.state.keyspaces["db"].redis,
+            )
+            print(f"applied: {versions}")
+    finally:
+        await close_keyspaces(keyspaces=app.state.keyspaces)
+        await close_redis(redis=app.state.redis)
+        await close_db(db_engine=app.state.db_engine)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
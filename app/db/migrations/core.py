@@ -0,0 +1,477 @@
+from app.db.backfill import BackfillRunner, BackfillThrottle
+from app.db.schema_check import normalize_predicate
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from redis.asyncio import Redis
+from sqlalchemy import Column, Index, UniqueConstraint, text
+from sqlalchemy.dialects import postgresql as pg
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.schema import CreateColumn, CreateIndex, MetaData
+
+MIGRATION_TABLE = "schema_migration"
+
+# pg_advisory_lock key held while migrating, so concurrent deploys apply each version once
+MIGRATION_LOCK_KEY = 7_202_500
+
+# what a lock held on a table does to the application's queries
+LOCK_EFFECTS = {
+    "NONE": "existing tables are not locked",
+    "ACCESS EXCLUSIVE": "blocks reads and writes",
+    "SHARE UPDATE EXCLUSIVE": "reads and writes continue",
+    "SHARE ROW EXCLUSIVE": "reads continue, writes wait",
+    "ROW EXCLUSIVE": "reads and writes continue, writes to changed rows wait for the commit",
+}
+
+TABLE_STATS_QUERY = """
+SELECT greatest(c.reltuples, 0)::bigint AS rows, pg_total_relation_size(c.oid) AS bytes
+FROM pg_class c
+WHERE c.oid = to_regclass(:table)
+"""
+
+INDEX_DEFINITION_QUERY = """
+SELECT pg_get_indexdef(x.indexrelid), x.indisvalid, current_schema()
+FROM pg_index x
+WHERE x.indexrelid = to_regclass(:index)
+"""
+
+INVALID_INDEX_QUERY = """
+SELECT NOT x.indisvalid
+FROM pg_index x
+WHERE x.indexrelid = to_regclass(:index)
+"""
+
+
+@dataclass
+class MigrationContext:
+    conn: AsyncConnection  # autocommit, holds the migration lock
+    db_engine: AsyncEngine
+    session_factory: async_sessionmaker[AsyncSession]
+    redis: Redis | None  # backfill checkpoints, none are kept without it
+    throttle: BackfillThrottle
+
+
+def compile_ddl(element) -> str:
+    return str(element.compile(dialect=pg.dialect()))
+
+
+def describe_size(stats: dict) -> str:
+    return f"~{stats['rows']:,} rows, {stats['bytes'] / 1024 / 1024:,.1f} MB"
+
+
+async def drop_invalid_index(conn: AsyncConnection, name: str):
+    # a concurrent build that failed leaves an invalid index that IF NOT EXISTS would keep
+    result = await conn.execute(text(INVALID_INDEX_QUERY), {"index": name})
+
+    if result.scalar():
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def normalize_index_definition(definition: str, schema: str | None = None) -> str:
+    # pg_get_indexdef qualifies the table, names the btree method and wraps the predicate
+    if schema:
+        definition = definition.replace(f" ON {schema}.", " ON ", 1)
+
+    definition = definition.replace(" USING btree ", " ", 1)
+    head, _, predicate = definition.partition(" WHERE ")
+    return f"{head} WHERE {normalize_predicate(predicate)}" if predicate else head
+
+
+async def is_index_built(conn: AsyncConnection, index: Index) -> bool:
+    """
+    output: True if a valid index of that name exists with the schema's definition
+    """
+    result = await conn.execute(text(INDEX_DEFINITION_QUERY), {"index": index.name})
+    row = result.first()
+
+    if row is None:
+        return False
+
+    definition, valid, schema = row
+    expected = normalize_index_definition(compile_ddl(CreateIndex(index)))
+    return valid and normalize_index_definition(definition, schema=schema) == expected
+
+
+def concurrent_index_sql(index: Index, name: str | None = None) -> str:
+    sql = compile_ddl(CreateIndex(index, if_not_exists=True))
+    sql = sql.replace(" INDEX IF NOT EXISTS ", " INDEX CONCURRENTLY IF NOT EXISTS ", 1)
+
+    if name:
+        sql = sql.replace(f" {index.name} ON ", f" {name} ON ", 1)
+
+    return sql
+
+
+@dataclass
+class CreateTables:
+    """
+    Tables of the schema that do not exist yet, existing tables are left untouched
+    """
+
+    metadata: MetaData
+    table: str = ""
+    lock = "NONE"
+
+    def statements(self) -> list[str]:
+        return ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+            f"CREATE TABLE IF NOT EXISTS {table.name} (...)"
+            for table in self.metadata.sorted_tables
+        ]
+
+    def impact(self, stats: dict) -> str:
+        return "new tables are created with their indexes"
+
+    async def run(self, context: MigrationContext):
+        await context.conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        await context.conn.run_sync(self.metadata.create_all)
+
+
+@dataclass
+class AddColumn:
+    """
+    A column of the schema added to an existing table, a catalog update when its default is
+    constant. Stored generated columns are refused: adding one rewrites the whole table under
+    ACCESS EXCLUSIVE, add a nullable column filled by a trigger and a Backfill instead.
+    """
+
+    column: Column
+    lock = "ACCESS EXCLUSIVE"
+
+    def __post_init__(self):
+        if self.column.computed is not None:
+            raise ValueError(f"{self.table}.{self.column.name} would rewrite the table")
+
+    @property
+    def table(self) -> str:
+        return self.column.table.name
+
+    def statements(self) -> list[str]:
+        column = compile_ddl(CreateColumn(self.column))
+        return [f"ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS {column}"]
+
+    def impact(self, stats: dict) -> str:
+        return "held for a catalog update only"
+
+    async def run(self, context: MigrationContext):
+        for statement in self.statements():
+            await context.conn.execute(text(statement))
+
+
+@dataclass
+class AddTrigger:
+    """
+    A trigger and its function, created or replaced. Rows written before it are left to a
+    Backfill.
+    """
+
+    table: str
+    function: str  # CREATE OR REPLACE FUNCTION
+    trigger: str  # CREATE OR REPLACE TRIGGER
+    lock = "SHARE ROW EXCLUSIVE"
+
+    def statements(self) -> list[str]:
+        return [self.function.strip(), self.trigger.strip()]
+
+    def impact(self, stats: dict) -> str:
+        return "held for a catalog update only"
+
+    async def run(self, context: MigrationContext):
+        for statement in self.statements():
+            await context.conn.execute(text(statement))
+
+
+@dataclass
+class AddIndex:
+    """
+    An index of the schema built with CREATE INDEX CONCURRENTLY
+    """
+
+    index: Index
+    lock = "SHARE UPDATE EXCLUSIVE"
+
+    @property
+    def table(self) -> str:
+        return self.index.table.name
+
+    def statements(self) -> list[str]:
+        return [concurrent_index_sql(self.index)]
+
+    def impact(self, stats: dict) -> str:
+        return f"held for two scans of the table ({describe_size(stats)})"
+
+    async def run(self, context: MigrationContext):
+        await drop_invalid_index(conn=context.conn, name=self.index.name)
+        await context.conn.execute(text(concurrent_index_sql(self.index)))
+
+
+@dataclass
+class ReplaceIndex:
+    """
+    An index whose definition changed: the new one is built concurrently under a temporary
+    name, then swapped in, queries keep the old one until the swap. Nothing is done when the
+    index already has the schema's definition.
+    """
+
+    index: Index
+    lock = "SHARE UPDATE EXCLUSIVE"
+
+    @property
+    def table(self) -> str:
+        return self.index.table.name
+
+    def statements(self) -> list[str]:
+        name = self.index.name
+        return [
+            concurrent_index_sql(self.index, name=f"{name}_new"),
+            f"DROP INDEX CONCURRENTLY IF EXISTS {name}",
+            f"ALTER INDEX IF EXISTS {name}_new RENAME TO {name}",
+        ]
+
+    def impact(self, stats: dict) -> str:
+        return f"held for two scans of the table ({describe_size(stats)}) and the swap"
+
+    async def run(self, context: MigrationContext):
+        if await is_index_built(conn=context.conn, index=self.index):
+            return
+
+        await drop_invalid_index(conn=context.conn, name=f"{self.index.name}_new")
+
+        for statement in self.statements():
+            await context.conn.execute(text(statement))
+
+
+@dataclass
+class AddUniqueConstraint:
+    """
+    A unique constraint of the schema: its index is built concurrently, then attached,
+    which only holds ACCESS EXCLUSIVE for a catalog update.
+    Duplicates make the build fail, they have to be removed by an earlier step.
+    """
+
+    constraint: UniqueConstraint
+    lock = "SHARE UPDATE EXCLUSIVE"
+
+    @property
+    def table(self) -> str:
+        return self.constraint.table.name
+
+    @property
+    def name(self) -> str:
+        # postgres' name for an unnamed UNIQUE (...) of create_all
+        columns = "_".join(column.name for column in self.constraint.columns)
+        return self.constraint.name or f"{self.table}_{columns}_key"
+
+    def statements(self) -> list[str]:
+        name, table = self.name, self.table
+        columns = ", ".join(column.name for column in self.constraint.columns)
+        return [
+            f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})",
+            f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}",
+        ]
+
+    def impact(self, stats: dict) -> str:
+        return (
+            f"held for two scans of the table ({describe_size(stats)}), "
+            "then ACCESS EXCLUSIVE for a catalog update"
+        )
+
+    async def run(self, context: MigrationContext):
+        result = await context.conn.execute(
+            text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {"name": self.name}
+        )
+
+        if result.first():
+            return
+
+        await drop_invalid_index(conn=context.conn, name=self.name)
+
+        for statement in self.statements():
+            await context.conn.execute(text(statement))
+
+
+@dataclass
+class Sql:
+    """
+    One statement, run in autocommit, written to be safe to run again
+    """
+
+    table: str
+    sql: str
+    lock: str = "ROW EXCLUSIVE"
+
+    def statements(self) -> list[str]:
+        return [self.sql]
+
+    def impact(self, stats: dict) -> str:
+        if not self.table:
+            return "no table data is touched"
+
+        return f"held for one statement over the table ({describe_size(stats)})"
+
+    async def run(self, context: MigrationContext):
+        await context.conn.execute(text(self.sql))
+
+
+@dataclass
+class Backfill:
+    """
+    Derived data recomputed by a BackfillRunner: primary key ranges of chunk_size ids, one
+    transaction each, throttled on replica lag and load, resumed from its redis checkpoint
+    """
+
+    name: str
+    table: str
+    description: str
+    fn: Callable[[AsyncSession, int, int], Awaitable[int]]
+    chunk_size: int = 1000
+    lock = "ROW EXCLUSIVE"
+
+    def statements(self) -> list[str]:
+        return [f"-- {self.description}, {self.chunk_size} ids per transaction"]
+
+    def impact(self, stats: dict) -> str:
+        chunks = -(-stats["rows"] // self.chunk_size)
+        return f"held per chunk, ~{chunks:,} chunks ({describe_size(stats)})"
+
+    def create_runner(
+        self,
+        db_engine: AsyncEngine,
+        session_factory: async_sessionmaker[AsyncSession],
+        redis: Redis | None,
+        throttle: BackfillThrottle,
+    ) -> BackfillRunner:
+        return BackfillRunner(
+            name=self.name,
+            table=self.table,
+            fn=self.fn,
+            chunk_size=self.chunk_size,
+            db_engine=db_engine,
+            session_factory=session_factory,
+            redis=redis,
+            throttle=throttle,
+        )
+
+    async def run(self, context: MigrationContext):
+        runner = self.create_runner(
+            db_engine=context.db_engine,
+            session_factory=context.session_factory,
+            redis=context.redis,
+            throttle=context.throttle,
+        )
+        await runner.run()
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    steps: list = field(default_factory=list)
+
+
+async def get_applied_versions(conn: AsyncConnection) -> set[int]:
+    result = await conn.execute(text("SELECT to_regclass(:table)"), {"table": MIGRATION_TABLE})
+
+    if result.scalar() is None:
+        return set()
+
+    result = await conn.execute(text(f"SELECT version FROM {MIGRATION_TABLE}"))
+    return set(result.scalars().all())
+
+
+async def get_table_stats(conn: AsyncConnection, table: str) -> dict:
+    # to_regclass parses the name, table names can be keywords ("user")
+    name = conn.dialect.identifier_preparer.quote(table)
+    result = await conn.execute(text(TABLE_STATS_QUERY), {"table": name})
+    row = result.mappings().first()
+    return dict(row) if row else {"rows": 0, "bytes": 0}
+
+
+async def plan_migrations(db_engine: AsyncEngine, migrations: list[Migration]) -> list[dict]:
+    """
+    Dry run: output the pending migrations with each step's statements and estimated lock
+    impact, nothing is changed
+    """
+    plan = []
+
+    async with db_engine.connect() as conn:
+        applied = await get_applied_versions(conn=conn)
+
+        for migration in migrations:
+            if migration.version in applied:
+                continue
+
+            steps = []
+
+            for step in migration.steps:
+                stats = await get_table_stats(conn=conn, table=step.table) if step.table else {}
+                steps.append(
+                    {
+                        "table": step.table,
+                        "statements": step.statements(),
+                        "lock": step.lock,
+                        "effect": LOCK_EFFECTS[step.lock],
+                        "impact": step.impact(stats),
+                    }
+                )
+
+            plan.append({"version": migration.version, "name": migration.name, "steps": steps})
+
+    return plan
+
+
+async def apply_migrations(
+    db_engine: AsyncEngine,
+    migrations: list[Migration],
+    lock_timeout_ms: int,
+    throttle: BackfillThrottle,
+    redis: Redis | None = None,
+) -> list[int]:
+    """
+    output: versions applied
+
+    Steps run in autocommit (CREATE INDEX CONCURRENTLY cannot run in a transaction) and a
+    version is recorded once all its steps succeeded. Steps are idempotent, so a migration
+    that failed halfway is resumed by running it again.
+    DDL gives up after lock_timeout_ms instead of queueing every query behind its lock.
+    Backfills are throttled by throttle and checkpointed in redis, when given.
+    """
+    session_factory = async_sessionmaker(bind=db_engine)
+    applied_now = []
+
+    async with db_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+        try:
+            await conn.execute(text(f"SET lock_timeout = {int(lock_timeout_ms)}"))
+            await conn.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {MIGRATION_TABLE} ("
+                    "version INTEGER PRIMARY KEY, name TEXT NOT NULL, "
+                    "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+                )
+            )
+            applied = await get_applied_versions(conn=conn)
+            context = MigrationContext(
+                conn=conn,
+                db_engine=db_engine,
+                session_factory=session_factory,
+                redis=redis,
+                throttle=throttle,
+            )
+
+            for migration in migrations:
+                if migration.version in applied:
+                    continue
+
+                for step in migration.steps:
+                    await step.run(context=context)
+
+                await conn.execute(
+                    text(f"INSERT INTO {MIGRATION_TABLE} (version, name) VALUES (:version, :name)"),
+                    {"version": migration.version, "name": migration.name},
+                )
+                applied_now.append(migration.version)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+    return applied_now
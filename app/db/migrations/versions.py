@@ -0,0 +1,152 @@
+from app.comment.services import reconcile_comment_counters
+from app.db.migrations.core import (
+    AddColumn,
+    AddIndex,
+    AddTrigger,
+    AddUniqueConstraint,
+    Backfill,
+    CreateTables,
+    Migration,
+    ReplaceIndex,
+    Sql,
+)
+from app.db.schema import (
+    POST_SEARCH_VECTOR_FUNCTION,
+    POST_SEARCH_VECTOR_TRIGGER,
+    Base,
+    Comment,
+    CommentUpvote,
+    Post,
+    PostUpvote,
+    SubredditFollow,
+)
+from app.post.services import fill_post_search_vectors, reconcile_post_counters
+from sqlalchemy import UniqueConstraint, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# steps must be safe to run again: a fresh database gets the whole schema from the baseline,
+# every later step then finds its column, index, constraint or index definition already there
+INDEXES = {index.name: index for table in Base.metadata.sorted_tables for index in table.indexes}
+
+
+def unique_constraint(model) -> UniqueConstraint:
+    (constraint,) = [arg for arg in model.__table_args__ if isinstance(arg, UniqueConstraint)]
+    return constraint
+
+
+def backfill_counters() -> list[Backfill]:
+    return [
+        Backfill(
+            name="post_counters",
+            table="post",
+            description="post counters",
+            fn=lambda db, start_id, end_id: reconcile_post_counters(
+                db=db, start_id=start_id, end_id=end_id
+            ),
+        ),
+        Backfill(
+            name="comment_counters",
+            table="comment",
+            description="comment counters",
+            fn=lambda db, start_id, end_id: reconcile_comment_counters(
+                db=db, start_id=start_id, end_id=end_id
+            ),
+        ),
+    ]
+
+
+def delete_duplicates(table: str, columns: list[str]) -> Backfill:
+    # the oldest row of each group is kept, the newer ones are deleted by ranges of their ids
+    matches = " AND ".join(f"newer.{column} = older.{column}" for column in columns)
+    query = text(
+        f"DELETE FROM {table} newer USING {table} older "
+        f"WHERE {matches} AND newer.id > older.id "
+        "AND newer.id >= :start_id AND newer.id < :end_id"
+    )
+
+    async def fn(db: AsyncSession, start_id: int, end_id: int) -> int:
+        result = await db.execute(query, {"start_id": start_id, "end_id": end_id})
+        return result.rowcount
+
+    return Backfill(
+        name=f"{table}_duplicates", table=table, description=f"duplicate {table} rows", fn=fn
+    )
+
+
+MIGRATIONS = [
+    Migration(version=1, name="baseline", steps=[CreateTables(metadata=Base.metadata)]),
+    Migration(
+        version=2,
+        name="post and comment counters",
+        steps=[
+            AddColumn(column=Post.__table__.c.upvote_count),
+            AddColumn(column=Post.__table__.c.downvote_count),
+            AddColumn(column=Post.__table__.c.comment_count),
+            AddColumn(column=Comment.__table__.c.upvote_count),
+            AddColumn(column=Comment.__table__.c.downvote_count),
+            AddColumn(column=Comment.__table__.c.reply_count),
+            *backfill_counters(),
+        ],
+    ),
+    Migration(
+        version=3,
+        name="post and subreddit search",
+        steps=[
+            Sql(table="", sql="CREATE EXTENSION IF NOT EXISTS pg_trgm", lock="NONE"),
+            AddIndex(index=INDEXES["ix_post_title_trgm"]),
+            AddIndex(index=INDEXES["ix_subreddit_name_trgm"]),
+            # the trigger sets the vector of new and edited posts, the backfill the older ones,
+            # then the index is built over the filled column
+            AddColumn(column=Post.__table__.c.search_vector),
+            AddTrigger(
+                table="post",
+                function=POST_SEARCH_VECTOR_FUNCTION,
+                trigger=POST_SEARCH_VECTOR_TRIGGER,
+            ),
+            Backfill(
+                name="post_search_vector",
+                table="post",
+                description="post search vectors",
+                fn=lambda db, start_id, end_id: fill_post_search_vectors(
+                    db=db, start_id=start_id, end_id=end_id
+                ),
+            ),
+            AddIndex(index=INDEXES["ix_post_search_vector"]),
+        ],
+    ),
+    Migration(
+        version=4,
+        name="unique votes and follows, comment pagination and foreign key indexes",
+        steps=[
+            # the user_id indexes first, deleting duplicates looks up the older rows by user
+            *[
+                AddIndex(index=INDEXES[name])
+                for name in [
+                    "ix_post_upvote_user_id",
+                    "ix_comment_upvote_user_id",
+                    "ix_subreddit_follow_user_id",
+                ]
+            ],
+            delete_duplicates(table="post_upvote", columns=["post_id", "user_id"]),
+            delete_duplicates(table="comment_upvote", columns=["comment_id", "user_id"]),
+            delete_duplicates(table="subreddit_follow", columns=["subreddit_id", "user_id"]),
+            AddUniqueConstraint(constraint=unique_constraint(PostUpvote)),
+            AddUniqueConstraint(constraint=unique_constraint(CommentUpvote)),
+            AddUniqueConstraint(constraint=unique_constraint(SubredditFollow)),
+            ReplaceIndex(index=INDEXES["ix_comment_post_id_score"]),
+            ReplaceIndex(index=INDEXES["ix_comment_parent_comment_id_score"]),
+            *[
+                AddIndex(index=INDEXES[name])
+                for name in [
+                    "ix_subreddit_user_id",
+                    "ix_post_subreddit_id",
+                    "ix_post_user_id",
+                    "ix_comment_post_id",
+                    "ix_comment_user_id",
+                ]
+            ],
+            # removed duplicate votes were counted
+            *backfill_counters(),
+        ],
+    ),
+]
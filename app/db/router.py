@@ -1,7 +1,14 @@
-from app.db.core import get_db_engine
-from app.db.services import create_tables, disable_extensions, drop_tables, enable_extensions
+from app.db.backfill import BackfillThrottle, clear_backfill_checkpoints, get_backfill_throttle
+from app.db.core import get_db_engine, get_db_metrics, get_db_session_factory
+from app.db.metrics import DBMetrics
+from app.db.migrations.core import apply_migrations, plan_migrations
+from app.db.migrations.versions import MIGRATIONS, backfill_counters
+from app.db.schema_check import check_schema
+from app.db.services import disable_extensions, drop_tables, enable_extensions
+from app.keyspace.core import Keyspace, get_keyspaces
+from app.settings import get_migration_lock_timeout_ms
 from fastapi import APIRouter, Depends
-from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
 
 database_router = APIRouter(prefix="/db", tags=["DB"])
 
@@ -12,12 +19,31 @@ async def drop_databaset_route(db_engine: AsyncEngine = Depends(get_db_engine)):
 
 
 @database_router.put(path="")
-async def reset_database_route(db_engine: AsyncEngine = Depends(get_db_engine)):
+async def reset_database_route(
+    db_engine: AsyncEngine = Depends(get_db_engine),
+    migration_lock_timeout_ms: int = Depends(get_migration_lock_timeout_ms),
+    backfill_throttle: BackfillThrottle = Depends(get_backfill_throttle),
+    keyspaces: dict[str, Keyspace] = Depends(get_keyspaces),
+):
+    redis = keyspaces["db"].redis
     await drop_tables(db_engine=db_engine)
     await disable_extensions(db_engine=db_engine)
+    # checkpoints point into the dropped tables
+    await clear_backfill_checkpoints(redis=redis)
 
-    await create_tables(db_engine=db_engine)
-    await enable_extensions(db_engine=db_engine)
+    await apply_migrations(
+        db_engine=db_engine,
+        migrations=MIGRATIONS,
+        lock_timeout_ms=migration_lock_timeout_ms,
+        throttle=backfill_throttle,
+        redis=redis,
+    )
+
+
+@database_router.get(path="/migrations")
+async def plan_migrations_route(db_engine: AsyncEngine = Depends(get_db_engine)):
+    # dry run of the pending migrations, they are applied with `make migrate`
+    return await plan_migrations(db_engine=db_engine, migrations=MIGRATIONS)
 
 
 @database_router.post(path="/extensions")
@@ -28,3 +54,40 @@ async def enable_extensions_route(db_engine: AsyncEngine = Depends(get_db_engine
 @database_router.delete(path="/extensions")
 async def disable_extensions_route(db_engine: AsyncEngine = Depends(get_db_engine)):
     await disable_extensions(db_engine=db_engine)
+
+
+@database_router.post(path="/counters")
+async def reconcile_counters_route(
+    db_engine: AsyncEngine = Depends(get_db_engine),
+    session_factory: async_sessionmaker[AsyncSession] = Depends(get_db_session_factory),
+    backfill_throttle: BackfillThrottle = Depends(get_backfill_throttle),
+    keyspaces: dict[str, Keyspace] = Depends(get_keyspaces),
+):
+    # chunked like the migration backfills, a single recount would lock every post and comment
+    # until it commits
+    counts = []
+
+    for backfill in backfill_counters():
+        runner = backfill.create_runner(
+            db_engine=db_engine,
+            session_factory=session_factory,
+            redis=keyspaces["db"].redis,
+            throttle=backfill_throttle,
+        )
+        counts.append((await runner.run())["changed"])
+
+    post_count, comment_count = counts
+    return {"post_count": post_count, "comment_count": comment_count}
+
+
+@database_router.get(path="/indexes")
+async def check_indexes_route(db_engine: AsyncEngine = Depends(get_db_engine)):
+    return await check_schema(db_engine=db_engine)
+
+
+@database_router.get(path="/metrics")
+async def get_db_metrics_route(
+    db_engine: AsyncEngine = Depends(get_db_engine), db_metrics: DBMetrics = Depends(get_db_metrics)
+):
+    # counters are per worker process
+    return db_metrics.snapshot(db_engine=db_engine)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import ForeignKey, UniqueConstraint, func
+from sqlalchemy import DDL, ForeignKey, Index, UniqueConstraint, event, func
 from sqlalchemy.dialects import postgresql as pg
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
@@ -36,7 +36,7 @@ class SubredditFollow(Base):
     subreddit_id: Mapped[int] = mapped_column(ForeignKey(column=Subreddit.id, ondelete="CASCADE"))
     user_id: Mapped[int] = mapped_column(ForeignKey(column=User.id, ondelete="CASCADE"))
 
-    UniqueConstraint(subreddit_id, user_id)
+    __table_args__ = (UniqueConstraint(subreddit_id, user_id),)
 
 
 class Post(Base):
@@ -45,6 +45,12 @@ class Post(Base):
     body: Mapped[list[dict]] = mapped_column(pg.JSONB)
     user_id: Mapped[int] = mapped_column(ForeignKey(column=User.id, ondelete="CASCADE"))
     subreddit_id: Mapped[int] = mapped_column(ForeignKey(column=Subreddit.id, ondelete="CASCADE"))
+    upvote_count: Mapped[int] = mapped_column(pg.INTEGER, default=0, server_default="0")
+    downvote_count: Mapped[int] = mapped_column(pg.INTEGER, default=0, server_default="0")
+    comment_count: Mapped[int] = mapped_column(pg.INTEGER, default=0, server_default="0")
+    search_vector: Mapped[str | None] = mapped_column(
+        pg.TSVECTOR, nullable=True, deferred=True
+    )  # title and Markdown contents, set by the post_search_vector trigger, never loaded
 
 
 class Comment(Base):
@@ -55,6 +61,9 @@ class Comment(Base):
     parent_comment_id: Mapped[int | None] = mapped_column(
         ForeignKey(column="comment.id", ondelete="CASCADE"), nullable=True
     )  # None = post_comment
+    upvote_count: Mapped[int] = mapped_column(pg.INTEGER, default=0, server_default="0")
+    downvote_count: Mapped[int] = mapped_column(pg.INTEGER, default=0, server_default="0")
+    reply_count: Mapped[int] = mapped_column(pg.INTEGER, default=0, server_default="0")
 
 
 class PostUpvote(Base):
@@ -62,7 +71,9 @@ class PostUpvote(Base):
     value: Mapped[bool] = mapped_column(pg.BOOLEAN)
     post_id: Mapped[int] = mapped_column(ForeignKey(column=Post.id, ondelete="CASCADE"))
     user_id: Mapped[int] = mapped_column(ForeignKey(column=User.id, ondelete="CASCADE"))
-    UniqueConstraint(post_id, user_id)
+
+    # one vote per user, the arbiter of the ON CONFLICT vote upsert
+    __table_args__ = (UniqueConstraint(post_id, user_id),)
 
 
 class CommentUpvote(Base):
@@ -70,4 +81,75 @@ class CommentUpvote(Base):
     value: Mapped[bool] = mapped_column(pg.BOOLEAN)
     comment_id: Mapped[int] = mapped_column(ForeignKey(column=Comment.id, ondelete="CASCADE"))
     user_id: Mapped[int] = mapped_column(ForeignKey(column=User.id, ondelete="CASCADE"))
-    UniqueConstraint(comment_id, user_id)
+
+    __table_args__ = (UniqueConstraint(comment_id, user_id),)
+
+
+# keyset pagination of comments by (score, id), top-level ones within a post and replies
+# within a parent comment. The partial predicates keep each index to the rows it serves,
+# the replies index also backs the parent_comment_id foreign key.
+Index(
+    "ix_comment_post_id_score",
+    Comment.post_id,
+    Comment.upvote_count.desc(),
+    Comment.id.desc(),
+    postgresql_where=Comment.parent_comment_id.is_(None),
+)
+Index(
+    "ix_comment_parent_comment_id_score",
+    Comment.parent_comment_id,
+    Comment.upvote_count.desc(),
+    Comment.id.desc(),
+    postgresql_where=Comment.parent_comment_id.isnot(None),
+)
+
+# foreign keys not leading another index: ON DELETE CASCADE/RESTRICT checks, counter
+# reconciliation and per-user lookups would otherwise scan the referencing table
+Index("ix_subreddit_user_id", Subreddit.user_id)
+Index("ix_subreddit_follow_user_id", SubredditFollow.user_id)
+Index("ix_post_subreddit_id", Post.subreddit_id)
+Index("ix_post_user_id", Post.user_id)
+Index("ix_comment_post_id", Comment.post_id)
+Index("ix_comment_user_id", Comment.user_id)
+Index("ix_post_upvote_user_id", PostUpvote.user_id)
+Index("ix_comment_upvote_user_id", CommentUpvote.user_id)
+
+# trigram search, filtered with `%` and ordered by `<->`
+Index(
+    "ix_post_title_trgm",
+    Post.title,
+    postgresql_using="gin",
+    postgresql_ops={"title": "gin_trgm_ops"},
+)
+Index(
+    "ix_subreddit_name_trgm",
+    Subreddit.name,
+    postgresql_using="gin",
+    postgresql_ops={"name": "gin_trgm_ops"},
+)
+
+# full-text search over title and body
+Index("ix_post_search_vector", Post.search_vector, postgresql_using="gin")
+
+# a trigger instead of a stored generated column, which would rewrite the whole table when added
+POST_SEARCH_VECTOR_FUNCTION = """
+CREATE OR REPLACE FUNCTION post_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector = setweight(to_tsvector('english', NEW.title), 'A') || setweight(
+        jsonb_to_tsvector(
+            'english', jsonb_path_query_array(NEW.body, '$[*].content'), '["string"]'
+        ),
+        'B'
+    );
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+POST_SEARCH_VECTOR_TRIGGER = """
+CREATE OR REPLACE TRIGGER post_search_vector BEFORE INSERT OR UPDATE OF title, body ON post
+FOR EACH ROW EXECUTE FUNCTION post_search_vector()
+"""
+
+event.listen(Post.__table__, "after_create", DDL(POST_SEARCH_VECTOR_FUNCTION))
+event.listen(Post.__table__, "after_create", DDL(POST_SEARCH_VECTOR_TRIGGER))
+event.listen(Post.__table__, "after_drop", DDL("DROP FUNCTION IF EXISTS post_search_vector()"))
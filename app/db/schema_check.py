@@ -0,0 +1,197 @@
+import asyncio
+import json
+import sys
+from app.db.schema import Base
+from app.settings import Settings
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+
+# lookups made by the services: equality columns then order-by columns, with the row filter
+# the query always applies (matched against the predicate of a partial index)
+QUERY_PATTERNS = [
+    {
+        "table": "comment",
+        "columns": ["post_id", "upvote_count", "id"],
+        "where": "parent_comment_id IS NULL",
+        "query": "comment.services.get_comments",
+    },
+    {
+        "table": "comment",
+        "columns": ["parent_comment_id", "upvote_count", "id"],
+        "where": "parent_comment_id IS NOT NULL",
+        "query": "comment.services.get_comment_replies",
+    },
+    {
+        "table": "post_upvote",
+        "columns": ["post_id", "user_id"],
+        "where": None,
+        "query": "vote.services.set_vote",
+    },
+    {
+        "table": "comment_upvote",
+        "columns": ["comment_id", "user_id"],
+        "where": None,
+        "query": "vote.services.set_vote",
+    },
+    {
+        "table": "subreddit_follow",
+        "columns": ["subreddit_id", "user_id"],
+        "where": None,
+        "query": "subreddit.services.follow_subreddit",
+    },
+]
+
+INDEXES_QUERY = """
+SELECT
+    t.relname AS table,
+    i.relname AS index,
+    am.amname AS method,
+    array(
+        SELECT coalesce(a.attname, '(expression)')
+        FROM unnest(x.indkey) WITH ORDINALITY AS k(attnum, n)
+        LEFT JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum
+        WHERE k.n <= x.indnkeyatts
+        ORDER BY k.n
+    ) AS columns,
+    pg_get_expr(x.indpred, x.indrelid) AS predicate,
+    x.indisvalid AS valid
+FROM pg_index x
+JOIN pg_class i ON i.oid = x.indexrelid
+JOIN pg_class t ON t.oid = x.indrelid
+JOIN pg_am am ON am.oid = i.relam
+JOIN pg_namespace ns ON ns.oid = t.relnamespace
+WHERE ns.nspname = current_schema()
+"""
+
+
+def is_wrapped(expression: str) -> bool:
+    """
+    output: True for "(...)", False for "(a) AND (b)"
+    """
+    if not expression.startswith("("):
+        return False
+
+    depth = 0
+
+    for i, char in enumerate(expression):
+        depth += {"(": 1, ")": -1}.get(char, 0)
+
+        if depth == 0:
+            return i == len(expression) - 1
+
+    return False
+
+
+def normalize_predicate(predicate: str | None) -> str | None:
+    if predicate is None:
+        return None
+
+    # pg_get_expr wraps the predicate in parentheses
+    while is_wrapped(predicate):
+        predicate = predicate[1:-1]
+
+    return " ".join(predicate.split()).lower()
+
+
+def covers(index: dict, table: str, columns: list[str], where: str | None) -> bool:
+    """
+    output: True if a valid btree index on table starts with columns and its predicate,
+    if any, is the one the lookup always applies
+    """
+    return (
+        index["table"] == table
+        and index["method"] == "btree"
+        and index["valid"]
+        and index["columns"][: len(columns)] == columns
+        and index["predicate"] in (None, normalize_predicate(where))
+    )
+
+
+def get_lookups() -> list[dict]:
+    """
+    output: QUERY_PATTERNS and one lookup per foreign key of the schema
+    """
+    lookups = list(QUERY_PATTERNS)
+
+    for table in Base.metadata.sorted_tables:
+        for foreign_key in table.foreign_key_constraints:
+            columns = [column.name for column in foreign_key.columns]
+            # rows with a NULL reference are never looked up through the foreign key
+            where = " AND ".join(
+                f"{column.name} IS NOT NULL" for column in foreign_key.columns if column.nullable
+            )
+            lookups.append(
+                {
+                    "table": table.name,
+                    "columns": columns,
+                    "where": where or None,
+                    "query": f"foreign key to {foreign_key.referred_table.name}",
+                }
+            )
+
+    return lookups
+
+
+async def get_indexes(conn: AsyncConnection) -> list[dict]:
+    result = await conn.execute(text(INDEXES_QUERY))
+    indexes = [dict(row) for row in result.mappings()]
+
+    for index in indexes:
+        index["predicate"] = normalize_predicate(index["predicate"])
+
+    return indexes
+
+
+async def check_schema(db_engine: AsyncEngine) -> dict:
+    """
+    output: {"missing_indexes", "unbuilt_indexes", "invalid_indexes"}
+    missing = lookups no index serves, unbuilt = declared in the schema but absent from the
+    database (create_all never adds indexes to existing tables), invalid = failed builds
+    """
+    async with db_engine.connect() as conn:
+        indexes = await get_indexes(conn=conn)
+
+    built = {index["index"] for index in indexes}
+    declared = [
+        (table.name, index.name) for table in Base.metadata.sorted_tables for index in table.indexes
+    ]
+
+    return {
+        "missing_indexes": [
+            lookup
+            for lookup in get_lookups()
+            if not any(
+                covers(
+                    index=index,
+                    table=lookup["table"],
+                    columns=lookup["columns"],
+                    where=lookup["where"],
+                )
+                for index in indexes
+            )
+        ],
+        "unbuilt_indexes": [
+            {"table": table, "index": name} for table, name in declared if name not in built
+        ],
+        "invalid_indexes": [
+            {"table": index["table"], "index": index["index"]}
+            for index in indexes
+            if not index["valid"]
+        ],
+    }
+
+
+async def main() -> int:
+    db_engine = create_async_engine(url=Settings().DB_URL)
+
+    try:
+        report = await check_schema(db_engine=db_engine)
+    finally:
+        await db_engine.dispose()
+
+    print(json.dumps(report, indent=2))
+    return int(any(report.values()))
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,16 +1,30 @@
+from app.db.migrations.core import MIGRATION_TABLE
 from app.db.schema import Base
 from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncEngine
 
 
+def get_constraint_name(error: IntegrityError) -> str | None:
+    """
+    output: name of the violated constraint (e.g. "subreddit_name_key") | None
+
+    """
+    # asyncpg's exception is chained behind the DBAPI adapter's
+    return getattr(error.orig.__cause__, "constraint_name", None)
+
+
 async def create_tables(db_engine: AsyncEngine):
     async with db_engine.begin() as conn:
+        # trigram indexes need the operator classes from pg_trgm
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
         await conn.run_sync(Base.metadata.create_all)
 
 
 async def drop_tables(db_engine: AsyncEngine):
     async with db_engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
+        await conn.execute(text(f"DROP TABLE IF EXISTS {MIGRATION_TABLE};"))
 
 
 async def enable_extensions(db_engine: AsyncEngine):
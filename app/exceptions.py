@@ -1,12 +1,15 @@
 class BaseError(Exception):
-    def __init__(self, status_code: int, message: str):
+    def __init__(self, status_code: int, message: str, headers: dict[str, str] | None = None):
         self.status_code = status_code
         self.message = message
+        self.headers = headers
 
     def content(self):
         return {"message": self.message}
 
 
 class RateLimitExceeded(BaseError):
-    def __init__(self):
-        super().__init__(status_code=429, message="Rate limit exceeded. Try again later.")
+    def __init__(self, headers: dict[str, str] | None = None):
+        super().__init__(
+            status_code=429, message="Rate limit exceeded. Try again later.", headers=headers
+        )
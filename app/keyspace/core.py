@@ -0,0 +1,95 @@
+from app.cache.core import INVALIDATE_ALL, INVALIDATION_CHANNEL
+from fastapi import FastAPI, Request
+from redis.asyncio import Redis
+
+# every redis key starts with the name of the subsystem that owns it
+KEYSPACES = ("cache", "rate_limit", "refresh_token", "db", "vote")
+
+
+class Keyspace:
+    """
+    The keys of one subsystem ("{name}:*") and the redis instance holding them.
+    Keyspaces share the default instance unless REDIS_KEYSPACE_URLS moves them elsewhere,
+    so purging and sizing only ever touch keys under the prefix.
+    """
+
+    def __init__(self, name: str, redis: Redis, dedicated: bool = False):
+        self.name = name
+        self.redis = redis
+        self.dedicated = dedicated  # owns its connection pool
+        self.pattern = f"{name}:*"
+
+    async def purge(self, batch_size: int = 1000) -> int:
+        """
+        output: number of keys removed
+        """
+        # SCAN + UNLINK instead of KEYS/FLUSHDB: redis is never blocked on the whole keyspace
+        # and the memory is reclaimed in the background
+        deleted = 0
+
+        async for batch in self.scan_batches(batch_size=batch_size):
+            deleted += await self.redis.unlink(*batch)
+
+        # the local tier of every worker still holds the purged cache entries
+        if self.name == "cache":
+            await self.redis.publish(INVALIDATION_CHANNEL, INVALIDATE_ALL)
+
+        return deleted
+
+    async def memory(self, batch_size: int = 1000, max_keys: int = 100_000) -> dict:
+        """
+        output: {"keys", "bytes", "complete"}, complete is False when the scan stopped at max_keys
+        """
+        keys = 0
+        size = 0
+
+        async for batch in self.scan_batches(batch_size=batch_size):
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in batch:
+                    pipe.memory_usage(key)
+
+                sizes = await pipe.execute()
+
+            keys += len(batch)
+            size += sum(key_size or 0 for key_size in sizes)  # None for keys expired meanwhile
+
+            if keys >= max_keys:
+                return {"keys": keys, "bytes": size, "complete": False}
+
+        return {"keys": keys, "bytes": size, "complete": True}
+
+    async def scan_batches(self, batch_size: int):
+        cursor = 0
+
+        while True:
+            cursor, batch = await self.redis.scan(
+                cursor=cursor, match=self.pattern, count=batch_size
+            )
+
+            if batch:
+                yield batch
+
+            if cursor == 0:
+                return
+
+
+def set_keyspaces(app: FastAPI):
+    urls = app.state.settings.REDIS_KEYSPACE_URLS
+    app.state.keyspaces = {}
+
+    for name in KEYSPACES:
+        if name in urls:
+            redis = Redis.from_url(urls[name], decode_responses=True)
+            app.state.keyspaces[name] = Keyspace(name=name, redis=redis, dedicated=True)
+        else:
+            app.state.keyspaces[name] = Keyspace(name=name, redis=app.state.redis)
+
+
+def get_keyspaces(request: Request) -> dict[str, Keyspace]:
+    return request.app.state.keyspaces
+
+
+async def close_keyspaces(keyspaces: dict[str, Keyspace]):
+    for keyspace in keyspaces.values():
+        if keyspace.dedicated:
+            await keyspace.redis.aclose()
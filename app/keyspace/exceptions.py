@@ -0,0 +1,6 @@
+from app.exceptions import BaseError
+
+
+class KeyspaceNotFound(BaseError):
+    def __init__(self):
+        super().__init__(status_code=404, message="Keyspace Not Found!")
@@ -0,0 +1,18 @@
+from app.keyspace.core import Keyspace, get_keyspaces
+from app.keyspace.exceptions import KeyspaceNotFound
+from fastapi import APIRouter, Depends
+
+keyspace_router = APIRouter(prefix="/keyspaces", tags=["Keyspace"])
+
+
+@keyspace_router.get(path="/memory", status_code=200)
+async def get_keyspaces_memory_route(keyspaces: dict[str, Keyspace] = Depends(get_keyspaces)):
+    return {name: await keyspace.memory() for name, keyspace in keyspaces.items()}
+
+
+@keyspace_router.delete(path="/{name}", status_code=200)
+async def purge_keyspace_route(name: str, keyspaces: dict[str, Keyspace] = Depends(get_keyspaces)):
+    if name not in keyspaces:
+        raise KeyspaceNotFound()
+
+    return {"deleted": await keyspaces[name].purge()}
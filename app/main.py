@@ -1,16 +1,31 @@
+from app.auth.hasher import close_password_hasher, set_password_hasher
+from app.auth.services import set_refresh_token_store
+from app.auth.verifier import set_token_verifier
+from app.cache.core import close_cache, open_cache, set_cache
 from app.config import set_exception_handlers, set_middlewares, set_routers, set_swaggerui
-from app.db.core import close_db, set_db
+from app.db.core import close_db, close_db_replicas, open_db_replicas, set_db
+from app.keyspace.core import close_keyspaces, set_keyspaces
+from app.rate_limit import set_rate_limiter
 from app.redis import close_redis, set_redis
 from app.settings import set_settings
+from app.vote.core import close_vote_buffer, open_vote_buffer, set_vote_buffer
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    open_db_replicas(app=app)
+    await open_cache(cache=app.state.cache)
+    await open_vote_buffer(vote_buffer=app.state.vote_buffer)
     yield
+    await close_vote_buffer(vote_buffer=app.state.vote_buffer)
+    await close_cache(cache=app.state.cache)
+    await close_keyspaces(keyspaces=app.state.keyspaces)
     await close_redis(redis=app.state.redis)
+    await close_db_replicas(app=app)
     await close_db(db_engine=app.state.db_engine)
+    close_password_hasher(password_hasher=app.state.password_hasher)
 
 
 def create_app():
@@ -22,6 +37,13 @@ def create_app():
     set_settings(app=app)
     set_db(app=app)
     set_redis(app=app)
+    set_keyspaces(app=app)
+    set_cache(app=app)
+    set_rate_limiter(app=app)
+    set_password_hasher(app=app)
+    set_token_verifier(app=app)
+    set_refresh_token_store(app=app)
+    set_vote_buffer(app=app)
 
     return app
 
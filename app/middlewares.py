@@ -1,9 +1,9 @@
 import uuid
 from app.exceptions import BaseError, RateLimitExceeded
+from app.rate_limit import RateLimiter
 from fastapi import Request, Response
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
-from redis.asyncio import Redis
 from typing import Awaitable, Callable
 
 
@@ -18,20 +18,28 @@ async def generate_request_id_middleware(
 
 
 async def rate_limit_middleware(request: Request, next: Callable[[Request], Awaitable[Response]]):
-    if request.client:
-        host = request.client.host
-        redis: Redis = request.app.state.redis
-        rate_limit = request.app.state.settings.RATE_LIMIT
-        count = await redis.incr(host)
+    rate_limiter: RateLimiter = request.app.state.rate_limiter
+    result = await rate_limiter.allow(request)
 
-        if count == 1:
-            # Set expiration only when key is created
-            await redis.expire(host, 60)
+    if result is None:
+        return await next(request)
 
-        if count > rate_limit:
-            raise RateLimitExceeded()
+    allowed, limit, remaining = result
+    headers = {"X-RateLimit-Limit": str(limit), "X-RateLimit-Remaining": str(max(remaining, 0))}
 
-    return await next(request)
+    if not allowed:
+        headers["Retry-After"] = str(rate_limiter.get_retry_after_sec(limit=limit))
+        raise RateLimitExceeded(headers=headers)
+
+    try:
+        response = await next(request)
+    except BaseError as e:
+        # errors become responses in exceptions_handler_middleware, outside of this one
+        e.headers = {**headers, **(e.headers or {})}
+        raise
+
+    response.headers.update(headers)
+    return response
 
 
 async def exceptions_handler_middleware(
@@ -43,7 +51,7 @@ async def exceptions_handler_middleware(
 
     except Exception as e:
         if isinstance(e, BaseError):
-            return JSONResponse(status_code=e.status_code, content=e.content())
+            return JSONResponse(status_code=e.status_code, content=e.content(), headers=e.headers)
 
         if isinstance(e, RequestValidationError):
             return JSONResponse(
@@ -34,3 +34,12 @@ class PostUpdate(Model):
 
 class PostUpvoteCreate(Model):
     value: bool
+
+
+class PostUpvoteUpdate(Model):
+    value: bool | None  # None removes the vote
+
+
+class PostUpvoteRead(Model):
+    upvote_count: int
+    downvote_count: int
@@ -1,19 +1,28 @@
 from app.auth.services import get_current_user_id
-from app.db.core import get_db
+from app.cache.core import Cache, get_cache
+from app.db.core import get_db, get_db_read
 from app.post.exceptions import PostNotFound, PostUpvoteNotFound
-from app.post.models import PostCreate, PostRead, PostReads, PostUpdate, PostUpvoteCreate
+from app.post.models import (
+    PostCreate,
+    PostRead,
+    PostReads,
+    PostUpdate,
+    PostUpvoteCreate,
+    PostUpvoteRead,
+    PostUpvoteUpdate,
+)
 from app.post.services import (
     create_post,
     delete_post,
-    delete_post_upvote,
     get_post,
     get_posts,
-    toggle_post_upvote,
+    search_posts,
     update_post,
-    upvote_post,
 )
-from fastapi import APIRouter, Depends
+from app.vote.core import VoteBuffer, cast_vote, get_vote_buffer
+from fastapi import APIRouter, Depends, Response
 from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Literal
 
 post_router = APIRouter(prefix="/subreddits/{subreddit_id}/posts", tags=["Post"])
 
@@ -25,7 +34,7 @@ async def create_post_route(
     db: AsyncSession = Depends(get_db),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    post_id = await create_post(
+    post = await create_post(
         title=post_data.title,
         body=[elem.model_dump() for elem in post_data.body],
         user_id=current_user_id,
@@ -33,11 +42,6 @@ async def create_post_route(
         db=db,
     )
 
-    post = await get_post(post_id=post_id, db=db)
-
-    if not post:
-        raise PostNotFound()
-
     post = post._asdict()
     post.update(post.pop("Post").to_dict())
     return post
@@ -46,11 +50,13 @@ async def create_post_route(
 @post_router.get(path="", status_code=200, response_model=PostReads)
 async def get_posts_route(
     search_query: str,
+    search_mode: Literal["title", "full_text"] = "title",
     score_cursor: float | None = None,
     id_cursor: int | None = None,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_read),
 ):
-    result = await get_posts(
+    search = search_posts if search_mode == "full_text" else get_posts
+    result = await search(
         search_query=search_query, db=db, score_cursor=score_cursor, id_cursor=id_cursor
     )
     if result is None:
@@ -70,32 +76,49 @@ async def get_posts_route(
 
 
 @post_router.get(path="/{post_id}", status_code=200, response_model=PostRead)
-async def get_post_route(post_id: int, db: AsyncSession = Depends(get_db)):
-    post = await get_post(post_id=post_id, db=db)
+async def get_post_route(
+    post_id: int, db: AsyncSession = Depends(get_db_read), cache: Cache = Depends(get_cache)
+):
+    content, invalidated_at = await cache.get(namespace="post", entity_id=post_id)
 
-    if not post:
-        raise PostNotFound()
+    if content is None:
+        post = await get_post(post_id=post_id, db=db)
 
-    post = post._asdict()
-    post.update(post.pop("Post").to_dict())
-    return post
+        if not post:
+            raise PostNotFound()
+
+        post = post._asdict()
+        post.update(post.pop("Post").to_dict())
+        content = PostRead.model_validate(post).model_dump_json()
+        await cache.set(
+            namespace="post", entity_id=post_id, content=content, invalidated_at=invalidated_at
+        )
+
+    return Response(content=content, media_type="application/json")
 
 
 @post_router.delete(path="/{post_id}", status_code=200, response_model=None)
 async def delete_post_route(
     post_id: int,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    if not delete_post(post_id=post_id, user_id=current_user_id, db=db):
+    comment_ids = await delete_post(post_id=post_id, user_id=current_user_id, db=db)
+
+    if comment_ids is None:
         raise PostNotFound()
 
+    entities = [("post", post_id)] + [("comment", comment_id) for comment_id in comment_ids]
+    cache.invalidate_on_commit(*entities, db=db)
+
 
 @post_router.patch(path="/{post_id}", status_code=200, response_model=PostRead)
 async def update_post_route(
     post_id: int,
     post_data: PostUpdate,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
     current_user_id: int = Depends(get_current_user_id),
 ):
     if not await update_post(
@@ -106,6 +129,8 @@ async def update_post_route(
     ):
         raise PostNotFound()
 
+    cache.invalidate_on_commit(("post", post_id), db=db)
+
     post = await get_post(post_id=post_id, db=db)
 
     if not post:
@@ -116,26 +141,75 @@ async def update_post_route(
     return post
 
 
+@post_router.put(path="/{post_id}/upvote", status_code=200, response_model=PostUpvoteRead)
+async def set_post_upvote_route(
+    post_id: int,
+    post_vote: PostUpvoteUpdate,
+    db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
+    vote_buffer: VoteBuffer | None = Depends(get_vote_buffer),
+    current_user_id: int = Depends(get_current_user_id),
+):
+    row = await cast_vote(
+        target="post",
+        target_id=post_id,
+        user_id=current_user_id,
+        db=db,
+        cache=cache,
+        vote_buffer=vote_buffer,
+        value=post_vote.value,
+    )
+
+    if row is None:
+        raise PostNotFound()
+
+    upvote_count, downvote_count, _ = row
+    return {"upvote_count": upvote_count, "downvote_count": downvote_count}
+
+
 @post_router.post(path="/{post_id}/upvote", status_code=201, response_model=None)
 async def upvote_post_route(
     post_id: int,
     post_vote: PostUpvoteCreate,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
+    vote_buffer: VoteBuffer | None = Depends(get_vote_buffer),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    if not await upvote_post(
-        value=post_vote.value, user_id=current_user_id, post_id=post_id, db=db
+    if not await cast_vote(
+        target="post",
+        target_id=post_id,
+        user_id=current_user_id,
+        db=db,
+        cache=cache,
+        vote_buffer=vote_buffer,
+        value=post_vote.value,
     ):
-        raise PostUpvoteNotFound()
+        raise PostNotFound()
 
 
 @post_router.patch(path="/{post_id}/upvote", status_code=200, response_model=None)
 async def toggle_post_upvote_route(
     post_id: int,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
+    vote_buffer: VoteBuffer | None = Depends(get_vote_buffer),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    if not await toggle_post_upvote(user_id=current_user_id, post_id=post_id, db=db):
+    row = await cast_vote(
+        target="post",
+        target_id=post_id,
+        user_id=current_user_id,
+        db=db,
+        cache=cache,
+        vote_buffer=vote_buffer,
+        toggle=True,
+    )
+
+    if row is None:
+        raise PostNotFound()
+
+    if not row[-1]:
         raise PostUpvoteNotFound()
 
 
@@ -143,7 +217,22 @@ async def toggle_post_upvote_route(
 async def delete_post_upvote_route(
     post_id: int,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
+    vote_buffer: VoteBuffer | None = Depends(get_vote_buffer),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    if not await delete_post_upvote(user_id=current_user_id, post_id=post_id, db=db):
+    row = await cast_vote(
+        target="post",
+        target_id=post_id,
+        user_id=current_user_id,
+        db=db,
+        cache=cache,
+        vote_buffer=vote_buffer,
+        value=None,
+    )
+
+    if row is None:
+        raise PostNotFound()
+
+    if not row[-1]:
         raise PostUpvoteNotFound()
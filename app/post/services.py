@@ -6,21 +6,49 @@ from sqlalchemy.orm import aliased
 
 async def create_post(
     title: str, body: list[dict], user_id: int, subreddit_id: int, db: AsyncSession
-) -> int:
-    query = (
+):
+    """
+    output: (Post, user_display_name)
+
+    """
+    # insert and read back the author's display name in one statement
+    new_post = (
         insert(Post)
         .values(title=title, body=body, user_id=user_id, subreddit_id=subreddit_id)
-        .returning(Post.id)
+        .returning(*Post.__table__.c)
+        .cte("new_post")
+    )
+    post = aliased(Post, new_post, name="Post")
+    query = select(post, User.display_name.label("user_display_name")).join(
+        User, post.user_id == User.id, isouter=True
     )
     result = await db.execute(query)
-    post_id = result.scalars().one()
-    return post_id
+    row = result.one()
+    return row
 
 
-async def delete_post(post_id: int, user_id: int, db: AsyncSession) -> bool:
-    query = delete(Post).where(Post.id == post_id, Post.user_id == user_id)
+async def delete_post(post_id: int, user_id: int, db: AsyncSession) -> list[int] | None:
+    """
+    output: ids of the post's comments, removed by ON DELETE CASCADE | None
+
+    """
+    # the select reads the snapshot taken before the cascade, so it still sees the comments
+    deleted_post = (
+        delete(Post)
+        .where(Post.id == post_id, Post.user_id == user_id)
+        .returning(Post.id)
+        .cte("deleted_post")
+    )
+    query = select(deleted_post.c.id, Comment.id).outerjoin(
+        Comment, Comment.post_id == deleted_post.c.id
+    )
     result = await db.execute(query)
-    return result.rowcount > 0
+    rows = result.all()
+
+    if not rows:
+        return None
+
+    return [comment_id for _, comment_id in rows if comment_id is not None]
 
 
 async def update_post(post_id: int, user_id: int, post_data: dict, db: AsyncSession) -> bool:
@@ -31,26 +59,13 @@ async def update_post(post_id: int, user_id: int, post_data: dict, db: AsyncSess
 
 async def get_post(post_id: int, db: AsyncSession):
     """
-    output: (Post, user_display_name, upvote_count, downvote_count, comment_count) | None
+    output: (Post, user_display_name) | None
 
     """
-    Upvote = aliased(PostUpvote)
-    Downvote = aliased(PostUpvote)
-
     query = (
-        select(
-            Post,
-            User.display_name.label("user_display_name"),
-            func.count(func.distinct(Upvote.id)).label("upvote_count"),  # Upvotes count
-            func.count(func.distinct(Downvote.id)).label("downvote_count"),  # Downvotes count
-            func.count(func.distinct(Comment.id)).label("comment_count"),  # Comments count
-        )
+        select(Post, User.display_name.label("user_display_name"))
         .join(User, Post.user_id == User.id, isouter=True)
-        .join(Upvote, (Post.id == Upvote.post_id) & Upvote.value, isouter=True)
-        .join(Downvote, (Post.id == Downvote.post_id) & ~Downvote.value, isouter=True)
-        .join(Comment, Post.id == Comment.post_id, isouter=True)
         .where(Post.id == post_id)
-        .group_by(Post.id, User.display_name)
     )
     result = await db.execute(query)
     row = result.first()
@@ -61,62 +76,22 @@ async def get_posts(
     search_query: str, db: AsyncSession, score_cursor: float | None, id_cursor: int | None
 ):
     """
-    output: ([(Post, user_display_name, upvote_count, downvote_count, comment_count, score_cursor)], next_score_cursor, next_id_cursor) | None
+    output: ([(Post, user_display_name, score_cursor)], next_score_cursor, next_id_cursor) | None
     """
-    Upvote = aliased(PostUpvote)
-    Downvote = aliased(PostUpvote)
-
     limit = 10
+    similarity = func.similarity(Post.title, search_query)
 
-    if score_cursor is None or id_cursor is None:
-        query = (
-            select(
-                Post,
-                User.display_name.label("user_display_name"),
-                func.count(func.distinct(Upvote.id)).label("upvote_count"),
-                func.count(func.distinct(Downvote.id)).label("downvote_count"),
-                func.count(func.distinct(Comment.id)).label("comment_count"),
-                func.similarity(Post.title, search_query).label("score_cursor"),
-            )
-            .join(User, Post.user_id == User.id, isouter=True)
-            .join(Upvote, (Post.id == Upvote.post_id) & Upvote.value, isouter=True)
-            .join(Downvote, (Post.id == Downvote.post_id) & ~Downvote.value, isouter=True)
-            .join(Comment, Post.id == Comment.post_id, isouter=True)
-            .group_by(Post.id, User.display_name)
-            .order_by(
-                func.similarity(Post.title, search_query).label("score_cursor").desc(),
-                Post.id.asc(),
-            )
-            .limit(limit)
-        )
+    query = (
+        select(Post, User.display_name.label("user_display_name"), similarity.label("score_cursor"))
+        .join(User, Post.user_id == User.id, isouter=True)
+        .where(Post.title.op("%")(search_query))
+        .order_by(Post.title.op("<->")(search_query), Post.id.asc())
+        .limit(limit)
+    )
 
-    else:
-        query = (
-            select(
-                Post,
-                User.display_name.label("user_display_name"),
-                func.count(func.distinct(Upvote.id)).label("upvote_count"),
-                func.count(func.distinct(Downvote.id)).label("downvote_count"),
-                func.count(func.distinct(Comment.id)).label("comment_count"),
-                func.similarity(Post.title, search_query).label("score_cursor"),
-            )
-            .join(User, Post.user_id == User.id, isouter=True)
-            .join(Upvote, (Post.id == Upvote.post_id) & Upvote.value, isouter=True)
-            .join(Downvote, (Post.id == Downvote.post_id) & ~Downvote.value, isouter=True)
-            .join(Comment, Post.id == Comment.post_id, isouter=True)
-            .where(
-                (func.similarity(Post.title, search_query) < score_cursor)
-                | (
-                    (func.similarity(Post.title, search_query) == score_cursor)
-                    & (Post.id > id_cursor)
-                )
-            )
-            .group_by(Post.id, User.display_name)
-            .order_by(
-                func.similarity(Post.title, search_query).label("score_cursor").desc(),
-                Post.id.asc(),
-            )
-            .limit(limit)
+    if score_cursor is not None and id_cursor is not None:
+        query = query.where(
+            (similarity < score_cursor) | ((similarity == score_cursor) & (Post.id > id_cursor))
         )
 
     result = await db.execute(query)
@@ -131,23 +106,133 @@ async def get_posts(
     return (rows, next_score_cursor, next_id_cursor)
 
 
-async def upvote_post(value: bool, user_id: int, post_id: int, db: AsyncSession) -> bool:
-    query = insert(PostUpvote).values(value=value, user_id=user_id, post_id=post_id)
+async def search_posts(
+    search_query: str, db: AsyncSession, score_cursor: float | None, id_cursor: int | None
+):
+    """
+    output: ([(Post, user_display_name, score_cursor)], next_score_cursor, next_id_cursor) | None
+    """
+    limit = 10
+    ts_query = func.websearch_to_tsquery("english", search_query)
+    rank = func.ts_rank_cd(Post.search_vector, ts_query)
+
+    query = (
+        select(Post, User.display_name.label("user_display_name"), rank.label("score_cursor"))
+        .join(User, Post.user_id == User.id, isouter=True)
+        .where(Post.search_vector.op("@@")(ts_query))
+        .order_by(rank.desc(), Post.id.asc())
+        .limit(limit)
+    )
+
+    if score_cursor is not None and id_cursor is not None:
+        query = query.where(
+            (rank < score_cursor) | ((rank == score_cursor) & (Post.id > id_cursor))
+        )
+
     result = await db.execute(query)
-    return result.rowcount > 0
+    rows = result.all()
+
+    if rows == []:
+        return None
+
+    next_score_cursor = rows[-1][-1]
+    next_id_cursor = rows[-1][0].id
+
+    return (rows, next_score_cursor, next_id_cursor)
 
 
-async def delete_post_upvote(user_id: int, post_id: int, db: AsyncSession) -> bool:
-    query = delete(PostUpvote).where(PostUpvote.user_id == user_id, PostUpvote.post_id == post_id)
+async def fill_post_search_vectors(db: AsyncSession, start_id: int, end_id: int) -> int:
+    """
+    Set the search vector of the posts in [start_id, end_id) written before its trigger.
+    Returns the number of posts filled.
+    """
+    # assigning the title fires the post_search_vector trigger, which computes the vector
+    query = (
+        update(Post)
+        .where(Post.id >= start_id, Post.id < end_id, Post.search_vector.is_(None))
+        .values(title=Post.title, updated_at=Post.updated_at)
+    )
     result = await db.execute(query)
-    return result.rowcount > 0
+    return result.rowcount
 
 
-async def toggle_post_upvote(user_id: int, post_id: int, db: AsyncSession) -> bool:
+async def increment_post_counters(
+    post_id: int,
+    db: AsyncSession,
+    upvote_count: int = 0,
+    downvote_count: int = 0,
+    comment_count: int = 0,
+):
     query = (
-        update(PostUpvote)
-        .where(PostUpvote.user_id == user_id, PostUpvote.post_id == post_id)
-        .values(value=~PostUpvote.value)
+        update(Post)
+        .where(Post.id == post_id)
+        .values(
+            upvote_count=Post.upvote_count + upvote_count,
+            downvote_count=Post.downvote_count + downvote_count,
+            comment_count=Post.comment_count + comment_count,
+            updated_at=Post.updated_at,
+        )
+    )
+    await db.execute(query)
+
+
+async def reconcile_post_counters(db: AsyncSession, start_id: int, end_id: int) -> int:
+    """
+    Recompute the denormalized counters on Post from the vote and comment tables in bulk,
+    for the posts in [start_id, end_id), a BackfillRunner chunk.
+    Only drifted rows are written. Returns the number of repaired posts.
+
+    The posts are locked in id order before counting, so the counts are read once the
+    concurrent votes and comments on them committed, and those after wait for the commit.
+    """
+    votes = (
+        select(
+            PostUpvote.post_id,
+            func.count().filter(PostUpvote.value).label("upvote_count"),
+            func.count().filter(~PostUpvote.value).label("downvote_count"),
+        )
+        .where(PostUpvote.post_id >= start_id, PostUpvote.post_id < end_id)
+        .group_by(PostUpvote.post_id)
+    )
+    comments = (
+        select(Comment.post_id, func.count().label("comment_count"))
+        .where(Comment.post_id >= start_id, Comment.post_id < end_id)
+        .group_by(Comment.post_id)
+    )
+    posts = select(Post.id).where(Post.id >= start_id, Post.id < end_id)
+
+    await db.execute(posts.order_by(Post.id).with_for_update())
+
+    votes = votes.subquery()
+    comments = comments.subquery()
+    posts = posts.subquery()
+
+    counts = (
+        select(
+            posts.c.id,
+            func.coalesce(votes.c.upvote_count, 0).label("upvote_count"),
+            func.coalesce(votes.c.downvote_count, 0).label("downvote_count"),
+            func.coalesce(comments.c.comment_count, 0).label("comment_count"),
+        )
+        .join(votes, votes.c.post_id == posts.c.id, isouter=True)
+        .join(comments, comments.c.post_id == posts.c.id, isouter=True)
+        .subquery()
+    )
+
+    query = (
+        update(Post)
+        .where(
+            Post.id == counts.c.id,
+            (Post.upvote_count != counts.c.upvote_count)
+            | (Post.downvote_count != counts.c.downvote_count)
+            | (Post.comment_count != counts.c.comment_count),
+        )
+        .values(
+            upvote_count=counts.c.upvote_count,
+            downvote_count=counts.c.downvote_count,
+            comment_count=counts.c.comment_count,
+            updated_at=Post.updated_at,
+        )
     )
     result = await db.execute(query)
-    return result.rowcount > 0
+    return result.rowcount
@@ -0,0 +1,226 @@
+import math
+import re
+import time
+from app.auth.services import get_optional_user_id
+from collections import OrderedDict
+from dataclasses import dataclass
+from fastapi import FastAPI, Request
+from redis.asyncio import Redis
+from starlette.routing import compile_path
+
+# Token bucket refilled continuously at capacity tokens per window.
+# KEYS[1] = bucket, ARGV = capacity, window_ms, cost, drain
+# drain = 1 charges the cost even when it exceeds the tokens left (requests already admitted)
+# returns {allowed, remaining tokens}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local window_ms = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local drain = tonumber(ARGV[4])
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + (now - ts) * capacity / window_ms)
+
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+elseif drain == 1 then
+    tokens = 0
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], window_ms)
+return {allowed, math.floor(tokens)}
+"""
+
+
+@dataclass
+class LocalBucket:
+    pending: int  # requests admitted by this worker and not yet charged to redis
+    remaining: int  # tokens left in redis at the last sync, minus pending
+    synced_at: float
+    syncing: bool = False  # a sync is waiting for redis, requests meanwhile stay pending
+
+
+class RateLimiter:
+    """
+    Per-client token buckets evaluated in one round-trip by TOKEN_BUCKET_SCRIPT.
+    Authenticated clients are limited by JWT sub, anonymous ones by IP.
+    Routes listed in route_limits ("METHOD /path/{param}": limit) get their own bucket.
+
+    With sync_batch > 1 each worker admits requests against a local estimate of the bucket
+    and charges redis in one batch every sync_batch requests or sync_ms milliseconds.
+    A worker never admits past its own estimate, so a client can exceed the global limit
+    by at most (workers * (sync_batch - 1)) requests per sync period.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        window_sec: int,
+        ip_limit: int,
+        user_limit: int,
+        route_limits: dict[str, int],
+        sync_batch: int = 1,
+        sync_ms: int = 0,
+        max_local_buckets: int = 100_000,
+    ):
+        self.script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.window_ms = window_sec * 1000
+        self.ip_limit = ip_limit
+        self.user_limit = user_limit
+        self.route_limits = route_limits
+        self.sync_batch = sync_batch
+        self.sync_ms = sync_ms
+        self.max_local_buckets = max_local_buckets
+        self.local_buckets: OrderedDict[str, LocalBucket] = OrderedDict()
+        # path templates compiled once, requests are only matched against the limited routes
+        self.route_patterns: list[tuple[str, re.Pattern, str]] = []
+
+        for route in route_limits:
+            method, path = route.split(" ", 1)
+            path_regex, _, _ = compile_path(path)
+            self.route_patterns.append((method, path_regex, route))
+
+    def get_route(self, request: Request) -> str | None:
+        """
+        output: "METHOD /path/{param}" of the route limit matching the request | None
+        """
+        for method, path_regex, route in self.route_patterns:
+            if method == request.method and path_regex.match(request.url.path):
+                return route
+
+        return None
+
+    def get_retry_after_sec(self, limit: int) -> int:
+        # an empty bucket refills one token every window / limit
+        return math.ceil(self.window_ms / limit / 1000)
+
+    def get_bucket(self, request: Request) -> tuple[str, int] | None:
+        """
+        output: (bucket key, limit) | None
+        """
+        user_id = get_optional_user_id(request)
+
+        if user_id is not None:
+            key, limit = f"rate_limit:user:{user_id}", self.user_limit
+        elif request.client:
+            key, limit = f"rate_limit:ip:{request.client.host}", self.ip_limit
+        else:
+            return None
+
+        if self.route_limits:
+            route = self.get_route(request)
+
+            if route in self.route_limits:
+                key, limit = f"{key}:{route}", self.route_limits[route]
+
+        return key, limit
+
+    async def consume(
+        self, key: str, limit: int, cost: int = 1, drain: bool = False
+    ) -> tuple[bool, int]:
+        """
+        output: (allowed, remaining tokens)
+        """
+        allowed, remaining = await self.script(
+            keys=[key], args=[limit, self.window_ms, cost, int(drain)]
+        )
+        return bool(allowed), remaining
+
+    async def sync(self, key: str, limit: int, local_bucket: LocalBucket) -> bool:
+        cost = local_bucket.pending
+        local_bucket.pending = 0
+        local_bucket.syncing = True
+
+        try:
+            allowed, remaining = await self.consume(key=key, limit=limit, cost=cost, drain=True)
+        finally:
+            local_bucket.syncing = False
+
+        # requests admitted while waiting for redis stay pending for the next sync
+        local_bucket.remaining = remaining - local_bucket.pending
+        local_bucket.synced_at = time.monotonic()
+        return allowed
+
+    async def allow_locally(self, key: str, limit: int) -> tuple[bool, int]:
+        """
+        output: (allowed, remaining tokens estimated by this worker)
+        """
+        local_bucket = self.local_buckets.get(key)
+        now = time.monotonic()
+
+        if local_bucket is None:
+            # the first request of a client goes to redis, the ones arriving meanwhile are
+            # admitted against a full bucket and charged by the next sync
+            local_bucket = LocalBucket(pending=1, remaining=limit - 1, synced_at=now)
+            self.local_buckets[key] = local_bucket
+
+            if len(self.local_buckets) > self.max_local_buckets:
+                self.local_buckets.popitem(last=False)
+
+            allowed = await self.sync(key=key, limit=limit, local_bucket=local_bucket)
+            return allowed, max(local_bucket.remaining, 0)
+
+        self.local_buckets.move_to_end(key)
+        elapsed_ms = (now - local_bucket.synced_at) * 1000
+
+        # exhausted at the last sync: reject without redis until a token has refilled,
+        # or until the sync in flight tells otherwise
+        if local_bucket.remaining <= 0 and (
+            local_bucket.syncing or elapsed_ms < self.window_ms / limit
+        ):
+            return False, 0
+
+        local_bucket.pending += 1
+        local_bucket.remaining -= 1
+
+        # one sync at a time per bucket
+        if not local_bucket.syncing and (
+            local_bucket.pending >= self.sync_batch
+            or local_bucket.remaining <= 0
+            or elapsed_ms >= self.sync_ms
+        ):
+            allowed = await self.sync(key=key, limit=limit, local_bucket=local_bucket)
+            return allowed, max(local_bucket.remaining, 0)
+
+        return True, local_bucket.remaining
+
+    async def allow(self, request: Request) -> tuple[bool, int, int] | None:
+        """
+        output: (allowed, limit, remaining tokens) | None if the client is not identified
+        """
+        bucket = self.get_bucket(request)
+
+        if bucket is None:
+            return None
+
+        key, limit = bucket
+
+        if self.sync_batch > 1:
+            allowed, remaining = await self.allow_locally(key=key, limit=limit)
+        else:
+            allowed, remaining = await self.consume(key=key, limit=limit)
+
+        return allowed, limit, remaining
+
+
+def set_rate_limiter(app: FastAPI):
+    settings = app.state.settings
+    app.state.rate_limiter = RateLimiter(
+        redis=app.state.keyspaces["rate_limit"].redis,
+        window_sec=settings.RATE_LIMIT_WINDOW_SEC,
+        ip_limit=settings.RATE_LIMIT,
+        user_limit=settings.RATE_LIMIT_USER,
+        route_limits=settings.RATE_LIMIT_ROUTES,
+        sync_batch=settings.RATE_LIMIT_SYNC_BATCH,
+        sync_ms=settings.RATE_LIMIT_SYNC_MS,
+        max_local_buckets=settings.RATE_LIMIT_MAX_LOCAL_BUCKETS,
+    )
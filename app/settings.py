@@ -1,3 +1,4 @@
+import json
 from dataclasses import dataclass
 from fastapi import Depends, FastAPI, Request
 from os import environ
@@ -7,15 +8,63 @@ from os import environ
 class Settings:
     ENV: str = environ["ENV"]
     DB_URL: str = environ["DB_URL"]
+    DB_REPLICA_URLS = tuple(url for url in environ.get("DB_REPLICA_URLS", "").split(",") if url)
+    DB_REPLICA_CHECK_INTERVAL_SEC = int(environ.get("DB_REPLICA_CHECK_INTERVAL_SEC", 5))
+    DB_READ_YOUR_WRITES_SEC = int(environ.get("DB_READ_YOUR_WRITES_SEC", 5))
+    DB_POOL_SIZE = int(environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT_SEC = float(environ.get("DB_POOL_TIMEOUT_SEC", 30))
+    DB_POOL_RECYCLE_SEC = int(environ.get("DB_POOL_RECYCLE_SEC", -1))
+    DB_POOL_PRE_PING = environ.get("DB_POOL_PRE_PING", "false") == "true"
+    DB_STATEMENT_CACHE_SIZE = int(environ.get("DB_STATEMENT_CACHE_SIZE", 100))
+    MIGRATION_LOCK_TIMEOUT_MS = int(environ.get("MIGRATION_LOCK_TIMEOUT_MS", 5000))
+    # backfills wait while a replica lags or the primary runs more queries than this
+    BACKFILL_MAX_REPLICA_LAG_MS = int(environ.get("BACKFILL_MAX_REPLICA_LAG_MS", 1000))
+    BACKFILL_MAX_ACTIVE_QUERIES = int(environ.get("BACKFILL_MAX_ACTIVE_QUERIES", 20))
+    BACKFILL_THROTTLE_SLEEP_MS = int(environ.get("BACKFILL_THROTTLE_SLEEP_MS", 1000))
     REDIS_PWD = environ["REDIS_PWD"]
     REDIS_HOST = environ["REDIS_HOST"]
     REDIS_PORT = int(environ["REDIS_PORT"])
     REDIS_DB = int(environ["REDIS_DB"])
+    # keyspaces moved off the default instance: {"cache": "redis://...", "rate_limit": ...}
+    REDIS_KEYSPACE_URLS = json.loads(environ.get("REDIS_KEYSPACE_URLS", "{}"))
     JWT_KEY = environ["JWT_KEY"]
-    JWT_ALGORITHM = environ["JWT_ALGORITHM"]
+    JWT_ALGORITHM = environ["JWT_ALGORITHM"]  # HS*, or RS*/ES*/EdDSA with a PEM private JWT_KEY
+    JWT_KEY_ID = environ.get("JWT_KEY_ID", "")
+    # keys retired from signing but still accepted: {kid: {"algorithm": str, "key": str}}
+    JWT_VERIFY_KEYS = json.loads(environ.get("JWT_VERIFY_KEYS", "{}"))
     JWT_TTL_SEC = int(environ["JWT_TTL_SEC"])
     REFRESH_TOKEN_TTL_SEC = int(environ["REFRESH_TOKEN_TTL_SEC"])
+    REFRESH_TOKEN_MAX_SESSIONS = int(environ.get("REFRESH_TOKEN_MAX_SESSIONS", 10))  # per user
     RATE_LIMIT = int(environ["RATE_LIMIT"])
+    RATE_LIMIT_WINDOW_SEC = int(environ.get("RATE_LIMIT_WINDOW_SEC", 60))
+    RATE_LIMIT_USER = int(environ.get("RATE_LIMIT_USER", environ["RATE_LIMIT"]))
+    RATE_LIMIT_ROUTES = json.loads(environ.get("RATE_LIMIT_ROUTES", "{}"))
+    RATE_LIMIT_SYNC_BATCH = int(environ.get("RATE_LIMIT_SYNC_BATCH", 1))  # 1 = exact
+    RATE_LIMIT_SYNC_MS = int(environ.get("RATE_LIMIT_SYNC_MS", 100))
+    RATE_LIMIT_MAX_LOCAL_BUCKETS = int(environ.get("RATE_LIMIT_MAX_LOCAL_BUCKETS", 100_000))
+    CACHE_TTL_SEC = int(environ.get("CACHE_TTL_SEC", 60))
+    LOCAL_CACHE_ENABLED = environ.get("LOCAL_CACHE_ENABLED", "false") == "true"
+    LOCAL_CACHE_TTL_SEC = int(environ.get("LOCAL_CACHE_TTL_SEC", 5))
+    LOCAL_CACHE_BUDGETS = json.loads(
+        environ.get(
+            "LOCAL_CACHE_BUDGETS",
+            '{"post": {"max_entries": 10000, "max_bytes": 33554432},'
+            ' "subreddit": {"max_entries": 1000, "max_bytes": 1048576},'
+            ' "user": {"max_entries": 10000, "max_bytes": 8388608}}',
+        )
+    )
+    ARGON2_TIME_COST = int(environ.get("ARGON2_TIME_COST", 3))
+    ARGON2_MEMORY_COST_KIB = int(environ.get("ARGON2_MEMORY_COST_KIB", 65536))
+    ARGON2_PARALLELISM = int(environ.get("ARGON2_PARALLELISM", 4))
+    ARGON2_WORKERS = int(environ.get("ARGON2_WORKERS", 4))  # hashes running at once per process
+    ARGON2_MAX_QUEUE = int(environ.get("ARGON2_MAX_QUEUE", 64))
+    TOKEN_CACHE_MAX_ENTRIES = int(environ.get("TOKEN_CACHE_MAX_ENTRIES", 10_000))
+    VOTE_WRITE_BEHIND = environ.get("VOTE_WRITE_BEHIND", "false") == "true"
+    VOTE_FLUSH_INTERVAL_MS = int(environ.get("VOTE_FLUSH_INTERVAL_MS", 500))  # max counter lag
+    VOTE_FLUSH_BATCH_SIZE = int(environ.get("VOTE_FLUSH_BATCH_SIZE", 1000))  # votes per transaction
+    VOTE_STATE_TTL_SEC = int(environ.get("VOTE_STATE_TTL_SEC", 3600))
+    SEARCH_SIMILARITY_THRESHOLD = float(environ.get("SEARCH_SIMILARITY_THRESHOLD", 0.3))
 
 
 def set_settings(app: FastAPI):
@@ -34,6 +83,10 @@ def get_db_url(settings: Settings = Depends(get_settings)):
     return settings.DB_URL
 
 
+def get_migration_lock_timeout_ms(settings: Settings = Depends(get_settings)):
+    return settings.MIGRATION_LOCK_TIMEOUT_MS
+
+
 def get_redis_pwd(settings: Settings = Depends(get_settings)):
     return settings.REDIS_PWD
 
@@ -58,6 +111,10 @@ def get_jwt_algorithm(settings: Settings = Depends(get_settings)):
     return settings.JWT_ALGORITHM
 
 
+def get_jwt_key_id(settings: Settings = Depends(get_settings)):
+    return settings.JWT_KEY_ID
+
+
 def get_jwt_ttl_sec(settings: Settings = Depends(get_settings)):
     return settings.JWT_TTL_SEC
 
@@ -66,5 +123,9 @@ def get_refresh_token_ttl_sec(settings: Settings = Depends(get_settings)):
     return settings.REFRESH_TOKEN_TTL_SEC
 
 
+def get_refresh_token_max_sessions(settings: Settings = Depends(get_settings)):
+    return settings.REFRESH_TOKEN_MAX_SESSIONS
+
+
 def get_rate_limit(settings: Settings = Depends(get_settings)):
     return settings.RATE_LIMIT
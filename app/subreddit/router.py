@@ -1,5 +1,6 @@
 from app.auth.services import get_current_user_id
-from app.db.core import get_db
+from app.cache.core import Cache, get_cache
+from app.db.core import get_db, get_db_read
 from app.subreddit.exceptions import SubredditNameAlreadyExist, SubredditNotFound
 from app.subreddit.models import SubredditCreate, SubredditRead, SubredditReads, SubredditUpdate
 from app.subreddit.services import (
@@ -12,7 +13,7 @@ from app.subreddit.services import (
     unfollow_subreddit,
     update_subreddit,
 )
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 subreddit_router = APIRouter(prefix="/subreddits", tags=["Subreddit"])
@@ -24,16 +25,12 @@ async def create_subreddit_route(
     db: AsyncSession = Depends(get_db),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    if await subreddit_name_exists(subreddit_name=subreddit_data.name, db=db):
-        raise SubredditNameAlreadyExist()
-
-    subreddit_id = await create_subreddit(
+    subreddit = await create_subreddit(
         subreddit_name=subreddit_data.name, user_id=current_user_id, db=db
     )
 
-    subreddit = await get_subreddit(subreddit_id=subreddit_id, db=db)
     if subreddit is None:
-        raise SubredditNotFound()
+        raise SubredditNameAlreadyExist()
 
     subreddit = subreddit._asdict()
     subreddit.update(subreddit.pop("Subreddit").to_dict())
@@ -45,7 +42,7 @@ async def get_subreddits_route(
     search_query: str,
     score_cursor: float | None = None,
     id_cursor: int | None = None,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_read),
 ):
     result = await get_subreddits(
         search_query=search_query, db=db, score_cursor=score_cursor, id_cursor=id_cursor
@@ -67,15 +64,28 @@ async def get_subreddits_route(
 
 
 @subreddit_router.get(path="/{subreddit_id}", status_code=200, response_model=SubredditRead)
-async def get_subreddit_route(subreddit_id: int, db: AsyncSession = Depends(get_db)):
-    subreddit = await get_subreddit(subreddit_id=subreddit_id, db=db)
+async def get_subreddit_route(
+    subreddit_id: int, db: AsyncSession = Depends(get_db_read), cache: Cache = Depends(get_cache)
+):
+    content, invalidated_at = await cache.get(namespace="subreddit", entity_id=subreddit_id)
 
-    if not subreddit:
-        raise SubredditNotFound()
+    if content is None:
+        subreddit = await get_subreddit(subreddit_id=subreddit_id, db=db)
 
-    subreddit = subreddit._asdict()
-    subreddit.update(subreddit.pop("Subreddit").to_dict())
-    return subreddit
+        if not subreddit:
+            raise SubredditNotFound()
+
+        subreddit = subreddit._asdict()
+        subreddit.update(subreddit.pop("Subreddit").to_dict())
+        content = SubredditRead.model_validate(subreddit).model_dump_json()
+        await cache.set(
+            namespace="subreddit",
+            entity_id=subreddit_id,
+            content=content,
+            invalidated_at=invalidated_at,
+        )
+
+    return Response(content=content, media_type="application/json")
 
 
 @subreddit_router.patch(path="/{subreddit_id}", status_code=201, response_model=SubredditRead)
@@ -83,6 +93,7 @@ async def update_subreddit_route(
     subreddit_id: int,
     subreddit_data: SubredditUpdate,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
     current_user_id: int = Depends(get_current_user_id),
 ):
     if subreddit_data.name and await subreddit_name_exists(
@@ -98,6 +109,8 @@ async def update_subreddit_route(
     ):
         raise SubredditNotFound()
 
+    cache.invalidate_on_commit(("subreddit", subreddit_id), db=db)
+
     subreddit = await get_subreddit(subreddit_id=subreddit_id, db=db)
 
     if not subreddit:
@@ -112,27 +125,42 @@ async def update_subreddit_route(
 async def delete_subreddit_route(
     subreddit_id: int,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    if not await delete_subreddit(subreddit_id=subreddit_id, user_id=current_user_id, db=db):
+    result = await delete_subreddit(subreddit_id=subreddit_id, user_id=current_user_id, db=db)
+
+    if result is None:
         raise SubredditNotFound()
 
+    post_ids, comment_ids = result
+    entities = [("subreddit", subreddit_id)]
+    entities += [("post", post_id) for post_id in post_ids]
+    entities += [("comment", comment_id) for comment_id in comment_ids]
+    cache.invalidate_on_commit(*entities, db=db)
+
 
 @subreddit_router.post(path="/{subreddit_id}/followers", response_model=None)
 async def follow_subreddit_route(
     subreddit_id: int,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
     current_user_id: int = Depends(get_current_user_id),
 ):
     if not await follow_subreddit(user_id=current_user_id, subreddit_id=subreddit_id, db=db):
         raise SubredditNotFound()
 
+    cache.invalidate_on_commit(("subreddit", subreddit_id), db=db)
+
 
 @subreddit_router.delete(path="/{subreddit_id}/followers", response_model=None)
 async def unfollow_subreddit_route(
     subreddit_id: int,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
     current_user_id: int = Depends(get_current_user_id),
 ):
     if not await unfollow_subreddit(user_id=current_user_id, subreddit_id=subreddit_id, db=db):
         raise SubredditNotFound()
+
+    cache.invalidate_on_commit(("subreddit", subreddit_id), db=db)
@@ -1,19 +1,66 @@
-from app.db.schema import Subreddit, SubredditFollow, User
-from sqlalchemy import delete, func, insert, select, update
+from app.db.schema import Comment, Post, Subreddit, SubredditFollow, User
+from app.db.services import get_constraint_name
+from sqlalchemy import delete, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql as pg
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
 
-async def create_subreddit(subreddit_name: str, user_id: int, db: AsyncSession) -> int:
-    query = insert(Subreddit).values(name=subreddit_name, user_id=user_id).returning(Subreddit.id)
-    result = await db.execute(query)
-    subreddit_id = result.scalars().one()
-    return subreddit_id
+async def create_subreddit(subreddit_name: str, user_id: int, db: AsyncSession):
+    """
+    output: (Subreddit, user_display_name, follower_count) | None if the name is taken
+
+    """
+    # the unique constraint on name replaces an existence check before the insert
+    new_subreddit = (
+        insert(Subreddit)
+        .values(name=subreddit_name, user_id=user_id)
+        .returning(*Subreddit.__table__.c)
+        .cte("new_subreddit")
+    )
+    subreddit = aliased(Subreddit, new_subreddit, name="Subreddit")
+    query = select(
+        subreddit, User.display_name.label("user_display_name"), literal(0).label("follower_count")
+    ).join(User, subreddit.user_id == User.id, isouter=True)
+
+    try:
+        result = await db.execute(query)
+    except IntegrityError as e:
+        if get_constraint_name(e) == "subreddit_name_key":
+            return None
+        raise
+
+    row = result.one()
+    return row
 
 
-async def delete_subreddit(subreddit_id: int, user_id: int, db: AsyncSession) -> bool:
-    query = delete(Subreddit).where(Subreddit.id == subreddit_id, Subreddit.user_id == user_id)
+async def delete_subreddit(subreddit_id: int, user_id: int, db: AsyncSession):
+    """
+    output: (post_ids, comment_ids) removed by ON DELETE CASCADE | None
+
+    """
+    # the select reads the snapshot taken before the cascade, so it still sees posts and comments
+    deleted_subreddit = (
+        delete(Subreddit)
+        .where(Subreddit.id == subreddit_id, Subreddit.user_id == user_id)
+        .returning(Subreddit.id)
+        .cte("deleted_subreddit")
+    )
+    query = (
+        select(deleted_subreddit.c.id, Post.id, Comment.id)
+        .outerjoin(Post, Post.subreddit_id == deleted_subreddit.c.id)
+        .outerjoin(Comment, Comment.post_id == Post.id)
+    )
     result = await db.execute(query)
-    return result.rowcount > 0
+    rows = result.all()
+
+    if not rows:
+        return None
+
+    post_ids = {post_id for _, post_id, _ in rows if post_id is not None}
+    comment_ids = [comment_id for _, _, comment_id in rows if comment_id is not None]
+    return (sorted(post_ids), comment_ids)
 
 
 async def update_subreddit(
@@ -57,48 +104,27 @@ async def get_subreddits(
     output: ([(Subreddit, user_display_name, follower_count, score_cursor)], next_score_cursor, next_id_cursor) | None
     """
     limit = 10
+    similarity = func.similarity(Subreddit.name, search_query)
 
-    if score_cursor is None or id is None:
-        query = (
-            select(
-                Subreddit,
-                User.display_name.label("user_display_name"),
-                func.count(SubredditFollow.id).label("follower_count"),
-                func.similarity(Subreddit.name, search_query).label("score_cursor"),
-            )
-            .join(User, Subreddit.user_id == User.id, isouter=True)
-            .join(SubredditFollow, Subreddit.id == SubredditFollow.subreddit_id, isouter=True)
-            .group_by(Subreddit.id, User.display_name)
-            .order_by(
-                func.similarity(Subreddit.name, search_query).label("score_cursor").desc(),
-                Subreddit.id.asc(),
-            )
-            .limit(limit)
+    query = (
+        select(
+            Subreddit,
+            User.display_name.label("user_display_name"),
+            func.count(SubredditFollow.id).label("follower_count"),
+            similarity.label("score_cursor"),
         )
+        .join(User, Subreddit.user_id == User.id, isouter=True)
+        .join(SubredditFollow, Subreddit.id == SubredditFollow.subreddit_id, isouter=True)
+        .where(Subreddit.name.op("%")(search_query))
+        .group_by(Subreddit.id, User.display_name)
+        .order_by(Subreddit.name.op("<->")(search_query), Subreddit.id.asc())
+        .limit(limit)
+    )
 
-    else:
-        query = (
-            select(
-                Subreddit,
-                User.display_name.label("user_display_name"),
-                func.count(SubredditFollow.id).label("follower_count"),
-                func.similarity(Subreddit.name, search_query).label("score_cursor"),
-            )
-            .join(User, Subreddit.user_id == User.id, isouter=True)
-            .join(SubredditFollow, Subreddit.id == SubredditFollow.subreddit_id, isouter=True)
-            .where(
-                (func.similarity(Subreddit.name, search_query) < score_cursor)
-                | (
-                    (func.similarity(Subreddit.name, search_query) == score_cursor)
-                    & (Subreddit.id > id_cursor)
-                )
-            )
-            .group_by(Subreddit.id, User.display_name)
-            .order_by(
-                func.similarity(Subreddit.name, search_query).label("score_cursor").desc(),
-                Subreddit.id.asc(),
-            )
-            .limit(limit)
+    if score_cursor is not None and id_cursor is not None:
+        query = query.where(
+            (similarity < score_cursor)
+            | ((similarity == score_cursor) & (Subreddit.id > id_cursor))
         )
 
     result = await db.execute(query)
@@ -114,7 +140,15 @@ async def get_subreddits(
 
 
 async def follow_subreddit(user_id: int, subreddit_id: int, db: AsyncSession) -> bool:
-    query = insert(SubredditFollow).values(subreddit_id=subreddit_id, user_id=user_id)
+    query = pg.insert(SubredditFollow).from_select(
+        ["subreddit_id", "user_id"],
+        select(Subreddit.id, literal(user_id)).where(Subreddit.id == subreddit_id),
+    )
+    # following twice matches the existing row, so no row means no subreddit
+    query = query.on_conflict_do_update(
+        index_elements=[SubredditFollow.subreddit_id, SubredditFollow.user_id],
+        set_={"updated_at": SubredditFollow.updated_at},
+    )
     result = await db.execute(query)
     return result.rowcount > 0
 
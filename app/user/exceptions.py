@@ -19,3 +19,11 @@ class EmailAlreadyExist(BaseError):
 class UserNotFound(BaseError):
     def __init__(self):
         super().__init__(status_code=404, message="User Not Found!")
+
+
+# unique constraints of the user table and the error reported when an insert or update violates them
+UNIQUE_CONSTRAINT_ERRORS = {
+    "user_username_key": UsernameAlreadyExist,
+    "user_email_key": EmailAlreadyExist,
+    "user_display_name_key": DisplayNameAlreadyExist,
+}
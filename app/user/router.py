@@ -1,9 +1,13 @@
-from app.auth.services import get_current_user_id, hash_password
-from app.db.core import get_db
-from app.user.exceptions import DisplayNameAlreadyExist, EmailAlreadyExist, UserNotFound
+from app.auth.hasher import PasswordHasherPool, get_password_hasher
+from app.auth.services import RefreshTokenStore, get_current_user_id, get_refresh_token_store
+from app.cache.core import Cache, get_cache
+from app.db.core import get_db, get_db_read
+from app.db.services import get_constraint_name
+from app.user.exceptions import UNIQUE_CONSTRAINT_ERRORS, UserNotFound
 from app.user.models import UserRead, UserUpdate
-from app.user.services import delete_user, display_name_exists, email_exists, get_user, update_user
-from fastapi import APIRouter, Depends
+from app.user.services import delete_user, get_authored_entities, get_user, update_user
+from fastapi import APIRouter, Depends, Response
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 user_router = APIRouter(prefix="/users", tags=["User"])
@@ -13,44 +17,80 @@ user_router = APIRouter(prefix="/users", tags=["User"])
 async def update_user_route(
     user_data: UserUpdate,
     db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
+    password_hasher: PasswordHasherPool = Depends(get_password_hasher),
+    refresh_token_store: RefreshTokenStore = Depends(get_refresh_token_store),
     current_user_id: int = Depends(get_current_user_id),
 ):
-    if user_data.email and await email_exists(email=user_data.email, db=db):
-        raise EmailAlreadyExist()
+    if user_data.password:
+        user_data.password = await password_hasher.hash(user_data.password)
 
-    if user_data.display_name and await display_name_exists(
-        display_name=user_data.display_name, db=db
-    ):
-        raise DisplayNameAlreadyExist
+    entities = [("user", current_user_id)]
 
-    if user_data.password:
-        user_data.password = hash_password(user_data.password)
+    # posts, comments and subreddits embed the author's display name
+    if user_data.display_name:
+        entities += await get_authored_entities(user_id=current_user_id, db=db)
+
+    # a taken email or display name is detected by the unique constraints, as on sign-up
+    try:
+        user = await update_user(
+            user_id=current_user_id, user_data=user_data.model_dump(exclude_unset=True), db=db
+        )
+    except IntegrityError as e:
+        error = UNIQUE_CONSTRAINT_ERRORS.get(get_constraint_name(e))
+
+        if error is None:
+            raise
 
-    user = await update_user(
-        user_id=current_user_id, user_data=user_data.model_dump(exclude_unset=True), db=db
-    )
+        raise error()
 
     if not user:
         raise UserNotFound()
 
+    # a new password signs the user out of every session
+    if user_data.password:
+        await refresh_token_store.revoke_all(user_id=current_user_id)
+
+    cache.invalidate_on_commit(*entities, db=db)
     return user
 
 
 @user_router.get(path="/me", status_code=200, response_model=UserRead)
 async def get_user_route(
-    db: AsyncSession = Depends(get_db), current_user_id: int = Depends(get_current_user_id)
+    db: AsyncSession = Depends(get_db_read),
+    cache: Cache = Depends(get_cache),
+    current_user_id: int = Depends(get_current_user_id),
 ):
-    user = await get_user(user_id=current_user_id, db=db)
+    content, invalidated_at = await cache.get(namespace="user", entity_id=current_user_id)
 
-    if not user:
-        raise UserNotFound()
+    if content is None:
+        user = await get_user(user_id=current_user_id, db=db)
 
-    return user
+        if not user:
+            raise UserNotFound()
+
+        content = UserRead.model_validate(user, from_attributes=True).model_dump_json()
+        await cache.set(
+            namespace="user",
+            entity_id=current_user_id,
+            content=content,
+            invalidated_at=invalidated_at,
+        )
+
+    return Response(content=content, media_type="application/json")
 
 
 @user_router.delete(path="/me", status_code=200, response_model=None)
 async def delete_user_route(
-    db: AsyncSession = Depends(get_db), current_user_id: int = Depends(get_current_user_id)
+    db: AsyncSession = Depends(get_db),
+    cache: Cache = Depends(get_cache),
+    refresh_token_store: RefreshTokenStore = Depends(get_refresh_token_store),
+    current_user_id: int = Depends(get_current_user_id),
 ):
-    if not delete_user(user_id=current_user_id, db=db):
+    entities = await get_authored_entities(user_id=current_user_id, db=db)
+
+    if not await delete_user(user_id=current_user_id, db=db):
         raise UserNotFound()
+
+    await refresh_token_store.revoke_all(user_id=current_user_id)
+    cache.invalidate_on_commit(("user", current_user_id), *entities, db=db)
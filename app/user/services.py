@@ -1,6 +1,6 @@
-from app.auth.services import verify_hashed_password
-from app.db.schema import User
-from sqlalchemy import delete, insert, select, update
+from app.auth.hasher import PasswordHasherPool
+from app.db.schema import Comment, Post, Subreddit, User
+from sqlalchemy import delete, func, insert, literal, or_, select, union_all, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -43,31 +43,27 @@ async def delete_user(user_id: int, db: AsyncSession) -> bool:
     return result.rowcount > 0
 
 
-async def username_exists(username: str, db: AsyncSession) -> bool:
-    query = select(User).where(User.username == username)
-    result = await db.execute(query)
-    user = result.scalars().first()
-
-    return True if user else False
-
-
-async def display_name_exists(display_name: str, db: AsyncSession) -> bool:
-    query = select(User).where(User.display_name == display_name)
-    result = await db.execute(query)
-    user = result.scalars().first()
-
-    return True if user else False
+async def get_authored_entities(user_id: int, db: AsyncSession) -> list[tuple[str, int]]:
+    """
+    output: [(namespace, entity_id)] of the subreddits, posts and comments whose read model
+    embeds the user's display name, or that are removed with the user
 
-
-async def email_exists(email: str, db: AsyncSession) -> bool:
-    query = select(User).where(User.email == email)
+    """
+    posts = select(Post.id).where(Post.user_id == user_id)
+    query = union_all(
+        select(literal("subreddit"), Subreddit.id).where(Subreddit.user_id == user_id),
+        select(literal("post"), Post.id).where(Post.user_id == user_id),
+        select(literal("comment"), Comment.id).where(
+            or_(Comment.user_id == user_id, Comment.post_id.in_(posts))
+        ),
+    )
     result = await db.execute(query)
-    user = result.scalars().first()
+    return [tuple(row) for row in result.all()]
 
-    return True if user else False
 
-
-async def get_user_id_by_credentials(username: str, password: str, db: AsyncSession) -> int | None:
+async def get_user_id_by_credentials(
+    username: str, password: str, password_hasher: PasswordHasherPool, db: AsyncSession
+) -> int | None:
     query = select(User).where(User.username == username)
     result = await db.execute(query)
     user = result.scalars().first()
@@ -75,7 +71,31 @@ async def get_user_id_by_credentials(username: str, password: str, db: AsyncSess
     if not user:
         return None
 
-    if not verify_hashed_password(password=password, hashed_password=user.password):
+    if not await password_hasher.verify(password=password, hashed_password=user.password):
         return None
 
+    # upgrade hashes made with older argon2 parameters while the plain password is at hand
+    if password_hasher.needs_rehash(hashed_password=user.password):
+        await update_password_hash(
+            user_id=user.id, password=await password_hasher.hash(password), db=db
+        )
+        password_hasher.record_rehash()
+
     return user.id
+
+
+async def update_password_hash(user_id: int, password: str, db: AsyncSession):
+    query = (
+        update(User).where(User.id == user_id).values(password=password, updated_at=User.updated_at)
+    )
+    await db.execute(query)
+
+
+async def count_outdated_password_hashes(hash_prefix: str, db: AsyncSession) -> int:
+    query = (
+        select(func.count())
+        .select_from(User)
+        .where(~User.password.startswith(hash_prefix, autoescape=True))
+    )
+    result = await db.execute(query)
+    return result.scalar_one()
@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import uuid
+from app.cache.core import Cache
+from app.vote.services import VOTE_TABLES, apply_votes, get_vote_counters, set_vote, toggle_vote
+from fastapi import FastAPI, Request
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import and_, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] = votes of the target {user_id: "1" up | "0" down | "-" none}
+# KEYS[2] = pending votes of all targets {"target_id:user_id": state}
+# ARGV = user_id, target_id, action ("set" | "toggle"), value ("1" | "0" | "-"), state_ttl_ms
+# returns {changed, state}: changed is 1 when the vote changed, 0 when it is unchanged (same
+# value, or no vote to toggle), -1 when the user's vote on the target is not loaded yet;
+# state is the user's vote after the call
+VOTE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if not current then
+    return {-1, ''}
+end
+
+local new = ARGV[4]
+if ARGV[3] == 'toggle' then
+    if current == '-' then
+        return {0, current}
+    end
+    new = current == '1' and '0' or '1'
+end
+
+if new == current then
+    return {0, current}
+end
+
+redis.call('HSET', KEYS[1], ARGV[1], new)
+redis.call('PEXPIRE', KEYS[1], ARGV[5])
+redis.call('HSET', KEYS[2], ARGV[2] .. ':' .. ARGV[1], new)
+return {1, new}
+"""
+
+# KEYS[1] = lock, ARGV[1] = token of the holder
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS[1] = lock, ARGV = token of the holder, ttl_ms
+# returns 1 if the lock is still held and was extended
+EXTEND_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class VoteBuffer:
+    """
+    Write-behind votes. A vote is recorded in redis, in the target's vote state and in a
+    pending hash holding the final state of every vote not yet in postgres.
+    Every flush_interval_ms one worker takes the pending hash under a lock and applies it in
+    batches of flush_batch_size votes, so vote counters lag by about one flush interval.
+
+    The pending hash is renamed to a processing key before it is applied and deleted after
+    the last batch commits. A flush that dies in between leaves the processing key behind
+    and the next flush replays it, which apply_votes makes idempotent. The lock is extended
+    before each batch; a flush that lost it stops, leaving the rest to the new holder.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        session_factory: async_sessionmaker[AsyncSession],
+        cache: Cache,
+        flush_interval_ms: int,
+        flush_batch_size: int,
+        state_ttl_sec: int,
+    ):
+        self.redis = redis
+        self.vote_script = redis.register_script(VOTE_SCRIPT)
+        self.release_lock_script = redis.register_script(RELEASE_LOCK_SCRIPT)
+        self.extend_lock_script = redis.register_script(EXTEND_LOCK_SCRIPT)
+        self.session_factory = session_factory
+        self.cache = cache
+        self.flush_interval_ms = flush_interval_ms
+        self.flush_batch_size = flush_batch_size
+        self.state_ttl_ms = state_ttl_sec * 1000
+        self.flusher: asyncio.Task | None = None
+
+    async def load_vote(self, target: str, target_id: int, user_id: int, db: AsyncSession) -> bool:
+        """
+        output: False if the target does not exist
+        """
+        vote_table, target_column, target_table = VOTE_TABLES[target]
+        query = (
+            select(vote_table.value)
+            .select_from(target_table)
+            .outerjoin(
+                vote_table, and_(target_column == target_table.id, vote_table.user_id == user_id)
+            )
+            .where(target_table.id == target_id)
+        )
+        result = await db.execute(query)
+        row = result.first()
+
+        if row is None:
+            return False
+
+        state = "-" if row.value is None else str(int(row.value))
+
+        # a vote recorded meanwhile by another request wins over the one read from postgres
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hsetnx(f"vote:{target}:{target_id}", str(user_id), state)
+            pipe.pexpire(f"vote:{target}:{target_id}", self.state_ttl_ms)
+            await pipe.execute()
+
+        return True
+
+    async def vote(
+        self,
+        target: str,
+        target_id: int,
+        user_id: int,
+        db: AsyncSession,
+        value: bool | None = None,
+        toggle: bool = False,
+    ) -> tuple[bool, bool | None] | None:
+        """
+        input: value = True up | False down | None no vote, or toggle the current vote
+        output: (changed, the user's vote after the call) | None if the target does not exist
+
+        """
+        state = "-" if value is None else str(int(value))
+        keys = [f"vote:{target}:{target_id}", f"vote:{target}:pending"]
+        args = [user_id, target_id, "toggle" if toggle else "set", state, self.state_ttl_ms]
+        changed, state = await self.vote_script(keys=keys, args=args)
+
+        if changed == -1:
+            if not await self.load_vote(target=target, target_id=target_id, user_id=user_id, db=db):
+                return None
+
+            changed, state = await self.vote_script(keys=keys, args=args)
+
+        return changed == 1, None if state == "-" else state == "1"
+
+    async def flush(self, target: str) -> int:
+        """
+        output: number of votes applied
+        """
+        lock, token = f"vote:{target}:flush_lock", uuid.uuid4().hex
+
+        lock_ttl_ms = max(10 * self.flush_interval_ms, 30_000)
+
+        if not await self.redis.set(lock, token, nx=True, px=lock_ttl_ms):
+            return 0
+
+        try:
+            processing = f"vote:{target}:processing"
+
+            # a processing key left by a failed flush is replayed before new votes are taken
+            if not await self.redis.exists(processing):
+                if not await self.redis.exists(f"vote:{target}:pending"):
+                    return 0
+
+                await self.redis.rename(f"vote:{target}:pending", processing)
+
+            votes = []
+
+            for key, state in (await self.redis.hgetall(processing)).items():
+                target_id, user_id = key.split(":")
+                votes.append((int(target_id), int(user_id), None if state == "-" else state == "1"))
+
+            target_ids = set()
+            applied = 0
+
+            for i in range(0, len(votes), self.flush_batch_size):
+                batch = votes[i : i + self.flush_batch_size]
+
+                # a flush outliving its lock would be replayed concurrently by another worker
+                if not await self.extend_lock_script(keys=[lock], args=[token, lock_ttl_ms]):
+                    logger.warning(
+                        "vote flush of %s lost its lock after %d of %d votes",
+                        target,
+                        applied,
+                        len(votes),
+                    )
+                    break
+
+                async with self.session_factory() as db, db.begin():
+                    target_ids |= await apply_votes(target=target, votes=batch, db=db)
+
+                applied += len(batch)
+            else:
+                await self.redis.delete(processing)
+
+            await self.cache.invalidate(*[(target, target_id) for target_id in target_ids])
+            return applied
+        finally:
+            await self.release_lock_script(keys=[lock], args=[token])
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_ms / 1000)
+
+            for target in VOTE_TABLES:
+                try:
+                    await self.flush(target)
+                except (SQLAlchemyError, RedisError):
+                    # the votes stay in the processing key and are replayed by the next flush
+                    logger.exception("vote flush of %s failed", target)
+
+
+async def cast_vote(
+    target: str,
+    target_id: int,
+    user_id: int,
+    db: AsyncSession,
+    cache: Cache,
+    vote_buffer: VoteBuffer | None,
+    value: bool | None = None,
+    toggle: bool = False,
+):
+    """
+    input: value = True up | False down | None no vote, or toggle the current vote
+    output: (upvote_count, downvote_count, changed) | None if the target does not exist
+
+    """
+    if vote_buffer:
+        # the counters in postgres and the cache are updated by the next flush
+        result = await vote_buffer.vote(
+            target=target, target_id=target_id, user_id=user_id, db=db, value=value, toggle=toggle
+        )
+
+        if result is None:
+            return None
+
+        changed, vote = result
+        row = await get_vote_counters(target=target, target_id=target_id, user_id=user_id, db=db)
+
+        if row is None:
+            return None
+
+        # the counters returned include this vote, read against the user's vote they were
+        # computed with; pending votes of other users show up after the next flush
+        upvote_count = row.upvote_count + (vote is True) - (row.value is True)
+        downvote_count = row.downvote_count + (vote is False) - (row.value is False)
+        return upvote_count, downvote_count, changed
+
+    if toggle:
+        row = await toggle_vote(target=target, target_id=target_id, user_id=user_id, db=db)
+    else:
+        row = await set_vote(
+            target=target, target_id=target_id, user_id=user_id, value=value, db=db
+        )
+
+    if row is not None and row.changed:
+        cache.invalidate_on_commit((target, target_id), db=db)
+
+    return row
+
+
+def set_vote_buffer(app: FastAPI):
+    settings = app.state.settings
+    app.state.vote_buffer = None
+
+    if settings.VOTE_WRITE_BEHIND:
+        app.state.vote_buffer = VoteBuffer(
+            redis=app.state.keyspaces["vote"].redis,
+            session_factory=app.state.db_session_factory,
+            cache=app.state.cache,
+            flush_interval_ms=settings.VOTE_FLUSH_INTERVAL_MS,
+            flush_batch_size=settings.VOTE_FLUSH_BATCH_SIZE,
+            state_ttl_sec=settings.VOTE_STATE_TTL_SEC,
+        )
+
+
+def get_vote_buffer(request: Request) -> VoteBuffer | None:
+    return request.app.state.vote_buffer
+
+
+async def open_vote_buffer(vote_buffer: VoteBuffer | None):
+    if vote_buffer:
+        vote_buffer.flusher = asyncio.create_task(vote_buffer.run())
+
+
+async def close_vote_buffer(vote_buffer: VoteBuffer | None):
+    if vote_buffer is None:
+        return
+
+    if vote_buffer.flusher:
+        vote_buffer.flusher.cancel()
+        await asyncio.gather(vote_buffer.flusher, return_exceptions=True)
+
+    # votes of the last interval are flushed before shutting down, leftovers are replayed later
+    for target in VOTE_TABLES:
+        try:
+            await vote_buffer.flush(target)
+        except (SQLAlchemyError, RedisError):
+            logger.exception("final vote flush of %s failed", target)
@@ -0,0 +1,240 @@
+from app.db.schema import Comment, CommentUpvote, Post, PostUpvote, User
+from sqlalchemy import (
+    and_,
+    case,
+    cast,
+    column,
+    delete,
+    exists,
+    false,
+    literal,
+    literal_column,
+    select,
+    true,
+    tuple_,
+    union_all,
+    update,
+    values,
+)
+from sqlalchemy.dialects import postgresql as pg
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# vote target: (vote table, its target column, target table)
+VOTE_TABLES = {
+    "post": (PostUpvote, PostUpvote.post_id, Post),
+    "comment": (CommentUpvote, CommentUpvote.comment_id, Comment),
+}
+
+
+async def execute_vote(
+    target: str, target_id: int, vote, upvote_delta, downvote_delta, db: AsyncSession
+):
+    """
+    input: vote = CTE of the changed vote row, deltas = counter changes computed from it
+    output: (upvote_count, downvote_count, changed) | None if the target does not exist
+
+    """
+    _, _, target_table = VOTE_TABLES[target]
+
+    # the counters move only when the vote row changed, in the same statement
+    counter = (
+        update(target_table)
+        .where(target_table.id == target_id)
+        .values(
+            upvote_count=target_table.upvote_count + upvote_delta,
+            downvote_count=target_table.downvote_count + downvote_delta,
+            updated_at=target_table.updated_at,
+        )
+        .returning(target_table.upvote_count, target_table.downvote_count)
+        .cte("counter")
+    )
+    query = union_all(
+        select(counter.c.upvote_count, counter.c.downvote_count, true().label("changed")),
+        select(target_table.upvote_count, target_table.downvote_count, false()).where(
+            target_table.id == target_id, ~exists(select(counter.c.upvote_count))
+        ),
+    )
+    result = await db.execute(query)
+    row = result.first()
+    return row
+
+
+async def set_vote(target: str, target_id: int, user_id: int, value: bool | None, db: AsyncSession):
+    """
+    input: value = True up | False down | None no vote
+    output: (upvote_count, downvote_count, changed) | None if the target does not exist
+
+    """
+    vote_table, target_column, target_table = VOTE_TABLES[target]
+
+    if value is None:
+        vote = (
+            delete(vote_table)
+            .where(target_column == target_id, vote_table.user_id == user_id)
+            .returning(vote_table.value)
+            .cte("vote")
+        )
+        return await execute_vote(
+            target=target,
+            target_id=target_id,
+            vote=vote,
+            upvote_delta=case((vote.c.value, -1), else_=0),
+            downvote_delta=case((vote.c.value, 0), else_=-1),
+            db=db,
+        )
+
+    # one upsert: inserted (xmax = 0) adds a vote, updated flips it, same value is a no-op
+    # that returns nothing, so retries never count twice
+    query = pg.insert(vote_table).from_select(
+        [target_column.key, "user_id", "value"],
+        select(
+            target_table.id, cast(literal(user_id), pg.INTEGER), cast(literal(value), pg.BOOLEAN)
+        ).where(target_table.id == target_id),
+    )
+    vote = (
+        query.on_conflict_do_update(
+            index_elements=[target_column, vote_table.user_id],
+            set_={"value": query.excluded.value, "updated_at": query.excluded.updated_at},
+            where=vote_table.value.is_distinct_from(query.excluded.value),
+        )
+        .returning(
+            vote_table.value,
+            literal_column(f"{vote_table.__tablename__}.xmax = 0").label("inserted"),
+        )
+        .cte("vote")
+    )
+    flip = 1 if value else -1
+    return await execute_vote(
+        target=target,
+        target_id=target_id,
+        vote=vote,
+        upvote_delta=case((vote.c.inserted, int(value)), else_=flip),
+        downvote_delta=case((vote.c.inserted, int(not value)), else_=-flip),
+        db=db,
+    )
+
+
+async def toggle_vote(target: str, target_id: int, user_id: int, db: AsyncSession):
+    """
+    output: (upvote_count, downvote_count, changed) | None if the target does not exist,
+    changed is False when the user has no vote to toggle
+
+    """
+    vote_table, target_column, _ = VOTE_TABLES[target]
+    vote = (
+        update(vote_table)
+        .where(target_column == target_id, vote_table.user_id == user_id)
+        .values(value=~vote_table.value)
+        .returning(vote_table.value)
+        .cte("vote")
+    )
+    return await execute_vote(
+        target=target,
+        target_id=target_id,
+        vote=vote,
+        upvote_delta=case((vote.c.value, 1), else_=-1),
+        downvote_delta=case((vote.c.value, -1), else_=1),
+        db=db,
+    )
+
+
+async def get_vote_counters(target: str, target_id: int, user_id: int, db: AsyncSession):
+    """
+    output: (upvote_count, downvote_count, value of the user's vote | None) | None,
+    read together so the counters include exactly that vote
+
+    """
+    vote_table, target_column, target_table = VOTE_TABLES[target]
+    query = (
+        select(target_table.upvote_count, target_table.downvote_count, vote_table.value)
+        .select_from(target_table)
+        .outerjoin(
+            vote_table, and_(target_column == target_table.id, vote_table.user_id == user_id)
+        )
+        .where(target_table.id == target_id)
+    )
+    result = await db.execute(query)
+    row = result.first()
+    return row
+
+
+async def apply_votes(
+    target: str, votes: list[tuple[int, int, bool | None]], db: AsyncSession
+) -> set[int]:
+    """
+    input: final (target_id, user_id, value | None) of each vote, None = no vote
+    output: ids of the targets whose counters changed
+
+    """
+    vote_table, target_column, target_table = VOTE_TABLES[target]
+
+    # the counters move by the rows actually changed, so applying the same votes twice
+    # (replay after a crash) leaves them unchanged
+    deltas: dict[int, list[int]] = {}
+    removed_votes = [(target_id, user_id) for target_id, user_id, value in votes if value is None]
+    new_votes = [vote for vote in votes if vote[2] is not None]
+
+    if removed_votes:
+        result = await db.execute(
+            delete(vote_table)
+            .where(tuple_(target_column, vote_table.user_id).in_(removed_votes))
+            .returning(target_column, vote_table.value)
+        )
+
+        for target_id, value in result.all():
+            delta = deltas.setdefault(target_id, [0, 0])
+            delta[0 if value else 1] -= 1
+
+    if new_votes:
+        rows = values(
+            column("target_id", pg.INTEGER),
+            column("user_id", pg.INTEGER),
+            column("value", pg.BOOLEAN),
+            name="new_vote",
+        ).data(new_votes)
+        # votes on targets or by users deleted in the meantime are dropped
+        query = pg.insert(vote_table).from_select(
+            [target_column.key, "user_id", "value"],
+            select(rows.c.target_id, rows.c.user_id, rows.c.value)
+            .join(target_table, target_table.id == rows.c.target_id)
+            .join(User, User.id == rows.c.user_id),
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[target_column, vote_table.user_id],
+            set_={"value": query.excluded.value, "updated_at": query.excluded.updated_at},
+            where=vote_table.value.is_distinct_from(query.excluded.value),
+        ).returning(
+            target_column,
+            vote_table.value,
+            literal_column(f"{vote_table.__tablename__}.xmax = 0").label("inserted"),
+        )
+        result = await db.execute(query)
+
+        # an updated vote was flipped, so it also leaves the opposite counter
+        for target_id, value, inserted in result.all():
+            delta = deltas.setdefault(target_id, [0, 0])
+            delta[0 if value else 1] += 1
+
+            if not inserted:
+                delta[1 if value else 0] -= 1
+
+    deltas = {target_id: delta for target_id, delta in deltas.items() if delta != [0, 0]}
+
+    if deltas:
+        rows = values(
+            column("id", pg.INTEGER),
+            column("upvote_count", pg.INTEGER),
+            column("downvote_count", pg.INTEGER),
+            name="delta",
+        ).data([(target_id, up, down) for target_id, (up, down) in deltas.items()])
+        await db.execute(
+            update(target_table)
+            .where(target_table.id == rows.c.id)
+            .values(
+                upvote_count=target_table.upvote_count + rows.c.upvote_count,
+                downvote_count=target_table.downvote_count + rows.c.downvote_count,
+                updated_at=target_table.updated_at,
+            )
+        )
+
+    return set(deltas)
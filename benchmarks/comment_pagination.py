@@ -0,0 +1,94 @@
+import asyncio
+import random
+import time
+from app.comment.services import get_comments
+from app.db.schema import Comment, Post, Subreddit, User
+from app.db.services import create_tables, drop_tables
+from app.main import create_app, lifespan
+from sqlalchemy import insert
+
+COMMENT_COUNT = 50_000
+BATCH_SIZE = 5_000
+BUCKET_COUNT = 10
+
+
+async def seed(db) -> int:
+    user_id = (
+        await db.execute(
+            insert(User)
+            .values(username="bench", password="", email="bench", display_name="bench", avatar="")
+            .returning(User.id)
+        )
+    ).scalar_one()
+    subreddit_id = (
+        await db.execute(
+            insert(Subreddit).values(name="bench", user_id=user_id).returning(Subreddit.id)
+        )
+    ).scalar_one()
+    post_id = (
+        await db.execute(
+            insert(Post)
+            .values(title="bench", body=[], user_id=user_id, subreddit_id=subreddit_id)
+            .returning(Post.id)
+        )
+    ).scalar_one()
+
+    for _ in range(COMMENT_COUNT // BATCH_SIZE):
+        await db.execute(
+            insert(Comment),
+            [
+                {
+                    "body": [],
+                    "user_id": user_id,
+                    "post_id": post_id,
+                    "upvote_count": random.randint(0, 1_000),
+                }
+                for _ in range(BATCH_SIZE)
+            ],
+        )
+    await db.commit()
+    return post_id
+
+
+async def main():
+    app = create_app()
+    async with lifespan(app=app):
+        db_engine = app.state.db_engine
+        await create_tables(db_engine=db_engine)
+
+        try:
+            async with app.state.db_session_factory() as db:
+                post_id = await seed(db)
+
+                latencies = []
+                score_cursor, id_cursor = None, None
+
+                while True:
+                    start = time.perf_counter()
+                    result = await get_comments(
+                        post_id=post_id, db=db, score_cursor=score_cursor, id_cursor=id_cursor
+                    )
+                    latencies.append(time.perf_counter() - start)
+
+                    if result is None:
+                        break
+
+                    _, score_cursor, id_cursor = result
+
+            bucket_size = len(latencies) // BUCKET_COUNT
+            print(f"{len(latencies)} pages of {COMMENT_COUNT} comments")
+            print(f"{'pages':>15} {'avg ms':>10} {'max ms':>10}")
+
+            for i in range(BUCKET_COUNT):
+                bucket = latencies[i * bucket_size : (i + 1) * bucket_size]
+                pages = f"{i * bucket_size + 1}-{(i + 1) * bucket_size}"
+                avg_ms = sum(bucket) / len(bucket) * 1000
+                max_ms = max(bucket) * 1000
+                print(f"{pages:>15} {avg_ms:>10.3f} {max_ms:>10.3f}")
+
+        finally:
+            await drop_tables(db_engine=db_engine)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
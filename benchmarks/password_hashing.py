@@ -0,0 +1,86 @@
+import asyncio
+import time
+from app.auth.hasher import PasswordHasherPool
+from app.settings import Settings
+from argon2 import PasswordHasher
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+SIGN_IN_COUNT = 100
+CONCURRENCY = 32
+PASSWORD = "correct horse battery staple"
+
+
+def create_bench_app(hasher: PasswordHasher, workers: int | None) -> FastAPI:
+    app = FastAPI()
+    hashed_password = hasher.hash(PASSWORD)
+    password_hasher = PasswordHasherPool(hasher=hasher, max_workers=workers or 1, max_queue=10**6)
+
+    # the verification step of sign-in, without the user lookup
+    @app.post("/sign-in")
+    async def sign_in():
+        if workers is None:
+            # the previous inline verification, kept here as the baseline
+            return hasher.verify(hashed_password, PASSWORD)
+
+        return await password_hasher.verify(password=PASSWORD, hashed_password=hashed_password)
+
+    app.get("/ping")(lambda: None)
+    return app
+
+
+async def measure(app: FastAPI) -> tuple[float, float]:
+    """
+    output: (sign-ins per second, worst /ping latency in ms while signing in)
+    """
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        ping_latencies = []
+        ping_start = None
+
+        async def sign_in():
+            async with semaphore:
+                await client.post("/sign-in")
+
+        async def ping():
+            nonlocal ping_start
+
+            while True:
+                ping_start = time.perf_counter()
+                await client.get("/ping")
+                ping_latencies.append(time.perf_counter() - ping_start)
+                ping_start = None
+                await asyncio.sleep(0.01)
+
+        pinger = asyncio.create_task(ping())
+        start = time.perf_counter()
+        await asyncio.gather(*[sign_in() for _ in range(SIGN_IN_COUNT)])
+        end = time.perf_counter()
+        pinger.cancel()
+
+        # a ping still waiting when the sign-ins finish counts with its wait so far
+        if ping_start is not None:
+            ping_latencies.append(end - ping_start)
+
+    elapsed = end - start
+
+    return SIGN_IN_COUNT / elapsed, max(ping_latencies) * 1000
+
+
+async def main():
+    settings = Settings()
+    hasher = PasswordHasher(
+        time_cost=settings.ARGON2_TIME_COST,
+        memory_cost=settings.ARGON2_MEMORY_COST_KIB,
+        parallelism=settings.ARGON2_PARALLELISM,
+    )
+    print(f"{SIGN_IN_COUNT} sign-ins, {CONCURRENCY} concurrent")
+    print(f"{'verification':>16} {'sign-ins/s':>12} {'max ping ms':>12}")
+
+    for name, workers in [("inline", None), ("pool, 1 thread", 1), ("pool, 4 threads", 4)]:
+        throughput, max_ping_ms = await measure(create_bench_app(hasher, workers))
+        print(f"{name:>16} {throughput:>12.1f} {max_ping_ms:>12.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
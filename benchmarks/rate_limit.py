@@ -0,0 +1,76 @@
+import asyncio
+import time
+from app.middlewares import rate_limit_middleware
+from app.rate_limit import RateLimiter
+from app.redis import set_redis
+from app.settings import set_settings
+from fastapi import FastAPI, Request
+from httpx import ASGITransport, AsyncClient
+
+REQUEST_COUNT = 5_000
+
+
+async def incr_expire_middleware(request: Request, next):
+    # the previous INCR + EXPIRE limiter, kept here as the baseline
+    host = request.client.host
+    count = await request.app.state.redis.incr(host)
+
+    if count == 1:
+        await request.app.state.redis.expire(host, 60)
+
+    return await next(request)
+
+
+def create_bench_app(middleware=None, sync_batch: int = 1) -> FastAPI:
+    app = FastAPI()
+    set_settings(app=app)
+    set_redis(app=app)
+    app.state.rate_limiter = RateLimiter(
+        redis=app.state.redis,
+        window_sec=60,
+        ip_limit=10**9,
+        user_limit=10**9,
+        route_limits={},
+        sync_batch=sync_batch,
+        sync_ms=1_000,
+    )
+    app.get("/ping")(lambda: None)
+
+    if middleware:
+        app.middleware("http")(middleware)
+
+    return app
+
+
+async def measure(app: FastAPI) -> float:
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        await client.get("/ping")
+        start = time.perf_counter()
+
+        for _ in range(REQUEST_COUNT):
+            await client.get("/ping")
+
+        elapsed = time.perf_counter() - start
+
+    await app.state.redis.aclose()
+    return elapsed / REQUEST_COUNT * 1_000_000
+
+
+async def main():
+    baseline = await measure(create_bench_app())
+    print(f"{REQUEST_COUNT} sequential requests")
+    print(f"{'middleware':>20} {'us/request':>12} {'added us':>10}")
+    print(f"{'none':>20} {baseline:>12.1f} {0:>10.1f}")
+
+    for name, middleware, sync_batch in [
+        ("incr + expire", incr_expire_middleware, 1),
+        ("token bucket script", rate_limit_middleware, 1),
+        ("local, batch 10", rate_limit_middleware, 10),
+        ("local, batch 100", rate_limit_middleware, 100),
+    ]:
+        latency = await measure(create_bench_app(middleware, sync_batch))
+        print(f"{name:>20} {latency:>12.1f} {latency - baseline:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+import asyncio
+import jwt
+import time
+from app.auth.services import create_access_token, get_current_user_id
+from app.auth.verifier import TokenVerifier
+from app.settings import Settings, get_jwt_algorithm, get_jwt_key
+from fastapi import Depends, FastAPI
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from httpx import ASGITransport, AsyncClient
+
+CALL_COUNT = 100_000
+REQUEST_COUNT = 5_000
+
+
+def decode_verify_access_token(
+    credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False)),
+    jwt_key: str = Depends(get_jwt_key),
+    jwt_algorithm: str = Depends(get_jwt_algorithm),
+) -> dict:
+    # the previous dependency, decoding every token, kept here as the baseline
+    return jwt.decode(jwt=credentials.credentials, key=jwt_key, algorithms=[jwt_algorithm])
+
+
+def decode_get_current_user_id(payload: dict = Depends(decode_verify_access_token)) -> int:
+    return int(payload["sub"])
+
+
+def create_bench_app(settings: Settings, dependency=None) -> FastAPI:
+    app = FastAPI()
+    app.state.settings = settings
+    app.state.token_verifier = TokenVerifier(keys={"": (settings.JWT_ALGORITHM, settings.JWT_KEY)})
+
+    if dependency:
+        app.get("/me")(lambda user_id=Depends(dependency): user_id)
+    else:
+        app.get("/me")(lambda: None)
+
+    return app
+
+
+def measure_calls(verify) -> float:
+    start = time.perf_counter()
+
+    for _ in range(CALL_COUNT):
+        verify()
+
+    return (time.perf_counter() - start) / CALL_COUNT * 1_000_000
+
+
+async def measure_requests(app: FastAPI, token: str) -> float:
+    headers = {"authorization": f"Bearer {token}"}
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        await client.get("/me", headers=headers)
+        start = time.perf_counter()
+
+        for _ in range(REQUEST_COUNT):
+            await client.get("/me", headers=headers)
+
+        elapsed = time.perf_counter() - start
+
+    return elapsed / REQUEST_COUNT * 1_000_000
+
+
+async def main():
+    settings = Settings()
+    token, _ = create_access_token(
+        sub="1", jwt_key=settings.JWT_KEY, jwt_algorithm=settings.JWT_ALGORITHM, jwt_ttl_sec=3600
+    )
+    keys = {"": (settings.JWT_ALGORITHM, settings.JWT_KEY)}
+    cached = TokenVerifier(keys=keys)
+    uncached = TokenVerifier(keys=keys, max_entries=0)
+
+    print(f"{CALL_COUNT} verifications of one {settings.JWT_ALGORITHM} token")
+    print(f"{'verification':>20} {'us/call':>10}")
+
+    for name, verify in [
+        ("jwt.decode", lambda: jwt.decode(token, settings.JWT_KEY, [settings.JWT_ALGORITHM])),
+        ("verifier, no cache", lambda: uncached.verify(token)),
+        ("verifier, cached", lambda: cached.verify(token)),
+    ]:
+        print(f"{name:>20} {measure_calls(verify):>10.2f}")
+
+    baseline = await measure_requests(create_bench_app(settings), token)
+    print(f"\n{REQUEST_COUNT} sequential requests")
+    print(f"{'dependency':>20} {'us/request':>12} {'added us':>10}")
+    print(f"{'none':>20} {baseline:>12.1f} {0:>10.1f}")
+
+    for name, dependency in [
+        ("decode per request", decode_get_current_user_id),
+        ("token verifier", get_current_user_id),
+    ]:
+        latency = await measure_requests(create_bench_app(settings, dependency), token)
+        print(f"{name:>20} {latency:>12.1f} {latency - baseline:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,156 @@
+import asyncio
+import random
+import time
+from app.db.schema import Post, PostUpvote, Subreddit, User
+from app.db.services import create_tables, drop_tables
+from app.main import create_app, lifespan
+from app.vote.core import VoteBuffer
+from app.vote.services import set_vote, toggle_vote
+from sqlalchemy import delete, insert, select, update
+
+USER_COUNT = 2_000
+CONCURRENCY = 50
+FLUSH_INTERVAL_MS = 500
+FLUSH_BATCH_SIZE = 1_000
+
+
+async def seed(db) -> tuple[int, list[int]]:
+    user_ids = (
+        (
+            await db.execute(
+                insert(User).returning(User.id),
+                [
+                    {
+                        "username": f"bench{i}",
+                        "password": "",
+                        "email": f"bench{i}",
+                        "display_name": f"bench{i}",
+                        "avatar": "",
+                    }
+                    for i in range(USER_COUNT)
+                ],
+            )
+        )
+        .scalars()
+        .all()
+    )
+    subreddit_id = (
+        await db.execute(
+            insert(Subreddit).values(name="bench", user_id=user_ids[0]).returning(Subreddit.id)
+        )
+    ).scalar_one()
+    post_id = (
+        await db.execute(
+            insert(Post)
+            .values(title="bench", body=[], user_id=user_ids[0], subreddit_id=subreddit_id)
+            .returning(Post.id)
+        )
+    ).scalar_one()
+    await db.commit()
+    return post_id, user_ids
+
+
+async def run_votes(votes: list[tuple[int, bool]], vote) -> float:
+    """
+    output: votes/sec, every user votes then toggles its vote on the same hot post
+    """
+    queue = list(votes)
+
+    async def worker():
+        while queue:
+            user_id, value = queue.pop()
+            await vote(user_id=user_id, value=value)
+            await vote(user_id=user_id, toggle=True)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(CONCURRENCY)])
+    return 2 * len(votes) / (time.perf_counter() - start)
+
+
+async def get_counters(app, post_id: int) -> tuple[int, int]:
+    async with app.state.db_session_factory() as db:
+        result = await db.execute(
+            select(Post.upvote_count, Post.downvote_count).where(Post.id == post_id)
+        )
+        return tuple(result.one())
+
+
+async def reset(app):
+    async with app.state.db_session_factory() as db, db.begin():
+        await db.execute(delete(PostUpvote))
+        await db.execute(update(Post).values(upvote_count=0, downvote_count=0))
+
+
+async def main():
+    app = create_app()
+    async with lifespan(app=app):
+        db_engine = app.state.db_engine
+        session_factory = app.state.db_session_factory
+        await create_tables(db_engine=db_engine)
+
+        try:
+            async with session_factory() as db:
+                post_id, user_ids = await seed(db)
+
+            votes = [(user_id, random.random() < 0.8) for user_id in user_ids]
+            # values are toggled once, so the final up/down counts are swapped
+            expected = (sum(not value for _, value in votes), sum(value for _, value in votes))
+
+            async def direct_vote(user_id: int, value: bool | None = None, toggle: bool = False):
+                async with session_factory() as db, db.begin():
+                    if toggle:
+                        await toggle_vote(target="post", target_id=post_id, user_id=user_id, db=db)
+                    else:
+                        await set_vote(
+                            target="post", target_id=post_id, user_id=user_id, value=value, db=db
+                        )
+
+            direct_rate = await run_votes(votes=votes, vote=direct_vote)
+            direct_counters = await get_counters(app=app, post_id=post_id)
+            await reset(app=app)
+
+            vote_buffer = VoteBuffer(
+                redis=app.state.keyspaces["vote"].redis,
+                session_factory=session_factory,
+                cache=app.state.cache,
+                flush_interval_ms=FLUSH_INTERVAL_MS,
+                flush_batch_size=FLUSH_BATCH_SIZE,
+                state_ttl_sec=60,
+            )
+            await app.state.keyspaces["vote"].purge()
+            vote_buffer.flusher = asyncio.create_task(vote_buffer.run())
+
+            async def buffered_vote(user_id: int, value: bool | None = None, toggle: bool = False):
+                async with session_factory() as db:
+                    await vote_buffer.vote(
+                        target="post",
+                        target_id=post_id,
+                        user_id=user_id,
+                        db=db,
+                        value=value,
+                        toggle=toggle,
+                    )
+
+            buffered_rate = await run_votes(votes=votes, vote=buffered_vote)
+            vote_buffer.flusher.cancel()
+            await asyncio.gather(vote_buffer.flusher, return_exceptions=True)
+
+            start = time.perf_counter()
+            await vote_buffer.flush("post")
+            final_flush_ms = (time.perf_counter() - start) * 1000
+            buffered_counters = await get_counters(app=app, post_id=post_id)
+            await app.state.keyspaces["vote"].purge()
+
+            print(f"{len(votes)} users voting then toggling on one post, {CONCURRENCY} at once")
+            print(f"expected (up, down): {expected}")
+            print(f"{'path':>15} {'votes/sec':>10} {'(up, down)':>15}")
+            print(f"{'direct':>15} {direct_rate:>10.0f} {direct_counters!s:>15}")
+            print(f"{'write-behind':>15} {buffered_rate:>10.0f} {buffered_counters!s:>15}")
+            print(f"final flush: {final_flush_ms:.1f} ms")
+
+        finally:
+            await drop_tables(db_engine=db_engine)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
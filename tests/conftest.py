@@ -1,9 +1,11 @@
 import pytest_asyncio
-from app.db.core import get_db
+from app.db.core import get_db, get_db_read
+from app.db.schema import Post, Subreddit, User
 from app.db.services import create_tables, drop_tables
 from app.main import create_app, lifespan
 from fastapi import FastAPI
 from httpx import ASGITransport, AsyncClient
+from sqlalchemy import delete
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -17,7 +19,8 @@ async def app_instance():
 @pytest_asyncio.fixture(scope="session", loop_scope="session")
 async def redis_teardown(app_instance: FastAPI):
     yield
-    await app_instance.state.redis.flushdb()
+    for keyspace in app_instance.state.keyspaces.values():
+        await keyspace.purge()
 
 
 @pytest_asyncio.fixture(scope="session", loop_scope="session")
@@ -33,6 +36,7 @@ async def db_session(app_instance: FastAPI):
     yield session
     await session.close()
 
+
 # Make sure database is stateless between each test
 @pytest_asyncio.fixture(scope="function", loop_scope="session", autouse=True)
 async def db_rollback(db_session: AsyncSession):
@@ -42,7 +46,16 @@ async def db_rollback(db_session: AsyncSession):
 
 @pytest_asyncio.fixture(scope="session", loop_scope="session")
 async def override_dependencies(app_instance: FastAPI, db_session: AsyncSession):
-    app_instance.dependency_overrides[get_db] = lambda: db_session
+    # a savepoint per request keeps the shared session usable after a constraint violation
+    async def get_test_db():
+        async with db_session.begin_nested():
+            yield db_session
+
+        # releasing the savepoint stands in for the commit get_db invalidates the cache after
+        await app_instance.state.cache.invalidate_committed(db=db_session)
+
+    app_instance.dependency_overrides[get_db] = get_test_db
+    app_instance.dependency_overrides[get_db_read] = lambda: db_session
     yield
     app_instance.dependency_overrides.clear()
 
@@ -74,3 +87,39 @@ async def created_user(test_client: AsyncClient):
         response.json()["refresh_token"]["token"],
         json,
     ]
+
+
+# for code that commits in its own transactions (vote buffer flushes, migrations): a post and
+# two users, committed
+@pytest_asyncio.fixture(scope="function", loop_scope="session")
+async def committed_post(app_instance: FastAPI, db_tables_setup):
+    session_factory = app_instance.state.db_session_factory
+
+    async with session_factory() as db, db.begin():
+        users = [
+            User(
+                username=f"voter{i}",
+                password="1234",
+                email=f"voter{i}@gmail.com",
+                display_name=f"voter{i}",
+                avatar="s3.avatar",
+            )
+            for i in range(2)
+        ]
+        db.add_all(users)
+        await db.flush()
+        subreddit = Subreddit(name="votes", user_id=users[0].id)
+        db.add(subreddit)
+        await db.flush()
+        post = Post(title="votes", body=[], user_id=users[0].id, subreddit_id=subreddit.id)
+        db.add(post)
+        await db.flush()
+        post_id, subreddit_id, user_ids = post.id, subreddit.id, [user.id for user in users]
+
+    yield post_id, user_ids
+
+    async with session_factory() as db, db.begin():
+        await db.execute(delete(Subreddit).where(Subreddit.id == subreddit_id))
+        await db.execute(delete(User).where(User.id.in_(user_ids)))
+
+    await app_instance.state.keyspaces["vote"].purge()
@@ -1,32 +1,45 @@
+import jwt
 import pytest
+from app.auth.services import create_access_token
+from app.auth.verifier import TokenVerifier, prepare_signing_key
+from argon2 import PasswordHasher
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from fastapi import FastAPI
 from httpx import AsyncClient
 
 
+def create_pem_key(private_key) -> str:
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode()
+
+
 @pytest.mark.asyncio(loop_scope="session")
-async def test_sign_up(test_client: AsyncClient, created_user):
+@pytest.mark.parametrize(
+    "field,message",
+    [
+        ("username", "Usrname Already Exist!"),
+        ("email", "Email Already Exist!"),
+        ("display_name", "Display Name Already Exist!"),
+    ],
+)
+async def test_sign_up(test_client: AsyncClient, created_user, field: str, message: str):
     url = "/auth/sign-up"
     _, _, user = created_user
 
-    # username already exist
-    response = await test_client.post(url=url, json=user)
+    # only one unique field is taken, whichever constraint postgres checks first
+    json = {**user, "username": "john", "email": "john@gmail.com", "display_name": "john"}
+    json[field] = user[field]
+    response = await test_client.post(url=url, json=json)
     assert response.status_code == 400
-    assert response.json()["message"] == "Usrname Already Exist!"
-
-    # email already exist
-    user["username"] += "1"
-    response = await test_client.post(url=url, json=user)
-    assert response.status_code == 400
-    assert response.json()["message"] == "Email Already Exist!"
-
-    # display name already exist
-    user["email"] += "1"
-    response = await test_client.post(url=url, json=user)
-    assert response.status_code == 400
-    assert response.json()["message"] == "Display Name Already Exist!"
+    assert response.json()["message"] == message
 
     # user successfully registered
-    user["display_name"] += "1"
-    response = await test_client.post(url=url, json=user)
+    json[field] = "john"
+    response = await test_client.post(url=url, json=json)
     assert response.status_code == 201
 
 
@@ -46,6 +59,39 @@ async def test_sign_in(test_client: AsyncClient, created_user):
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio(loop_scope="session")
+async def test_password_rehash(
+    test_client: AsyncClient, app_instance: FastAPI, created_user, monkeypatch: pytest.MonkeyPatch
+):
+    _, _, user = created_user
+    password_hasher = app_instance.state.password_hasher
+    credentials = {"username": user["username"], "password": user["password"]}
+
+    # raising the parameters makes the stored hash outdated
+    hasher = password_hasher.hasher
+    monkeypatch.setattr(
+        password_hasher,
+        "hasher",
+        PasswordHasher(
+            time_cost=hasher.time_cost + 1,
+            memory_cost=hasher.memory_cost,
+            parallelism=hasher.parallelism,
+        ),
+    )
+    response = await test_client.get("/auth/password-hashes")
+    assert response.json()["outdated_users"] == 1
+    rehashed = response.json()["rehashed"]
+
+    # signing in upgrades the hash, once
+    for _ in range(2):
+        response = await test_client.post("/auth/sign-in", json=credentials)
+        assert response.status_code == 200
+
+    response = await test_client.get("/auth/password-hashes")
+    assert response.json()["outdated_users"] == 0
+    assert response.json()["rehashed"] == rehashed + 1
+
+
 @pytest.mark.asyncio(loop_scope="session")
 async def test_sign_out(test_client: AsyncClient, created_user):
     _, refresh_token, user = created_user
@@ -61,6 +107,21 @@ async def test_sign_out(test_client: AsyncClient, created_user):
     response = await test_client.post(url=url, json={"token": refresh_token})
     assert response.status_code == 200
 
+    # the session is gone
+    response = await test_client.post(url=url, json={"token": refresh_token})
+    assert response.status_code == 401
+
+    # a token that is not the current one of its session signs nothing out
+    response = await test_client.post(
+        url="/auth/sign-in", json={"username": user["username"], "password": user["password"]}
+    )
+    refresh_token = response.json()["refresh_token"]["token"]
+    response = await test_client.post(url=url, json={"token": refresh_token + "x"})
+    assert response.status_code == 401
+
+    response = await test_client.post("/auth/refresh", json={"token": refresh_token})
+    assert response.status_code == 200
+
 
 @pytest.mark.asyncio(loop_scope="session")
 async def test_refresh_access_token(test_client: AsyncClient, created_user):
@@ -70,6 +131,62 @@ async def test_refresh_access_token(test_client: AsyncClient, created_user):
     # user successfully retreieved
     response = await test_client.post(url=url, json={"token": refresh_token})
     assert response.status_code == 200
+    new_refresh_token = response.json()["refresh_token"]["token"]
 
     response = await test_client.post(url=url, json={"token": "invalid_refresh_token"})
     assert response.status_code == 401
+
+    # refresh tokens are single use, reusing one revokes the whole session
+    response = await test_client.post(url=url, json={"token": refresh_token})
+    assert response.status_code == 401
+
+    response = await test_client.post(url=url, json={"token": new_refresh_token})
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_key_rotation(
+    test_client: AsyncClient, app_instance: FastAPI, monkeypatch: pytest.MonkeyPatch
+):
+    old_key = create_pem_key(rsa.generate_private_key(public_exponent=65537, key_size=2048))
+    new_key = create_pem_key(ec.generate_private_key(ec.SECP256R1()))
+    token_verifier = TokenVerifier(keys={"new": ("ES256", new_key), "old": ("RS256", old_key)})
+
+    def create_token(kid: str, algorithm: str, key: str) -> str:
+        token, _ = create_access_token(
+            sub="1",
+            jwt_key=prepare_signing_key(algorithm=algorithm, key=key),
+            jwt_algorithm=algorithm,
+            jwt_ttl_sec=60,
+            jwt_key_id=kid,
+        )
+        return token
+
+    # the kid header picks the key, tokens of the rotated out key verify until they expire
+    assert token_verifier.verify(create_token(kid="new", algorithm="ES256", key=new_key))
+    assert token_verifier.verify(create_token(kid="old", algorithm="RS256", key=old_key))
+
+    # a token is only checked against the key of its kid
+    assert token_verifier.verify(create_token(kid="old", algorithm="ES256", key=new_key)) is None
+    assert token_verifier.verify(create_token(kid="other", algorithm="ES256", key=new_key)) is None
+    assert token_verifier.verify(create_token(kid="", algorithm="ES256", key=new_key)) is None
+
+    # public keys are published with their kid, shared secrets never are
+    response = await test_client.get("/auth/jwks")
+    assert response.status_code == 200
+    assert response.json() == {"keys": []}
+
+    monkeypatch.setattr(app_instance.state, "token_verifier", token_verifier)
+    response = await test_client.get("/auth/jwks")
+    assert response.status_code == 200
+    jwks = {jwk["kid"]: jwk for jwk in response.json()["keys"]}
+    assert {kid: (jwk["alg"], jwk["kty"]) for kid, jwk in jwks.items()} == {
+        "new": ("ES256", "EC"),
+        "old": ("RS256", "RSA"),
+    }
+    assert "d" not in jwks["new"] and "d" not in jwks["old"]
+
+    # the published key verifies the tokens signed with the private one
+    token = create_token(kid="new", algorithm="ES256", key=new_key)
+    public_key = jwt.PyJWK(jwks["new"]).key
+    assert jwt.decode(token, key=public_key, algorithms=["ES256"])["sub"] == "1"
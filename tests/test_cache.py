@@ -0,0 +1,179 @@
+import asyncio
+import pytest
+from app.cache.core import Cache, LocalCache
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+
+def test_local_cache_budget():
+    local = LocalCache(ttl_sec=60, budgets={"post": {"max_entries": 2, "max_bytes": 10}})
+
+    # namespaces without a budget are not stored
+    local.set(namespace="comment", entity_id=1, content="a")
+    assert local.get(namespace="comment", entity_id=1) is None
+
+    # least recently used entry is evicted once max_entries is exceeded
+    local.set(namespace="post", entity_id=1, content="a")
+    local.set(namespace="post", entity_id=2, content="b")
+    assert local.get(namespace="post", entity_id=1) == "a"
+    local.set(namespace="post", entity_id=3, content="c")
+    assert local.get(namespace="post", entity_id=2) is None
+    assert local.get(namespace="post", entity_id=1) == "a"
+
+    # entries are evicted to stay under max_bytes
+    local.set(namespace="post", entity_id=4, content="123456789")
+    assert local.get(namespace="post", entity_id=4) == "123456789"
+    assert local.sizes["post"] <= 10
+
+    # entries larger than the whole budget are skipped
+    local.set(namespace="post", entity_id=5, content="12345678901")
+    assert local.get(namespace="post", entity_id=5) is None
+
+    local.discard(namespace="post", entity_id=4)
+    assert local.get(namespace="post", entity_id=4) is None
+    assert local.sizes["post"] == sum(len(c) for _, c in local.entries["post"].values())
+
+
+def test_local_cache_ttl():
+    local = LocalCache(ttl_sec=-1, budgets={"post": {"max_entries": 2, "max_bytes": 10}})
+    local.set(namespace="post", entity_id=1, content="a")
+    assert local.get(namespace="post", entity_id=1) is None
+    assert local.sizes["post"] == 0
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_cache_invalidation(test_client: AsyncClient, app_instance: FastAPI, created_user):
+    access_token, _, _ = created_user
+    headers = {"Authorization": f"Bearer {access_token}"}
+    stats = app_instance.state.cache.stats
+    body = [{"type": "text", "content": "hello"}]
+
+    response = await test_client.post("/subreddits", json={"name": "cached"}, headers=headers)
+    subreddit_id = response.json()["id"]
+    url = f"/subreddits/{subreddit_id}/posts"
+    response = await test_client.post(url, json={"title": "hello", "body": body}, headers=headers)
+    post_url = f"{url}/{response.json()['id']}"
+    response = await test_client.post(
+        f"{post_url}/comments", json={"parent_comment_id": None, "body": body}, headers=headers
+    )
+    comment_url = f"{post_url}/comments/{response.json()['id']}"
+
+    # the first read fills the cache, the second one is served from it
+    await test_client.get(post_url)
+    hits = stats["post"]["hit"] + stats["post"]["local_hit"]
+    response = await test_client.get(post_url)
+    assert response.json()["title"] == "hello"
+    assert stats["post"]["hit"] + stats["post"]["local_hit"] == hits + 1
+
+    # writes invalidate the entry
+    response = await test_client.patch(post_url, json={"title": "updated"}, headers=headers)
+    assert response.status_code == 200
+    response = await test_client.get(post_url)
+    assert response.json()["title"] == "updated"
+
+    # a new display name invalidates the read models embedding it
+    await test_client.get(comment_url)
+    await test_client.get(f"/subreddits/{subreddit_id}")
+    response = await test_client.patch(
+        "/users/me", json={"display_name": "renamed"}, headers=headers
+    )
+    assert response.status_code == 200
+
+    for entity_url in (post_url, comment_url, f"/subreddits/{subreddit_id}"):
+        response = await test_client.get(entity_url)
+        assert response.json()["user_display_name"] == "renamed"
+
+    # deleting a post invalidates its comments
+    response = await test_client.delete(post_url, headers=headers)
+    assert response.status_code == 200
+    response = await test_client.get(comment_url)
+    assert response.status_code == 404
+
+    # deleting a subreddit invalidates its posts
+    response = await test_client.post(url, json={"title": "other", "body": body}, headers=headers)
+    post_url = f"{url}/{response.json()['id']}"
+    await test_client.get(post_url)
+    response = await test_client.delete(f"/subreddits/{subreddit_id}", headers=headers)
+    assert response.status_code == 200
+    response = await test_client.get(post_url)
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_cache_purge(app_instance: FastAPI):
+    keyspace = app_instance.state.keyspaces["cache"]
+    caches = [
+        Cache(
+            redis=keyspace.redis,
+            ttl_sec=60,
+            local=LocalCache(ttl_sec=60, budgets={"post": {"max_entries": 10, "max_bytes": 100}}),
+        )
+        for _ in range(2)
+    ]
+    await keyspace.purge()
+    listeners = [asyncio.create_task(cache.listen()) for cache in caches]
+    await asyncio.sleep(0.1)
+
+    # both workers hold the entry in their local tier
+    await caches[0].set(namespace="post", entity_id=1, content="a", invalidated_at="")
+    assert await caches[1].get(namespace="post", entity_id=1) == ("a", "")
+
+    await keyspace.purge()
+    await asyncio.sleep(0.1)
+
+    for cache in caches:
+        assert cache.local.get(namespace="post", entity_id=1) is None
+        assert await cache.get(namespace="post", entity_id=1) == (None, "")
+
+    for listener in listeners:
+        listener.cancel()
+
+    await asyncio.gather(*listeners, return_exceptions=True)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_cache_fill_after_invalidation(app_instance: FastAPI):
+    keyspace = app_instance.state.keyspaces["cache"]
+    cache = Cache(
+        redis=keyspace.redis,
+        ttl_sec=60,
+        local=LocalCache(ttl_sec=60, budgets={"post": {"max_entries": 10, "max_bytes": 100}}),
+    )
+
+    await keyspace.purge()
+
+    # a read that started before an invalidation does not store what it saw
+    content, invalidated_at = await cache.get(namespace="post", entity_id=1)
+    assert (content, invalidated_at) == (None, "")
+    await cache.invalidate(("post", 1))
+    await cache.set(namespace="post", entity_id=1, content="old", invalidated_at=invalidated_at)
+    assert cache.local.get(namespace="post", entity_id=1) is None
+    assert await keyspace.redis.get("cache:post:1") is None
+
+    # a read that started after it fills the cache
+    content, invalidated_at = await cache.get(namespace="post", entity_id=1)
+    assert content is None and invalidated_at
+    await cache.set(namespace="post", entity_id=1, content="new", invalidated_at=invalidated_at)
+    assert await cache.get(namespace="post", entity_id=1) == ("new", "")
+
+    await keyspace.purge()
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_cache_fill_grace(app_instance: FastAPI):
+    keyspace = app_instance.state.keyspaces["cache"]
+    cache = Cache(redis=keyspace.redis, ttl_sec=60, fill_grace_ms=200)
+    await keyspace.purge()
+
+    # right after a write, a replica may still return the old row, the read is not cached
+    await cache.invalidate(("post", 1))
+    content, invalidated_at = await cache.get(namespace="post", entity_id=1)
+    await cache.set(namespace="post", entity_id=1, content="old", invalidated_at=invalidated_at)
+    assert await keyspace.redis.get("cache:post:1") is None
+
+    await asyncio.sleep(0.2)
+    content, invalidated_at = await cache.get(namespace="post", entity_id=1)
+    await cache.set(namespace="post", entity_id=1, content="new", invalidated_at=invalidated_at)
+    assert await keyspace.redis.get("cache:post:1") == "new"
+
+    await keyspace.purge()
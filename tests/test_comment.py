@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from app.comment.services import delete_comment, submit_comment
+from app.db.schema import Comment, Post
+from fastapi import FastAPI
+from httpx import AsyncClient
+from sqlalchemy import func, select
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_get_comments(test_client: AsyncClient, created_user):
+    access_token, _, _ = created_user
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = await test_client.post("/subreddits", json={"name": "python"}, headers=headers)
+    url = f"/subreddits/{response.json()['id']}/posts"
+    body = [{"type": "text", "content": "hello"}]
+    response = await test_client.post(url, json={"title": "hello", "body": body}, headers=headers)
+    url = f"{url}/{response.json()['id']}/comments"
+
+    response = await test_client.post(
+        url, json={"parent_comment_id": None, "body": body}, headers=headers
+    )
+    comment_id = response.json()["id"]
+    response = await test_client.post(
+        url, json={"parent_comment_id": comment_id, "body": body}, headers=headers
+    )
+    reply_id = response.json()["id"]
+
+    # a post lists its top-level comments only
+    response = await test_client.get(url)
+    assert response.status_code == 200
+    comments = response.json()["comments"]
+    assert [(comment["id"], comment["reply_count"]) for comment in comments] == [(comment_id, 1)]
+
+    # replies are listed under their parent
+    response = await test_client.get(f"{url}/{comment_id}/replies")
+    assert response.status_code == 200
+    assert [comment["id"] for comment in response.json()["comments"]] == [reply_id]
+
+    response = await test_client.get(f"{url}/{reply_id}/replies")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_delete_comment_concurrent_reply(app_instance: FastAPI, committed_post):
+    session_factory = app_instance.state.db_session_factory
+    post_id, (user_id, other_user_id) = committed_post
+    body = [{"type": "text", "content": "hello"}]
+
+    async with session_factory() as db, db.begin():
+        comment, _ = await submit_comment(
+            body=body, user_id=user_id, post_id=post_id, parent_comment_id=None, db=db
+        )
+        reply, _ = await submit_comment(
+            body=body, user_id=other_user_id, post_id=post_id, parent_comment_id=comment.id, db=db
+        )
+        comment_id, reply_id = comment.id, reply.id
+
+    async def delete_subtree():
+        async with session_factory() as db, db.begin():
+            return await delete_comment(comment_id=comment_id, user_id=user_id, db=db)
+
+    # a reply written while the subtree is deleted: the delete waits for it and counts it
+    async with session_factory() as db, db.begin():
+        new_reply, _ = await submit_comment(
+            body=body, user_id=other_user_id, post_id=post_id, parent_comment_id=reply_id, db=db
+        )
+        new_reply_id = new_reply.id
+        deleted = asyncio.create_task(delete_subtree())
+        await asyncio.sleep(0.2)
+        assert not deleted.done()
+
+    assert await deleted == (post_id, None, [comment_id, reply_id, new_reply_id])
+
+    async with session_factory() as db:
+        comment_count = await db.scalar(select(Post.comment_count).where(Post.id == post_id))
+        comments = await db.scalar(
+            select(func.count()).select_from(Comment).where(Comment.post_id == post_id)
+        )
+        assert comment_count == comments == 0
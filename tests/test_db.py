@@ -0,0 +1,370 @@
+import asyncio
+import importlib
+import pytest
+from app.comment.services import get_comment_replies, get_comments
+from app.db.backfill import BackfillRunner, BackfillThrottle, get_backfill_throttle
+from app.db.core import (
+    DBReplica,
+    check_db_replicas,
+    create_db_engine,
+    get_db,
+    get_db_read_session_factory,
+)
+from app.db.migrations.core import (
+    MIGRATION_TABLE,
+    apply_migrations,
+    is_index_built,
+    plan_migrations,
+)
+from app.db.migrations.versions import INDEXES, MIGRATIONS
+from app.db.schema import Post, PostUpvote
+from app.db.schema_check import QUERY_PATTERNS, check_schema, covers, get_indexes
+from fastapi import FastAPI, Request
+from httpx import AsyncClient
+from sqlalchemy import event, func, insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+
+def create_request(app: FastAPI, token: str | None = None) -> Request:
+    headers = [(b"authorization", f"Bearer {token}".encode())] if token else []
+    return Request(scope={"type": "http", "app": app, "headers": headers})
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_db_metrics(test_client: AsyncClient, app_instance: FastAPI):
+    db_metrics = app_instance.state.db_metrics
+    statement = text("SELECT CAST(:value AS integer) AS statement_cache_test")
+
+    async with app_instance.state.db_engine.connect() as conn:
+        before = db_metrics.snapshot(db_engine=app_instance.state.db_engine)
+
+        # prepared on the first run, served from the connection's statement cache after
+        for value in range(3):
+            assert (await conn.execute(statement, {"value": value})).scalar() == value
+
+    response = await test_client.get("/db/metrics")
+    assert response.status_code == 200
+    after = response.json()
+
+    assert after["statement_cache_misses"] - before["statement_cache_misses"] == 1
+    assert after["statement_cache_hits"] - before["statement_cache_hits"] >= 2
+    assert after["compiled_cache_hits"] - before["compiled_cache_hits"] >= 2
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_replica_routing(
+    app_instance: FastAPI, created_user: list, monkeypatch: pytest.MonkeyPatch
+):
+    settings = app_instance.state.settings
+    replicas = []
+
+    for url in (settings.DB_URL, settings.DB_URL.replace(":5432/", ":1/")):
+        engine = create_db_engine(url=url, settings=settings)
+        session_factory = async_sessionmaker(
+            bind=engine.execution_options(isolation_level="AUTOCOMMIT")
+        )
+        replicas.append(DBReplica(engine=engine, session_factory=session_factory))
+
+    # the replica that refuses connections is marked unhealthy
+    checker = asyncio.create_task(check_db_replicas(replicas=replicas, interval_sec=1))
+    await asyncio.sleep(0.5)
+    checker.cancel()
+    await asyncio.gather(checker, return_exceptions=True)
+    assert [replica.healthy for replica in replicas] == [True, False]
+
+    monkeypatch.setattr(app_instance.state, "db_replicas", replicas)
+    replica_session_factory = replicas[0].session_factory
+    primary_session_factory = app_instance.state.db_read_session_factory
+    access_token = created_user[0]
+    user_id = app_instance.state.token_verifier.verify(access_token)["sub"]
+    redis = app_instance.state.keyspaces["db"].redis
+
+    for token in (None, access_token):
+        request = create_request(app=app_instance, token=token)
+        assert await get_db_read_session_factory(request=request) is replica_session_factory
+
+    # a write pins the user's reads to the primary, other clients keep reading replicas
+    request = create_request(app=app_instance, token=access_token)
+    db_dependency = get_db(request=request, session_factory=app_instance.state.db_session_factory)
+    db = await anext(db_dependency)
+    await db.execute(text("SELECT 1"))
+    await anext(db_dependency, None)
+    assert await redis.ttl(f"db:recent_write:{user_id}") > 0
+
+    assert await get_db_read_session_factory(request=request) is primary_session_factory
+    request = create_request(app=app_instance)
+    assert await get_db_read_session_factory(request=request) is replica_session_factory
+
+    # no healthy replica left
+    replicas[0].healthy = False
+    assert await get_db_read_session_factory(request=request) is primary_session_factory
+
+    await redis.delete(f"db:recent_write:{user_id}")
+    for replica in replicas:
+        await replica.engine.dispose()
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_check_schema(test_client: AsyncClient, app_instance: FastAPI):
+    # every lookup of the services and foreign keys is served by an index the schema declares
+    report = await check_schema(db_engine=app_instance.state.db_engine)
+    assert report == {"missing_indexes": [], "unbuilt_indexes": [], "invalid_indexes": []}
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_query_patterns(
+    test_client: AsyncClient, app_instance: FastAPI, db_session: AsyncSession
+):
+    # the services a pattern names still exist
+    for pattern in QUERY_PATTERNS:
+        module, name = pattern["query"].rsplit(".", 1)
+        assert hasattr(importlib.import_module(f"app.{module}"), name), pattern["query"]
+
+    # the statements of the paginated lookups are planned on the index of their pattern,
+    # without a sort, so the patterns cannot drift from the queries
+    queries = {
+        "comment.services.get_comments": lambda: get_comments(
+            post_id=1, db=db_session, score_cursor=1, id_cursor=1
+        ),
+        "comment.services.get_comment_replies": lambda: get_comment_replies(
+            comment_id=1, db=db_session, score_cursor=1, id_cursor=1
+        ),
+    }
+    sync_engine = app_instance.state.db_engine.sync_engine
+    conn = await db_session.connection()
+    indexes = await get_indexes(conn=conn)
+    await conn.execute(text("SET LOCAL enable_seqscan = off"))
+
+    for pattern in QUERY_PATTERNS:
+        if pattern["query"] not in queries:
+            continue
+
+        statements = []
+
+        def capture(
+            conn, cursor, statement, parameters, context, executemany, statements=statements
+        ):
+            statements.append((statement, parameters))
+
+        event.listen(sync_engine, "before_cursor_execute", capture)
+
+        try:
+            await queries[pattern["query"]]()
+        finally:
+            event.remove(sync_engine, "before_cursor_execute", capture)
+
+        statement, parameters = statements[-1]
+        result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+        nodes = list(walk_plan(result.scalar()[0]["Plan"]))
+        index_names = {node["Index Name"] for node in nodes if "Index Name" in node}
+
+        assert not any(node["Node Type"] == "Sort" for node in nodes), pattern["query"]
+        assert any(
+            index["index"] in index_names
+            and covers(
+                index=index,
+                table=pattern["table"],
+                columns=pattern["columns"],
+                where=pattern["where"],
+            )
+            for index in indexes
+        ), pattern["query"]
+
+
+def walk_plan(plan: dict):
+    yield plan
+
+    for child in plan.get("Plans", []):
+        yield from walk_plan(child)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_migrations(app_instance: FastAPI, committed_post):
+    db_engine = app_instance.state.db_engine
+    session_factory = app_instance.state.db_session_factory
+    post_id, user_ids = committed_post
+    options = {
+        "db_engine": db_engine,
+        "migrations": MIGRATIONS,
+        "lock_timeout_ms": 1000,
+        "throttle": get_backfill_throttle(settings=app_instance.state.settings),
+        "redis": app_instance.state.keyspaces["db"].redis,
+    }
+
+    # a database from before the search column, the vote constraints and the partial comment
+    # indexes, with a post, a duplicate vote and drifted counters
+    async with db_engine.begin() as conn:
+        await conn.execute(text("DROP TRIGGER post_search_vector ON post"))
+        await conn.execute(text("ALTER TABLE post DROP COLUMN search_vector"))
+        await conn.execute(
+            text("ALTER TABLE post_upvote DROP CONSTRAINT post_upvote_post_id_user_id_key")
+        )
+        await conn.execute(text("DROP INDEX ix_comment_post_id_score"))
+        await conn.execute(
+            text("CREATE INDEX ix_comment_post_id_score ON comment (post_id, upvote_count DESC)")
+        )
+        await conn.execute(
+            insert(PostUpvote),
+            [{"post_id": post_id, "user_id": user_ids[0], "value": True} for _ in range(2)],
+        )
+        await conn.execute(
+            update(Post).where(Post.id == post_id).values(upvote_count=5, comment_count=2)
+        )
+
+    try:
+        # the dry run lists every pending version with its locks
+        plan = await plan_migrations(db_engine=db_engine, migrations=MIGRATIONS)
+        assert [migration["version"] for migration in plan] == [1, 2, 3, 4]
+
+        # nothing blocks reads for longer than a catalog update
+        steps = [step for migration in plan for step in migration["steps"]]
+        assert {step["lock"] for step in steps} >= {"ACCESS EXCLUSIVE", "SHARE ROW EXCLUSIVE"}
+        assert all(
+            step["impact"] == "held for a catalog update only"
+            for step in steps
+            if step["lock"] == "ACCESS EXCLUSIVE"
+        )
+
+        assert await apply_migrations(**options) == [1, 2, 3, 4]
+
+        # the backfills filled the vector, removed the duplicate vote and repaired the counters,
+        # the indexes were built or replaced
+        async with session_factory() as db:
+            result = await db.execute(
+                select(
+                    Post.search_vector.op("@@")(func.to_tsquery("english", "votes")),
+                    Post.upvote_count,
+                    Post.comment_count,
+                ).where(Post.id == post_id)
+            )
+            assert result.one() == (True, 1, 0)
+            votes = await db.scalar(
+                select(func.count()).select_from(PostUpvote).where(PostUpvote.post_id == post_id)
+            )
+            assert votes == 1
+
+        async with db_engine.connect() as conn:
+            for name in ("ix_comment_post_id_score", "ix_comment_parent_comment_id_score"):
+                assert await is_index_built(conn=conn, index=INDEXES[name])
+
+            index_oids = await get_index_oids(conn=conn)
+
+        report = await check_schema(db_engine=db_engine)
+        assert report == {"missing_indexes": [], "unbuilt_indexes": [], "invalid_indexes": []}
+
+        # then the trigger keeps it up to date
+        async with session_factory() as db, db.begin():
+            await db.execute(update(Post).where(Post.id == post_id).values(title="search"))
+            result = await db.execute(
+                select(Post.search_vector.op("@@")(func.to_tsquery("english", "search"))).where(
+                    Post.id == post_id
+                )
+            )
+            assert result.scalar()
+
+        # applied versions are skipped
+        assert await plan_migrations(db_engine=db_engine, migrations=MIGRATIONS) == []
+        assert await apply_migrations(**options) == []
+
+        # every step finds its work done when a version is run again
+        async with db_engine.begin() as conn:
+            await conn.execute(text(f"DELETE FROM {MIGRATION_TABLE}"))
+
+        assert await apply_migrations(**options) == [1, 2, 3, 4]
+
+        # indexes that already have their definition are not rebuilt
+        async with db_engine.connect() as conn:
+            assert await get_index_oids(conn=conn) == index_oids
+    finally:
+        async with db_engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {MIGRATION_TABLE}"))
+
+
+async def get_index_oids(conn) -> dict[str, int]:
+    result = await conn.execute(text("SELECT relname, oid FROM pg_class WHERE relkind = 'i'"))
+    return dict(result.all())
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_backfill_runner(
+    app_instance: FastAPI,
+    committed_post,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+):
+    _, user_ids = committed_post
+    redis = app_instance.state.keyspaces["db"].redis
+    chunks = []
+    failing = {user_ids[1]}
+
+    async def fn(db: AsyncSession, start_id: int, end_id: int) -> int:
+        if start_id in failing:
+            failing.clear()
+            raise RuntimeError("crashed")
+
+        chunks.append((start_id, end_id))
+        return 1
+
+    # "user" is a keyword, the runner's queries quote it
+    runner = BackfillRunner(
+        name="test",
+        table="user",
+        fn=fn,
+        chunk_size=1,
+        db_engine=app_instance.state.db_engine,
+        session_factory=app_instance.state.db_session_factory,
+        redis=redis,
+        throttle=BackfillThrottle(max_replica_lag_ms=100, max_active_queries=100, sleep_ms=10),
+    )
+
+    # one chunk per id, the next id is checkpointed after each
+    with pytest.raises(RuntimeError):
+        await runner.run()
+
+    assert chunks == [(user_ids[0], user_ids[0] + 1)]
+    assert int(float(await redis.hget("db:backfill:test", "next_id"))) == user_ids[1]
+
+    # a restarted backfill resumes at the checkpoint, which is cleared once it is done
+    result = await runner.run()
+    assert chunks == [(user_id, user_id + 1) for user_id in user_ids]
+    assert (result["rows"], result["changed"]) == (2, 2)
+    assert not await redis.exists("db:backfill:test")
+
+    # replicas with an unknown lag are warned about once
+    monkeypatch.setattr("app.db.backfill.REPLICA_LAG_QUERY", "SELECT 0, 1")
+
+    with caplog.at_level("WARNING", logger="app.db.backfill"):
+        for _ in range(2):
+            replica_lag_ms, _ = await runner.get_load()
+            assert replica_lag_ms == 0
+
+    assert [record.message for record in caplog.records] == [
+        "test: replay lag unknown for 1 replicas, not throttled on them"
+    ]
+
+    # chunks wait while the replicas lag or the primary is busy
+    loads = [(500.0, 0), (0.0, 500), (0.0, 0), (0.0, 0)]
+
+    async def get_load() -> tuple[float, int]:
+        return loads.pop(0)
+
+    runner.get_load = get_load
+    result = await runner.run(restart=True)
+    assert loads == [] and len(chunks) == 4
+    assert result["throttled_sec"] == pytest.approx(0.02)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_reconcile_counters(test_client: AsyncClient, app_instance: FastAPI, committed_post):
+    post_id, _ = committed_post
+
+    async with app_instance.state.db_engine.begin() as conn:
+        await conn.execute(update(Post).where(Post.id == post_id).values(upvote_count=3))
+
+    # repaired in chunks, each in its own transaction
+    response = await test_client.post("/db/counters")
+    assert response.status_code == 200
+    assert response.json() == {"post_count": 1, "comment_count": 0}
+
+    async with app_instance.state.db_session_factory() as db:
+        assert await db.scalar(select(Post.upvote_count).where(Post.id == post_id)) == 0
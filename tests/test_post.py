@@ -0,0 +1,68 @@
+import pytest
+from httpx import AsyncClient
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_post_counters(test_client: AsyncClient, created_user):
+    access_token, _, _ = created_user
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = await test_client.post("/subreddits", json={"name": "python"}, headers=headers)
+    assert response.status_code == 201
+    subreddit_id = response.json()["id"]
+
+    url = f"/subreddits/{subreddit_id}/posts"
+    body = [{"type": "text", "content": "hello"}]
+    response = await test_client.post(url, json={"title": "hello", "body": body}, headers=headers)
+    assert response.status_code == 201
+    post_id = response.json()["id"]
+    url = f"{url}/{post_id}"
+
+    # upvote
+    response = await test_client.post(f"{url}/upvote", json={"value": True}, headers=headers)
+    assert response.status_code == 201
+    response = await test_client.get(url)
+    assert response.json()["upvote_count"] == 1
+    assert response.json()["downvote_count"] == 0
+
+    # toggle to downvote
+    response = await test_client.patch(f"{url}/upvote", headers=headers)
+    assert response.status_code == 200
+    response = await test_client.get(url)
+    assert response.json()["upvote_count"] == 0
+    assert response.json()["downvote_count"] == 1
+
+    # remove vote
+    response = await test_client.delete(f"{url}/upvote", headers=headers)
+    assert response.status_code == 200
+    response = await test_client.get(url)
+    assert response.json()["downvote_count"] == 0
+
+    # set the vote, repeating it changes nothing
+    for _ in range(2):
+        response = await test_client.put(f"{url}/upvote", json={"value": False}, headers=headers)
+        assert response.status_code == 200
+        assert response.json() == {"upvote_count": 0, "downvote_count": 1}
+
+    response = await test_client.put(f"{url}/upvote", json={"value": None}, headers=headers)
+    assert response.json() == {"upvote_count": 0, "downvote_count": 0}
+
+    # comment and reply, deleting the parent removes both from the count
+    response = await test_client.post(
+        f"{url}/comments", json={"parent_comment_id": None, "body": body}, headers=headers
+    )
+    assert response.status_code == 201
+    comment_id = response.json()["id"]
+    response = await test_client.post(
+        f"{url}/comments", json={"parent_comment_id": comment_id, "body": body}, headers=headers
+    )
+    assert response.status_code == 201
+    response = await test_client.get(url)
+    assert response.json()["comment_count"] == 2
+    response = await test_client.get(f"{url}/comments/{comment_id}")
+    assert response.json()["reply_count"] == 1
+
+    response = await test_client.delete(f"{url}/comments/{comment_id}", headers=headers)
+    assert response.status_code == 200
+    response = await test_client.get(url)
+    assert response.json()["comment_count"] == 0
@@ -0,0 +1,127 @@
+import asyncio
+import pytest
+from app.rate_limit import RateLimiter
+from fastapi import FastAPI, Request
+from httpx import AsyncClient
+
+
+def create_rate_limiter(app: FastAPI, **kwargs) -> RateLimiter:
+    options = {"window_sec": 1, "ip_limit": 100, "user_limit": 100, "route_limits": {}}
+    options.update(kwargs)
+    return RateLimiter(redis=app.state.keyspaces["rate_limit"].redis, **options)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_token_bucket(app_instance: FastAPI):
+    rate_limiter = create_rate_limiter(app=app_instance)
+    key = "rate_limit:test:token_bucket"
+
+    for remaining in (2, 1, 0):
+        assert await rate_limiter.consume(key=key, limit=3) == (True, remaining)
+
+    assert await rate_limiter.consume(key=key, limit=3) == (False, 0)
+
+    # one token refills every window / limit
+    await asyncio.sleep(0.4)
+    assert await rate_limiter.consume(key=key, limit=3) == (True, 0)
+
+    # drain charges admitted requests even past the tokens left
+    allowed, remaining = await rate_limiter.consume(key=key, limit=3, cost=5, drain=True)
+    assert not allowed and remaining == 0
+
+    # the bucket expires once it would have refilled completely
+    redis = app_instance.state.keyspaces["rate_limit"].redis
+    assert 0 < await redis.pttl(key) <= 1000
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_rate_limit_middleware(
+    test_client: AsyncClient, app_instance: FastAPI, monkeypatch: pytest.MonkeyPatch
+):
+    route = "GET /subreddits/{subreddit_id}"
+    rate_limiter = create_rate_limiter(app=app_instance, window_sec=60, route_limits={route: 2})
+    monkeypatch.setattr(app_instance.state, "rate_limiter", rate_limiter)
+    await app_instance.state.keyspaces["rate_limit"].purge()
+
+    for remaining in ("1", "0"):
+        response = await test_client.get("/subreddits/0")
+        assert response.status_code == 404
+        assert response.headers["X-RateLimit-Limit"] == "2"
+        assert response.headers["X-RateLimit-Remaining"] == remaining
+
+    response = await test_client.get("/subreddits/0")
+    assert response.status_code == 429
+    assert response.headers["X-RateLimit-Remaining"] == "0"
+    assert response.headers["Retry-After"] == "30"
+
+    # other routes keep the client's own bucket
+    response = await test_client.get("/subreddits/0/posts/0")
+    assert response.status_code == 404
+    assert response.headers["X-RateLimit-Limit"] == "100"
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_local_bucket(app_instance: FastAPI):
+    rate_limiter = create_rate_limiter(
+        app=app_instance, window_sec=60, sync_batch=3, sync_ms=60_000
+    )
+    redis = app_instance.state.keyspaces["rate_limit"].redis
+    key = "rate_limit:test:local_bucket"
+
+    async def get_tokens() -> int:
+        return int(float(await redis.hget(key, "tokens")))
+
+    # the first request of a client goes to redis
+    assert await rate_limiter.allow_locally(key=key, limit=5) == (True, 4)
+    assert await get_tokens() == 4
+
+    # then requests are admitted locally and charged in batches of sync_batch
+    assert await rate_limiter.allow_locally(key=key, limit=5) == (True, 3)
+    assert await rate_limiter.allow_locally(key=key, limit=5) == (True, 2)
+    assert await get_tokens() == 4
+    assert await rate_limiter.allow_locally(key=key, limit=5) == (True, 1)
+    assert await get_tokens() == 1
+    assert rate_limiter.local_buckets[key].pending == 0
+
+    # running out of the local estimate syncs early, then rejects without redis
+    assert await rate_limiter.allow_locally(key=key, limit=5) == (True, 0)
+    assert await get_tokens() == 0
+    assert await rate_limiter.allow_locally(key=key, limit=5) == (False, 0)
+    assert rate_limiter.local_buckets[key].pending == 0
+
+    # local buckets are bounded, the least recently used one is dropped
+    rate_limiter.max_local_buckets = 1
+    await rate_limiter.allow_locally(key=f"{key}:other", limit=5)
+    assert list(rate_limiter.local_buckets) == [f"{key}:other"]
+    await redis.delete(key, f"{key}:other")
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_local_bucket_concurrent_sync(app_instance: FastAPI, monkeypatch: pytest.MonkeyPatch):
+    rate_limiter = create_rate_limiter(
+        app=app_instance, window_sec=60, ip_limit=5, sync_batch=3, sync_ms=60_000
+    )
+    redis = app_instance.state.keyspaces["rate_limit"].redis
+    consume = rate_limiter.consume
+    syncs = []
+
+    async def consume_slowly(**kwargs):
+        syncs.append(kwargs["cost"])
+        await asyncio.sleep(0.05)
+        return await consume(**kwargs)
+
+    monkeypatch.setattr(rate_limiter, "consume", consume_slowly)
+    request = Request(scope={"type": "http", "client": ("10.0.0.1", 0), "headers": []})
+
+    # requests arriving while a sync waits for redis are counted locally, not synced again
+    results = await asyncio.gather(*(rate_limiter.allow(request) for _ in range(20)))
+    assert syncs == [1]
+    assert sum(allowed for allowed, _, _ in results) == 5
+
+    # the drained bucket rejects without redis, the admitted ones are charged by the next sync
+    key = "rate_limit:ip:10.0.0.1"
+    assert await rate_limiter.allow(request) == (False, 5, 0)
+    await rate_limiter.sync(key=key, limit=5, local_bucket=rate_limiter.local_buckets[key])
+    assert syncs == [1, 4]
+    assert int(float(await redis.hget(key, "tokens"))) == 0
+    await redis.delete(key)
@@ -0,0 +1,22 @@
+import pytest
+from httpx import AsyncClient
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_create_subreddit(test_client: AsyncClient, created_user):
+    access_token, _, _ = created_user
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = await test_client.post("/subreddits", json={"name": "rust"}, headers=headers)
+    assert response.status_code == 201
+    assert response.json()["follower_count"] == 0
+    assert response.json()["user_display_name"] == "mike"
+
+    # the violated unique constraint is reported as the name being taken
+    response = await test_client.post("/subreddits", json={"name": "rust"}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["message"] == "Subreddit Name Arelady Exist!"
+
+    # the session is still usable after the violation
+    response = await test_client.post("/subreddits", json={"name": "go"}, headers=headers)
+    assert response.status_code == 201
@@ -0,0 +1,31 @@
+import pytest
+from httpx import AsyncClient
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_update_user(test_client: AsyncClient, created_user):
+    access_token, _, user = created_user
+    headers = {"Authorization": f"Bearer {access_token}"}
+    url = "/users/me"
+
+    other_user = {**user, "username": "john", "email": "john@gmail.com", "display_name": "john"}
+    response = await test_client.post("/auth/sign-up", json=other_user)
+    assert response.status_code == 201
+
+    # email already exist
+    response = await test_client.patch(url, json={"email": "john@gmail.com"}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["message"] == "Email Already Exist!"
+
+    # display name already exist
+    response = await test_client.patch(url, json={"display_name": "john"}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["message"] == "Display Name Already Exist!"
+
+    # user successfully updated
+    response = await test_client.patch(
+        url, json={"email": "mike2@gmail.com", "display_name": "mike2"}, headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json()["email"] == "mike2@gmail.com"
+    assert response.json()["display_name"] == "mike2"
@@ -0,0 +1,157 @@
+import pytest
+from app.db.schema import Post
+from app.vote.core import VoteBuffer
+from app.vote.services import apply_votes
+from fastapi import FastAPI
+from httpx import AsyncClient
+from sqlalchemy import select
+
+
+def create_vote_buffer(app: FastAPI, flush_batch_size: int = 1000) -> VoteBuffer:
+    return VoteBuffer(
+        redis=app.state.keyspaces["vote"].redis,
+        session_factory=app.state.db_session_factory,
+        cache=app.state.cache,
+        flush_interval_ms=500,
+        flush_batch_size=flush_batch_size,
+        state_ttl_sec=60,
+    )
+
+
+async def get_counters(app: FastAPI, post_id: int) -> tuple[int, int]:
+    async with app.state.db_session_factory() as db:
+        result = await db.execute(
+            select(Post.upvote_count, Post.downvote_count).where(Post.id == post_id)
+        )
+        return tuple(result.one())
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_vote_buffer_vote(app_instance: FastAPI, committed_post):
+    vote_buffer = create_vote_buffer(app=app_instance)
+    redis = vote_buffer.redis
+    post_id, (user_id, _) = committed_post
+
+    # the user's vote state is loaded from postgres on the first vote
+    keys = [f"vote:post:{post_id}", "vote:post:pending"]
+    assert await vote_buffer.vote_script(
+        keys=keys, args=[user_id, post_id, "set", "1", 60_000]
+    ) == [-1, ""]
+
+    async with app_instance.state.db_session_factory() as db:
+        votes = [
+            ({"value": True}, (True, True)),
+            ({"value": True}, (False, True)),
+            ({"toggle": True}, (True, False)),
+            ({"value": None}, (True, None)),
+            ({"toggle": True}, (False, None)),
+        ]
+
+        for kwargs, result in votes:
+            assert (
+                await vote_buffer.vote(
+                    target="post", target_id=post_id, user_id=user_id, db=db, **kwargs
+                )
+                == result
+            )
+
+        assert (
+            await vote_buffer.vote(target="post", target_id=0, user_id=user_id, db=db, value=True)
+            is None
+        )
+
+    # only the final state is pending
+    assert await redis.hgetall("vote:post:pending") == {f"{post_id}:{user_id}": "-"}
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_vote_buffer_flush(app_instance: FastAPI, committed_post):
+    vote_buffer = create_vote_buffer(app=app_instance)
+    redis = vote_buffer.redis
+    post_id, user_ids = committed_post
+
+    async with app_instance.state.db_session_factory() as db:
+        for user_id, value in zip(user_ids, (True, False)):
+            await vote_buffer.vote(
+                target="post", target_id=post_id, user_id=user_id, db=db, value=value
+            )
+
+    assert await get_counters(app=app_instance, post_id=post_id) == (0, 0)
+    assert await vote_buffer.flush("post") == 2
+    assert await get_counters(app=app_instance, post_id=post_id) == (1, 1)
+    assert not await redis.exists("vote:post:pending", "vote:post:processing")
+    assert await vote_buffer.flush("post") == 0
+
+    # a processing key left by a flush that died after committing is replayed without effect
+    await redis.hset("vote:post:processing", mapping={f"{post_id}:{user_ids[0]}": "1"})
+    assert await vote_buffer.flush("post") == 1
+    assert await get_counters(app=app_instance, post_id=post_id) == (1, 1)
+    assert not await redis.exists("vote:post:processing")
+
+    # a flush held by another worker is skipped
+    await redis.set("vote:post:flush_lock", "other", px=60_000)
+    await redis.hset("vote:post:pending", mapping={f"{post_id}:{user_ids[0]}": "-"})
+    assert await vote_buffer.flush("post") == 0
+    assert await redis.get("vote:post:flush_lock") == "other"
+    await redis.delete("vote:post:flush_lock")
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_vote_buffer_lost_lock(
+    app_instance: FastAPI, committed_post, monkeypatch: pytest.MonkeyPatch
+):
+    vote_buffer = create_vote_buffer(app=app_instance, flush_batch_size=1)
+    redis = vote_buffer.redis
+    post_id, user_ids = committed_post
+    await redis.hset(
+        "vote:post:pending", mapping={f"{post_id}:{user_id}": "1" for user_id in user_ids}
+    )
+
+    # the lock expires while the first batch runs and another worker takes it
+    async def apply_votes_slowly(**kwargs):
+        await redis.set("vote:post:flush_lock", "other")
+        return await apply_votes(**kwargs)
+
+    monkeypatch.setattr("app.vote.core.apply_votes", apply_votes_slowly)
+
+    # the flush stops before the second batch and leaves the votes for the next flush
+    assert await vote_buffer.flush("post") == 1
+    assert await get_counters(app=app_instance, post_id=post_id) == (1, 0)
+    assert await redis.hlen("vote:post:processing") == 2
+    assert await redis.get("vote:post:flush_lock") == "other"
+
+    monkeypatch.setattr("app.vote.core.apply_votes", apply_votes)
+    await redis.delete("vote:post:flush_lock")
+    assert await vote_buffer.flush("post") == 2
+    assert await get_counters(app=app_instance, post_id=post_id) == (2, 0)
+    assert not await redis.exists("vote:post:processing")
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_write_behind_vote_routes(
+    test_client: AsyncClient, app_instance: FastAPI, created_user, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(app_instance.state, "vote_buffer", create_vote_buffer(app=app_instance))
+    access_token, _, _ = created_user
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = await test_client.post("/subreddits", json={"name": "python"}, headers=headers)
+    url = f"/subreddits/{response.json()['id']}/posts"
+    body = [{"type": "text", "content": "hello"}]
+    response = await test_client.post(url, json={"title": "hello", "body": body}, headers=headers)
+    url = f"{url}/{response.json()['id']}"
+    response = await test_client.post(
+        f"{url}/comments", json={"parent_comment_id": None, "body": body}, headers=headers
+    )
+    comment_url = f"{url}/comments/{response.json()['id']}"
+
+    # the counters returned include the vote before it is flushed to postgres
+    for target_url in (url, comment_url):
+        for value, counters in ((True, (1, 0)), (True, (1, 0)), (False, (0, 1)), (None, (0, 0))):
+            response = await test_client.put(
+                f"{target_url}/upvote", json={"value": value}, headers=headers
+            )
+            assert response.status_code == 200
+            assert response.json() == {"upvote_count": counters[0], "downvote_count": counters[1]}
+
+    await app_instance.state.keyspaces["vote"].purge()